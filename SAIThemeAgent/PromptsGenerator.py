@@ -1,16 +1,74 @@
 import json
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Union, List, Dict, Optional
+from typing import Union, List, Dict, Optional, Callable
 import argparse
+import codecs
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from json_stream import JSONStreamValidator, RESULT_SCHEMA, BATCH_SCHEMA
+from llm_cache import LLMCache
+from result_checkpoint import ResultCheckpoint
+from text_dedup import NearDuplicateFilter
+from prompt_corpus import PromptCorpus
+import metrics
+
+# 需要退避重试的HTTP状态码
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 批量模式下追加在描述列表前的说明
+BATCH_INSTRUCTION = (
+    "Process each of the following {count} image descriptions independently, following all the rules above. "
+    "Return a JSON array with exactly one result object per description, in the same order. "
+    "Copy each description verbatim into the \"original_prompt\" field of its result.\n"
+)
+
+# 图片信息中存放描述的字段：爬虫写入description，早期的image_info.json使用prompt
+DESCRIPTION_FIELDS = ("description", "prompt")
+
+def get_description(item: Dict) -> str:
+    """从爬虫输出的图片信息中取出描述，字段名只在这里统一"""
+    for field in DESCRIPTION_FIELDS:
+        value = item.get(field)
+        if isinstance(value, str) and value.strip():
+            return value.strip()
+    return ""
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符按1个计，其余按4个字符1个计"""
+    cjk = sum(1 for ch in text if '\u3040' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af')
+    return cjk + (len(text) - cjk) // 4 + 1
+
+# 批量结果中每条除回显的original_prompt外的估算输出token数，按已有结果的p95（约280）留出余量
+OUTPUT_TOKENS_PER_ITEM = 400
 
 class LLMClient:
-    def __init__(self, request_timeout: int, model: str):
-        """初始化LLM客户端"""
+    def __init__(self, request_timeout: int, model: str, max_retries: int = 3,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 cache: Optional[LLMCache] = None, bypass_cache: bool = False, stream: bool = False):
+        """初始化LLM客户端
+
+        stream为True时以流式方式读取响应，边接收边做增量JSON校验，
+        输出一旦不可能构成合法结果就断开连接并重试，不必等待生成结束
+        """
         self.model = model
+        self.stream = stream
+        self.cache = cache
+        self.bypass_cache = bypass_cache  # 为True时不读缓存，但成功结果仍会写入
         self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # 单次响应的输出token上限，批量模式据此限制每批条数
+        self.max_tokens = 1024 * 8
+        # 线程间共享keep-alive连接，连接池需容纳并发请求数
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=64))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=64))
         self._setup_url_and_token()
         
     def _setup_url_and_token(self):
@@ -23,46 +81,205 @@ class LLMClient:
         self.url = model_urls.get(self.model)
         self.access_token = ""  # 需要设置访问令牌
         
-    def get_response_text(self, prompt: str) -> str:
-        """获取LLM响应"""
-        if not self.access_token:
-            raise ValueError("access_token is empty")
-            
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": self.access_token
-        }
-        
-        data = {
+    def _build_request_data(self, prompt: str) -> Dict:
+        """构建请求体"""
+        return {
             "prompt": prompt,
             "temperature": 0.8,
-            "max_tokens": 1024 * 8,
+            "max_tokens": self.max_tokens,
             "top_p": 1,
             "frequency_penalty": 0.0,
             "presence_penalty": 0.0,
             "stop": ["```", "<|im_end|>"]
         }
+
+    def get_response_text(self, prompt: str, validator: Optional[Callable[[str], bool]] = None,
+                          stream_schema: Optional[Dict] = None) -> str:
+        """获取LLM响应，只有通过validator校验的响应才会写入缓存
+
+        启用流式模式且给出stream_schema时按该schema（见json_stream.py）增量校验
+        """
+        data = self._build_request_data(prompt)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = LLMCache.make_key(self.model, {"url": self.url, **data})
+            if not self.bypass_cache:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    metrics.inc("llm_cache_lookups_total", model=self.model, result="hit")
+                    return cached
+                metrics.inc("llm_cache_lookups_total", model=self.model, result="miss")
+
+        if self.stream and stream_schema is not None:
+            response_text = self._request_stream(data, stream_schema)
+        else:
+            response_text = self._request(data)
+        if cache_key and response_text and (validator is None or validator(response_text)):
+            self.cache.put(cache_key, response_text)
+        return response_text
+
+    def _request(self, data: Dict) -> str:
+        """发送请求，失败时指数退避重试"""
+        if not self.access_token:
+            raise ValueError("access_token is empty")
+            
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": self.access_token
+        }
         
-        for _ in range(3):
+        for attempt in range(self.max_retries):
+            retry_after = None
             try:
-                response = requests.post(
-                    self.url,
-                    headers=headers,
-                    json=data,
-                    timeout=self.request_timeout
-                )
+                with metrics.timer("llm_request_seconds", model=self.model):
+                    response = self.session.post(
+                        self.url,
+                        headers=headers,
+                        json=data,
+                        timeout=self.request_timeout
+                    )
+                metrics.inc("llm_requests_total", model=self.model, status=response.status_code)
                 if response.status_code == 200:
                     return response.text
+                if response.status_code not in RETRY_STATUS_CODES:
+                    print(f"Request failed: {response.status_code}")
+                    return ""
+                retry_after = response.headers.get("Retry-After")
+                print(f"Request returned {response.status_code}, retrying")
             except Exception as e:
+                metrics.inc("llm_requests_total", model=self.model, status="error")
                 print(f"Request error: {e}")
-                continue
+            if attempt < self.max_retries - 1:
+                metrics.inc("llm_retries_total", model=self.model)
+                time.sleep(self._backoff_delay(attempt, retry_after))
+        return ""
+
+    def _request_stream(self, data: Dict, schema: Dict) -> str:
+        """流式请求：边接收边校验，确定无法得到合法结果时立即断开连接重试，HTTP错误时指数退避重试"""
+        if not self.access_token:
+            raise ValueError("access_token is empty")
+
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+            "x-api-key": self.access_token
+        }
+
+        for attempt in range(self.max_retries):
+            retry_after = None
+            cancelled = False
+            start = time.perf_counter()
+            try:
+                # 读取超时按两次数据之间的间隔计算，总耗时在_read_stream中检查
+                with self.session.post(self.url, headers=headers, json=dict(data, stream=True),
+                                       timeout=self.request_timeout, stream=True) as response:
+                    metrics.inc("llm_requests_total", model=self.model, status=response.status_code)
+                    if response.status_code == 200:
+                        text, error = self._read_stream(response, JSONStreamValidator(schema), start)
+                        if error is None:
+                            return text
+                        # 离开with时关闭连接，服务端随之停止生成
+                        cancelled = True
+                        metrics.inc("llm_stream_cancels_total", model=self.model)
+                        print(f"流式响应无法构成合法结果，已取消: {error}")
+                    elif response.status_code not in RETRY_STATUS_CODES:
+                        print(f"Request failed: {response.status_code}")
+                        return ""
+                    else:
+                        retry_after = response.headers.get("Retry-After")
+                        print(f"Request returned {response.status_code}, retrying")
+            except Exception as e:
+                metrics.inc("llm_requests_total", model=self.model, status="error")
+                print(f"Request error: {e}")
+            finally:
+                metrics.observe("llm_request_seconds", time.perf_counter() - start, model=self.model)
+            if attempt < self.max_retries - 1:
+                metrics.inc("llm_retries_total", model=self.model)
+                # 输出不合格时服务端并无压力，立即重新生成
+                if not cancelled:
+                    time.sleep(self._backoff_delay(attempt, retry_after))
         return ""
 
+    def _read_stream(self, response, validator: JSONStreamValidator, start: float):
+        """读取流式响应并逐段校验，返回 (结果文本, 错误信息)；结果完整时不再读取剩余内容"""
+        parts = []
+        deadline = start + self.request_timeout
+        for text in self._iter_stream_text(response):
+            if not text:
+                continue
+            if not parts:
+                metrics.observe("llm_ttft_seconds", time.perf_counter() - start, model=self.model)
+            parts.append(text)
+            if not validator.feed(text):
+                return "", validator.error
+            if validator.complete:
+                break
+            if time.perf_counter() > deadline:
+                return "", f"超过{self.request_timeout}秒仍未得到完整结果"
+        complete, error = validator.finish()
+        if not complete:
+            return "", error
+        metrics.observe("llm_time_to_valid_seconds", time.perf_counter() - start, model=self.model)
+        return "".join(parts)[:validator.end], None
+
+    def _iter_stream_text(self, response):
+        """按到达顺序产出增量文本：text/event-stream按SSE事件解析，否则按分块传输的原始文本"""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        if "text/event-stream" not in response.headers.get("Content-Type", ""):
+            for chunk in response.iter_content(chunk_size=None):
+                yield decoder.decode(chunk)
+            yield decoder.decode(b"", final=True)
+            return
+        buffer = ""
+        for chunk in response.iter_content(chunk_size=None):
+            buffer += decoder.decode(chunk)
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                line = line.rstrip("\r")
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:]
+                if payload.startswith(" "):
+                    payload = payload[1:]
+                if payload.strip() == "[DONE]":
+                    return
+                yield self._sse_text(payload)
+
+    @staticmethod
+    def _sse_text(payload: str) -> str:
+        """取出SSE事件中的增量文本，兼容 choices[0].delta.content、choices[0].text 与纯文本事件"""
+        try:
+            event = json.loads(payload)
+        except json.JSONDecodeError:
+            return payload
+        if isinstance(event, str):
+            return event
+        if not isinstance(event, dict):
+            return payload
+        choices = event.get("choices")
+        if choices and isinstance(choices[0], dict):
+            delta = choices[0].get("delta") or {}
+            return delta.get("content") or choices[0].get("text") or ""
+        return event.get("content") or event.get("text") or ""
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """指数退避加全抖动，优先使用服务端的Retry-After"""
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
 class PromptGenerator:
-    def __init__(self, system_prompt_file: str, llm_client: LLMClient):
-        """初始化提示生成器"""
+    def __init__(self, system_prompt_file: str, llm_client: LLMClient,
+                 batch_token_budget: Optional[int] = None, batch_max_items: int = 16):
+        """初始化提示生成器
+
+        batch_token_budget不为空时启用批量模式：多条描述打包进一次请求，
+        描述部分的估算token数不超过该预算，估算的输出不超过llm_client.max_tokens，每批最多batch_max_items条
+        """
         self.system_prompt = self._read_system_prompt(system_prompt_file)
         self.llm_client = llm_client
+        self.batch_token_budget = batch_token_budget
+        self.batch_max_items = batch_max_items
         
     def _read_system_prompt(self, file_path: str) -> str:
         """读取系统提示文件"""
@@ -73,21 +290,140 @@ class PromptGenerator:
         """格式化输入提示"""
         return f"{description}"
         
-    def generate_from_json(self, json_file: str) -> List[Dict]:
-        """从JSON文件生成提示"""
+    def generate_from_json(self, json_file: str, concurrency: int = 1,
+                           checkpoint: Optional[ResultCheckpoint] = None,
+                           resume: bool = False,
+                           dedup_filter: Optional[NearDuplicateFilter] = None) -> List[Dict]:
+        """从JSON文件生成提示，concurrency大于1时并发请求，结果保持输入顺序
+
+        resume为True时跳过检查点中已有的描述，只生成剩余部分；
+        传入dedup_filter时近似重复的描述只请求一次，组内其余描述复用代表描述的结果
+        """
         with open(json_file, 'r', encoding='utf-8') as f:
             data = json.load(f)
             
-        results = []
+        descriptions = []
         for item in data:
-            # 从prompt字段获取描述
-            if 'prompt' in item and item['prompt']:
-                result = self.generate_single_prompt(item['prompt'])
-                results.append(result)
-                print(f"处理描述: {item['prompt'][:50]}...")
+            description = get_description(item)
+            if description:
+                descriptions.append(description)
             else:
                 print(f"跳过无效描述项: {item}")
+
+        done = checkpoint.load() if checkpoint and resume else {}
+        todo = [description for description in dict.fromkeys(descriptions) if description not in done]
+        if done:
+            print(f"从检查点恢复 {len(done)} 条，剩余 {len(todo)} 条待生成")
+        if dedup_filter is not None:
+            new_results = self.generate_deduplicated(todo, dedup_filter, concurrency, checkpoint)
+        else:
+            new_results = dict(zip(todo, self.generate_batch(todo, concurrency, checkpoint)))
+        return [new_results[d] if d in new_results else done[d] for d in descriptions]
+
+    def generate_deduplicated(self, descriptions: List[str], dedup_filter: NearDuplicateFilter,
+                              concurrency: int = 1,
+                              checkpoint: Optional[ResultCheckpoint] = None) -> Dict[str, Dict]:
+        """近似重复的描述归为一组，每组只把代表描述发给LLM，返回 描述 -> 结果"""
+        representatives, groups = dedup_filter.dedup(descriptions)
+        print(f"近似去重: {len(descriptions)} 条描述归为 {len(representatives)} 组，"
+              f"节省 {len(descriptions) - len(representatives)} 次LLM调用")
+
+        results = {}
+        for representative, result in zip(representatives,
+                                           self.generate_batch(representatives, concurrency, checkpoint)):
+            for description in groups[representative]:
+                if description == representative:
+                    results[description] = result
+                    continue
+                duplicate = dict(result, original_prompt=description, duplicate_of=representative)
+                if checkpoint is not None:
+                    checkpoint.append(description, duplicate)
+                results[description] = duplicate
         return results
+
+    def retry_failed(self, checkpoint: ResultCheckpoint, concurrency: int = 1) -> List[Dict]:
+        """只重新生成检查点中失败的条目，返回检查点中的全部结果"""
+        done = checkpoint.load()
+        failed = [description for description, result in done.items() if checkpoint.is_failed(result)]
+        print(f"检查点中共 {len(done)} 条，其中失败 {len(failed)} 条，开始重试")
+        done.update(zip(failed, self.generate_batch(failed, concurrency, checkpoint)))
+        return list(done.values())
+
+    def generate_batch(self, descriptions: List[str], concurrency: int = 1,
+                       checkpoint: Optional[ResultCheckpoint] = None) -> List[Dict]:
+        """批量生成提示，每条结果生成后立即写入检查点，结束时输出吞吐与延迟分位数"""
+        latencies = []
+
+        def timed_generate(chunk: List[str]) -> List[Dict]:
+            start = time.perf_counter()
+            results = self.generate_chunk(chunk)
+            latencies.append(time.perf_counter() - start)
+            for description, result in zip(chunk, results):
+                metrics.inc("prompt_results_total",
+                            result="failed" if ResultCheckpoint.is_failed(result) else "ok")
+                if checkpoint is not None:
+                    checkpoint.append(description, result)
+                print(f"处理描述: {description[:50]}...")
+            return results
+
+        chunks = self._pack_batches(descriptions)
+        start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                chunk_results = list(executor.map(timed_generate, chunks))
+        else:
+            chunk_results = [timed_generate(chunk) for chunk in chunks]
+        self._report_stats(latencies, time.perf_counter() - start)
+        return [result for results in chunk_results for result in results]
+
+    def generate_chunk(self, chunk: List[str]) -> List[Dict]:
+        """生成一批描述的结果，单条时单独请求，多条时打包为一次批量请求"""
+        if len(chunk) == 1:
+            return [self.generate_single_prompt(chunk[0])]
+        return self.generate_multi_prompt(chunk)
+
+    def _pack_batches(self, descriptions: List[str]) -> List[List[str]]:
+        """按token预算和条数上限将描述顺序打包，未启用批量模式时每条单独一批"""
+        if not self.batch_token_budget:
+            return [[description] for description in descriptions]
+        chunks, current = [], []
+        for description in descriptions:
+            if current and not self.batch_has_room(current, description):
+                chunks.append(current)
+                current = []
+            current.append(description)
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def batch_has_room(self, chunk: List[str], description: str) -> bool:
+        """批次中再加入description后是否仍在条数上限、描述token预算和输出token上限之内
+
+        输出按每条回显描述加OUTPUT_TOKENS_PER_ITEM估算，超出max_tokens的批量响应会被截断，整批退回逐条请求
+        """
+        if len(chunk) >= self.batch_max_items:
+            return False
+        used = sum(estimate_tokens(item) for item in chunk) + estimate_tokens(description)
+        output = used + OUTPUT_TOKENS_PER_ITEM * (len(chunk) + 1)
+        return used <= self.batch_token_budget and output <= self.llm_client.max_tokens
+
+    @staticmethod
+    def _percentile(values: List[float], percent: float) -> float:
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered))) - 1))
+        return ordered[index]
+
+    def _report_stats(self, latencies: List[float], elapsed: float):
+        """输出吞吐量与延迟分位数"""
+        if not latencies:
+            return
+        print(f"共处理 {len(latencies)} 条，耗时 {elapsed:.1f} 秒，吞吐 {len(latencies) / elapsed:.2f} 条/秒")
+        print("延迟 p50={:.1f}s p95={:.1f}s p99={:.1f}s max={:.1f}s".format(
+            self._percentile(latencies, 50),
+            self._percentile(latencies, 95),
+            self._percentile(latencies, 99),
+            max(latencies)
+        ))
         
     def generate_from_input(self, description: str) -> Dict:
         """从用户输入生成提示"""
@@ -100,8 +436,9 @@ class PromptGenerator:
             format_description = self._format_input_prompt(description)
             full_prompt = self.system_prompt.replace("MESSAGE", format_description)
             
-            # 调用LLM获取响应
-            response = self.llm_client.get_response_text(full_prompt)
+            # 调用LLM获取响应，无法解析的响应不会进入缓存
+            response = self.llm_client.get_response_text(full_prompt, validator=self._is_valid_response,
+                                                         stream_schema=RESULT_SCHEMA)
             if not response:
                 raise Exception("LLM返回空响应")
             
@@ -116,6 +453,65 @@ class PromptGenerator:
             print(f"处理错误: {e}")
             return self._get_error_result(description)
             
+    def _format_batch_prompt(self, descriptions: List[str]) -> str:
+        """将多条描述编号后拼成一条输入"""
+        lines = [BATCH_INSTRUCTION.format(count=len(descriptions))]
+        for index, description in enumerate(descriptions, 1):
+            lines.append(f"{index}. {json.dumps(self._format_input_prompt(description), ensure_ascii=False)}")
+        return "\n".join(lines)
+
+    def generate_multi_prompt(self, descriptions: List[str]) -> List[Dict]:
+        """一次请求生成多条提示，按original_prompt匹配结果，缺失的条目单独重试"""
+        matched = {}
+        try:
+            full_prompt = self.system_prompt.replace("MESSAGE", self._format_batch_prompt(descriptions))
+            response = self.llm_client.get_response_text(full_prompt, validator=self._is_valid_batch_response,
+                                                         stream_schema=BATCH_SCHEMA)
+            if not response:
+                raise Exception("LLM返回空响应")
+            for item in self._parse_batch_response(response):
+                original = item.get("original_prompt")
+                if isinstance(original, str):
+                    matched.setdefault(original.strip(), item)
+        except Exception as e:
+            print(f"批量处理错误: {e}")
+
+        results = []
+        for description in descriptions:
+            result = matched.get(description.strip())
+            if result is None:
+                # 部分返回或格式错误时，缺失的描述单独请求
+                print(f"批量结果缺失，单独重试: {description[:50]}...")
+                result = self.generate_single_prompt(description)
+            else:
+                result = dict(result, original_prompt=description)
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _parse_batch_response(response: str) -> List[Dict]:
+        """解析批量响应，兼容 {"results": [...]} 这类包了一层的返回"""
+        data = json.loads(response)
+        if isinstance(data, dict):
+            data = next((value for value in data.values() if isinstance(value, list)), [data])
+        return [item for item in data if isinstance(item, dict) and item.get("inspired_prompt")]
+
+    @classmethod
+    def _is_valid_batch_response(cls, response: str) -> bool:
+        try:
+            return bool(cls._parse_batch_response(response))
+        except (json.JSONDecodeError, AttributeError, TypeError):
+            return False
+
+    @staticmethod
+    def _is_valid_response(response: str) -> bool:
+        """响应能解析为包含inspired_prompt的JSON对象"""
+        try:
+            result = json.loads(response)
+        except json.JSONDecodeError:
+            return False
+        return isinstance(result, dict) and bool(result.get("inspired_prompt"))
+
     def _get_error_result(self, description: str) -> Dict:
         """返回错误结果的统一格式"""
         return {
@@ -175,6 +571,31 @@ def main():
     parser.add_argument('--system_prompt', type=str, default='prompt_inspiration.md',
                       help='系统提示文件路径')
     parser.add_argument('--timeout', type=int, default=420, help='请求超时时间')
+    parser.add_argument('--concurrency', type=int, default=1, help='并发请求数')
+    parser.add_argument('--max_retries', type=int, default=3, help='单条请求最大尝试次数')
+    parser.add_argument('--cache_file', type=str, default='llm_cache.db', help='LLM响应缓存文件')
+    parser.add_argument('--cache_max_mb', type=int, default=512, help='缓存容量上限（MB）')
+    parser.add_argument('--cache_max_age_days', type=float, default=30, help='缓存有效期（天）')
+    parser.add_argument('--no_cache', action='store_true', help='不读取缓存，强制重新请求')
+    parser.add_argument('--checkpoint_file', type=str, default=None,
+                      help='逐条写入结果的JSONL检查点，默认为 <output_file>l')
+    parser.add_argument('--resume', action='store_true', help='跳过检查点中已生成的描述')
+    parser.add_argument('--overwrite', action='store_true',
+                      help='检查点已存在且未指定--resume时清空后重新生成，默认拒绝运行以免覆盖已有结果')
+    parser.add_argument('--retry_failed', action='store_true', help='只重试检查点中失败的条目')
+    parser.add_argument('--compact', action='store_true', help='将检查点压缩为输出JSON文件后退出')
+    parser.add_argument('--dedup_threshold', type=float, default=None,
+                      help='近似重复描述的Jaccard相似度阈值（如0.8），默认不去重')
+    parser.add_argument('--batch_token_budget', type=int, default=None,
+                      help='批量模式下每次请求中描述部分的token预算，默认不启用批量模式')
+    parser.add_argument('--batch_max_items', type=int, default=16,
+                      help='批量模式下每次请求的最大描述数，另受LLM单次输出token上限约束')
+    parser.add_argument('--stream', action='store_true',
+                      help='流式读取LLM响应，输出无法构成合法JSON时提前取消并重试')
+    parser.add_argument('--corpus_dir', type=str, default=None,
+                      help='生成完成后将结果增量导入该列式分析库目录，见 prompt_corpus.py')
+    parser.add_argument('--metrics_json', type=str, default=None, help='退出时写入指标汇总的JSON文件')
+    parser.add_argument('--metrics_prom', type=str, default=None, help='退出时写入的Prometheus文本文件')
     parser.add_argument('--model', type=str, default='gpt4o', 
                       choices=['deucalion', 'gpt4turbo', 'gpt4o'],
                       help='使用的模型')
@@ -184,23 +605,56 @@ def main():
                       help='Output file for valid prompts')
     
     args = parser.parse_args()
+    if args.metrics_json or args.metrics_prom:
+        metrics.enable(json_file=args.metrics_json, prom_file=args.metrics_prom)
     
     # Initialize LLM client
-    llm_client = LLMClient(args.timeout, args.model)
+    cache = LLMCache(
+        args.cache_file,
+        max_bytes=args.cache_max_mb * 1024 * 1024,
+        max_age=args.cache_max_age_days * 24 * 3600
+    )
+    llm_client = LLMClient(args.timeout, args.model, max_retries=args.max_retries,
+                           cache=cache, bypass_cache=args.no_cache, stream=args.stream)
     
     # Initialize generator
-    generator = PromptGenerator(args.system_prompt, llm_client)
+    generator = PromptGenerator(args.system_prompt, llm_client,
+                                batch_token_budget=args.batch_token_budget,
+                                batch_max_items=args.batch_max_items)
+    
+    checkpoint = ResultCheckpoint(args.checkpoint_file or args.output_file + 'l')
     
     if args.extract_prompts:
         generator.extract_valid_prompts(args.output_file, args.valid_prompts_file)
-    elif args.input_type == 'json':
-        # 从JSON文件生成
-        results = generator.generate_from_json(args.json_file)
+    elif args.compact:
+        count = checkpoint.compact(args.output_file)
+        print(f"已将检查点中的 {count} 条结果压缩到 {args.output_file}")
+    elif args.retry_failed or args.input_type == 'json':
+        if args.retry_failed:
+            results = generator.retry_failed(checkpoint, concurrency=args.concurrency)
+        else:
+            if not args.resume:
+                if checkpoint.has_records() and not args.overwrite:
+                    parser.error(f"检查点 {checkpoint.path} 已有结果，继续生成请加 --resume，清空重新生成请加 --overwrite")
+                checkpoint.reset()
+            # 从JSON文件生成，每条结果即时写入检查点
+            dedup_filter = NearDuplicateFilter(args.dedup_threshold) if args.dedup_threshold else None
+            results = generator.generate_from_json(args.json_file, concurrency=args.concurrency,
+                                                   checkpoint=checkpoint, resume=args.resume,
+                                                   dedup_filter=dedup_filter)
         
-        # 保存结果
-        with open(args.output_file, 'w', encoding='utf-8') as f:
+        # 保存结果，先写临时文件再替换
+        tmp_file = args.output_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(results, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, args.output_file)
         print(f"已生成 {len(results)} 个提示并保存到 {args.output_file}")
+        if args.corpus_dir:
+            corpus = PromptCorpus(args.corpus_dir)
+            added = corpus.ingest(args.output_file)
+            print(f"已将 {added} 条新结果导入分析库 {args.corpus_dir}，共 {len(corpus)} 条")
+        stats = cache.stats()
+        print(f"缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次，命中率 {stats['hit_rate']:.0%}")
     else:
         # 手动输入模式
         while True:
@@ -210,6 +664,7 @@ def main():
             result = generator.generate_from_input(description)
             print("\n生成的提示:")
             print(json.dumps(result, ensure_ascii=False, indent=2))
+    cache.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,118 @@
+import os
+from download_engine import DownloadEngine
+from metadata_store import MetadataStore
+from image_store import ImageStore, guess_extension
+import metrics
+
+
+class BaseSpider:
+    """两个爬虫共用的部分：下载入库、近似重复判断、元数据写入与资源释放
+
+    name为爬虫名，用于日志和指标中的spider标签；子类负责列表页的抓取与解析
+    """
+
+    def __init__(self, name, headers, save_dir, engine=None, image_store=None, revalidate=False,
+                 dedup_index=None, image_sink=None, metadata_options=None):
+        self.name = name
+        self.headers = headers
+        self.save_dir = save_dir
+        # 共享下载引擎，未传入时自行创建
+        self._owns_engine = engine is None
+        self.engine = engine or DownloadEngine(headers=self.headers)
+        self.metadata = None
+        # 全局内容寻址图片库，跨批次、跨爬虫去重
+        self._owns_image_store = image_store is None
+        self.image_store = image_store or ImageStore()
+        # 为True时已收录的图片也发起条件请求，服务端返回304则直接复用
+        self.revalidate = revalidate
+        # 感知哈希索引（image_hash.PerceptualIndex），传入时下载入库后丢弃近似重复的图片
+        self.dedup_index = dedup_index
+        # 元数据写入后回调image_sink(img_info)，流水线借此把描述实时交给提示生成
+        self.image_sink = image_sink
+        # 传给MetadataStore的参数，如多主机共享目录时的journal_mode与batch_size
+        self.metadata_options = metadata_options or {}
+
+    def create_save_dir(self):
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+
+    def download_image(self, img_url, task_id):
+        try:
+            # 同一张图片同时只有一个下载，其他线程、进程或主机在此等待
+            with self.image_store.temp_file(task_id) as tmp_path:
+                stored = task_id in self.image_store
+                if stored and not self.revalidate:
+                    # 等待期间其他下载已收录这张图片
+                    status = 'linked'
+                else:
+                    status = self._download_to_store(img_url, task_id, tmp_path, stored)
+            metrics.inc("spider_images_total", spider=self.name, result=status)
+            if status in ('ok', 'not_modified', 'linked'):
+                if self.is_near_duplicate(task_id):
+                    return False
+                return self.image_store.link(task_id, self.save_dir) is not None
+        except Exception as e:
+            print(f"下载图片失败: {str(e)}")
+        return False
+
+    def _download_to_store(self, img_url, task_id, tmp_path, stored):
+        """下载到临时文件并收录到全局图片库，返回下载状态；调用方需持有temp_file"""
+        # 已收录的图片带上校验值发送条件请求，未修改时服务端返回304
+        validators = self.image_store.get_validators(img_url) if stored else {}
+        # 流式写入临时文件，保留原始字节，转码由transcoder.py离线处理
+        with metrics.timer("spider_image_download_seconds", spider=self.name):
+            result = self.engine.download(img_url, tmp_path, **validators)
+        if result['status'] == 'ok':
+            metrics.inc("spider_download_bytes_total", result['bytes'] or 0, spider=self.name)
+            with open(tmp_path, 'rb') as f:
+                head = f.read(16)
+            ext = guess_extension(result['content_type'], img_url, head)
+            # 写入全局图片库后链接到本批次目录
+            path = self.image_store.put_file(task_id, tmp_path, ext)
+            self.image_store.set_validators(img_url, result['etag'], result['last_modified'])
+            # 计算感知哈希并收录，与已有图片近似重复的不放入批次目录，也不在全局图片库中保留
+            if self.dedup_index is not None and self.dedup_index.check_file(task_id, path) is not None:
+                self.image_store.remove(task_id)
+        return result['status']
+
+    def is_near_duplicate(self, task_id):
+        """启用感知哈希去重时，判断task_id是否已被判定为其他图片的近似重复"""
+        if self.dedup_index is None:
+            return False
+        duplicate_of = self.dedup_index.duplicate_of(task_id)
+        if duplicate_of is None:
+            return False
+        print(f"图片 {task_id} 与 {duplicate_of} 近似重复，跳过")
+        metrics.inc("spider_images_total", spider=self.name, result="near_duplicate")
+        return True
+
+    def get_metadata_store(self):
+        """获取当前保存目录对应的元数据存储"""
+        if self.metadata is None or self.metadata.save_dir != self.save_dir:
+            if self.metadata is not None:
+                self.metadata.close()
+            self.metadata = MetadataStore(self.save_dir, **self.metadata_options)
+        return self.metadata
+
+    def save_image_info(self, img_info):
+        try:
+            # 追加写入并按task_id去重，image_info.json在close时导出
+            with metrics.timer("spider_metadata_write_seconds", spider=self.name):
+                added = self.get_metadata_store().add(img_info)
+            if not added:
+                print(f"图片 {img_info['task_id']} 信息已存在，跳过保存")
+            elif self.image_sink is not None:
+                self.image_sink(img_info)
+
+        except Exception as e:
+            print(f"保存图片信息失败: {str(e)}")
+
+    def close(self):
+        """导出元数据并释放自行创建的下载引擎和图片库"""
+        if self.metadata is not None:
+            self.metadata.close()
+            self.metadata = None
+        if self._owns_engine:
+            self.engine.close()
+        if self._owns_image_store:
+            self.image_store.close()
@@ -0,0 +1,323 @@
+"""离线压测：启动本地替身服务，测量爬虫、元数据写入与提示生成的吞吐和延迟
+
+用法（在 SAIThemeAgent 目录下运行）:
+    python benchmarks/run_benchmarks.py --output bench_results.json
+    python benchmarks/run_benchmarks.py --only miaohua_crawl --compare bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stand_ins import StandInServer, GalleryHandler, RecraftFeedHandler, ImageHandler, LLMHandler
+from download_engine import DownloadEngine
+from image_store import ImageStore
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），Linux下ru_maxrss单位为KB，macOS为字节"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timed(func, latencies):
+    """包装函数，记录每次调用的耗时"""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def make_engine(args):
+    return DownloadEngine(max_workers=args.workers, rate_per_host=args.rate_per_host)
+
+
+def bench_miaohua_crawl(args, servers, work_dir):
+    """逐页调用 MiaohuaSpider.crawl，延迟为单张图片的下载耗时"""
+    from miaohua_spider import MiaohuaSpider
+
+    engine = make_engine(args)
+    store = ImageStore(os.path.join(work_dir, 'image_store'))
+    spider = MiaohuaSpider(engine=engine, image_store=store)
+    spider.base_url = servers['gallery'].base_url + '/api/v2/public/gallery'
+    spider.save_dir = os.path.join(work_dir, 'miaohua')
+    spider.create_save_dir()
+    latencies = []
+    spider.download_image = timed(spider.download_image, latencies)
+
+    items = 0
+    start = time.perf_counter()
+    try:
+        pages = (args.items + args.per_page - 1) // args.per_page
+        for page in range(1, pages + 1):
+            items += len(spider.crawl(page=page, per_page=args.per_page, query='春节'))
+    finally:
+        spider.close()
+        engine.close()
+        store.close()
+    return items, latencies, time.perf_counter() - start
+
+
+def bench_recraft_download(args, servers, work_dir):
+    """通过下载引擎并发调用 RecraftSpider.download_image"""
+    from recraft_spider import RecraftSpider
+
+    engine = make_engine(args)
+    store = ImageStore(os.path.join(work_dir, 'image_store'))
+    spider = RecraftSpider(engine=engine, image_store=store)
+    spider.save_dir = os.path.join(work_dir, 'recraft')
+    spider.create_save_dir()
+    latencies = []
+    download = timed(spider.download_image, latencies)
+
+    start = time.perf_counter()
+    try:
+        futures = [
+            engine.submit(download, f"{servers['cdn'].base_url}/images/recraft-{index:08d}.webp",
+                          f"recraft-{index:08d}")
+            for index in range(args.items)
+        ]
+        items = sum(1 for future in futures if future.result())
+    finally:
+        spider.close()
+        engine.close()
+        store.close()
+    return items, latencies, time.perf_counter() - start
+
+
+def bench_recraft_feed(args, servers, work_dir):
+    """接口模式下调用 RecraftSpider.crawl_api，回放录制的社区图片列表响应，延迟为单页列表请求的耗时
+
+    接口描述由 RecraftFeed.from_url 根据录制中的第一页请求推断，与浏览器发现接口后的流程一致；
+    条目数由录制决定，与--items无关
+    """
+    from recraft_feed import RecraftFeed
+    from recraft_spider import RecraftSpider
+
+    recording = RecraftFeedHandler.load_recording(args.recraft_recording)
+    query = next(query for query in recording['queries'] if query)
+    url = RecraftFeedHandler.feed_url(servers['recraft_feed'].base_url, recording, query)
+    engine = make_engine(args)
+    first_page = engine.fetch(url).json()
+    feed = RecraftFeed.from_url(url, query, first_page)
+
+    store = ImageStore(os.path.join(work_dir, 'image_store'))
+    spider = RecraftSpider(query=query, engine=engine, image_store=store, feed_file=None)
+    spider.save_dir = os.path.join(work_dir, 'recraft')
+    spider.create_save_dir()
+    latencies = []
+    spider.fetch_feed_page = timed(spider.fetch_feed_page, latencies)
+
+    start = time.perf_counter()
+    try:
+        items = len(spider.crawl_api(feed) or [])
+    finally:
+        spider.close()
+        engine.close()
+        store.close()
+    return items, latencies, time.perf_counter() - start
+
+
+def bench_save_image_info(args, servers, work_dir):
+    """顺序调用 save_image_info 写入元数据，包含close时导出JSON的耗时"""
+    from miaohua_spider import MiaohuaSpider
+
+    store = ImageStore(os.path.join(work_dir, 'image_store'))
+    spider = MiaohuaSpider(image_store=store)
+    spider.save_dir = os.path.join(work_dir, 'metadata')
+    spider.create_save_dir()
+    latencies = []
+    save = timed(spider.save_image_info, latencies)
+
+    start = time.perf_counter()
+    try:
+        for index in range(args.items):
+            save({
+                'description': f"春节，第{index}张，喜庆，红色背景，灯笼，超高清",
+                'ratio': '1024x1536',
+                'img_url': f"https://example.invalid/images/meta-{index:08d}.jpeg",
+                'task_id': f"meta-{index:08d}",
+                'user_name': 'bench',
+            })
+    finally:
+        spider.close()
+        store.close()
+    return args.items, latencies, time.perf_counter() - start
+
+
+def bench_generate_from_json(args, servers, work_dir):
+    """对替身LLM调用 PromptGenerator.generate_from_json，延迟为单次LLM请求的耗时"""
+    from PromptsGenerator import LLMClient, PromptGenerator
+    from result_checkpoint import ResultCheckpoint
+
+    json_file = os.path.join(work_dir, 'image_info.json')
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump([{'prompt': f"春节壁纸，第{index}张，红色背景，金色灯笼，烟花"}
+                   for index in range(args.items)], f, ensure_ascii=False)
+
+    client = LLMClient(request_timeout=60, model='gpt4o', max_retries=args.llm_max_retries,
+                       backoff_base=0.05, backoff_max=1.0, stream=args.llm_stream)
+    client.url = servers['llm'].base_url + '/llm'
+    client.access_token = 'bench'
+    latencies = []
+    client.get_response_text = timed(client.get_response_text, latencies)
+    generator = PromptGenerator(os.path.join(PROJECT_DIR, 'prompt_inspiration.md'), client,
+                                batch_token_budget=args.batch_token_budget)
+
+    start = time.perf_counter()
+    results = generator.generate_from_json(json_file, concurrency=args.concurrency)
+    elapsed = time.perf_counter() - start
+    items = sum(1 for result in results if not ResultCheckpoint.is_failed(result))
+    return items, latencies, elapsed
+
+
+BENCHMARKS = {
+    'miaohua_crawl': bench_miaohua_crawl,
+    'recraft_download': bench_recraft_download,
+    'recraft_feed': bench_recraft_feed,
+    'save_image_info': bench_save_image_info,
+    'generate_from_json': bench_generate_from_json,
+}
+
+
+def run_benchmark(name, args, servers):
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(sys.stdout if args.verbose else devnull):
+            items, latencies, elapsed = BENCHMARKS[name](args, servers, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    p50, p95 = percentile(latencies, 50), percentile(latencies, 95)
+    return {
+        'items': items,
+        'seconds': round(elapsed, 4),
+        'items_per_second': round(items / elapsed, 2) if elapsed else None,
+        'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+        'p95_ms': round(p95 * 1000, 2) if p95 is not None else None,
+        # ru_maxrss只增不减，按顺序运行时为截至该项的进程峰值，单独对比时请配合--only
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline, baseline_file):
+    """与之前保存的结果逐项对比，吞吐越高越好，延迟和内存越低越好"""
+    print(f"\n与 {baseline_file}（commit {baseline.get('commit')}）对比:")
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if not old:
+            continue
+        changes = []
+        for metric in ('items_per_second', 'p50_ms', 'p95_ms', 'peak_rss_mb'):
+            if result.get(metric) and old.get(metric):
+                changes.append(f"{metric} {old[metric]} -> {result[metric]} "
+                               f"({(result[metric] / old[metric] - 1) * 100:+.1f}%)")
+        print(f"  {name}: " + "，".join(changes))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='离线压测爬虫与提示生成')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help='只运行指定的压测项')
+    parser.add_argument('--output', type=str, default='bench_results.json', help='结果输出文件')
+    parser.add_argument('--compare', type=str, default=None, help='与之前的结果文件对比')
+    parser.add_argument('--items', type=int, default=300, help='每项压测处理的条目数')
+    parser.add_argument('--per-page', type=int, default=30, help='妙绘列表每页条目数')
+    parser.add_argument('--workers', type=int, default=8, help='下载引擎线程数')
+    parser.add_argument('--rate-per-host', type=float, default=1000.0, help='下载引擎每主机每秒请求数')
+    parser.add_argument('--image-size-kb', type=int, default=200, help='替身CDN的图片大小（KB）')
+    parser.add_argument('--image-latency', type=float, default=0.02, help='替身CDN首字节延迟（秒）')
+    parser.add_argument('--bandwidth-kbps', type=int, default=0,
+                        help='替身CDN单连接带宽（KB/s），0为不限速')
+    parser.add_argument('--gallery-latency', type=float, default=0.05, help='替身图库接口延迟（秒）')
+    parser.add_argument('--recraft-recording', type=str, default=None,
+                        help='Recraft图片列表接口的录制文件，默认为benchmarks/recordings/recraft_feed.json')
+    parser.add_argument('--llm-delay', type=float, default=0.1, help='替身LLM响应延迟（秒）')
+    parser.add_argument('--llm-failure-rate', type=float, default=0.0, help='替身LLM返回429/500的概率')
+    parser.add_argument('--llm-invalid-rate', type=float, default=0.0,
+                        help='替身LLM输出以说明文字开头、无法解析为JSON的概率')
+    parser.add_argument('--llm-stream', action='store_true', help='以流式模式请求替身LLM')
+    parser.add_argument('--llm-ttft', type=float, default=0.05, help='替身LLM流式输出的首字延迟（秒）')
+    parser.add_argument('--llm-chunk-delay', type=float, default=0.005, help='替身LLM流式输出每个分块的间隔（秒）')
+    parser.add_argument('--llm-max-retries', type=int, default=3, help='LLM单条请求最大尝试次数')
+    parser.add_argument('--concurrency', type=int, default=8, help='提示生成并发请求数')
+    parser.add_argument('--batch-token-budget', type=int, default=None, help='提示生成批量模式的token预算')
+    parser.add_argument('--verbose', action='store_true', help='保留被测代码的输出')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # 先读取基准结果，允许--compare与--output指向同一文件
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    cdn = StandInServer(ImageHandler, size=args.image_size_kb * 1024, latency=args.image_latency,
+                        bandwidth=args.bandwidth_kbps * 1024)
+    llm = StandInServer(LLMHandler, delay=args.llm_delay, failure_rate=args.llm_failure_rate,
+                        invalid_rate=args.llm_invalid_rate, ttft=args.llm_ttft, chunk_delay=args.llm_chunk_delay)
+    with cdn, llm:
+        gallery = StandInServer(GalleryHandler, total_items=args.items, cdn_url=cdn.base_url,
+                                latency=args.gallery_latency)
+        recraft_feed = StandInServer(RecraftFeedHandler, recording=RecraftFeedHandler.load_recording(args.recraft_recording),
+                                     cdn_url=cdn.base_url, latency=args.gallery_latency)
+        with gallery, recraft_feed:
+            servers = {'gallery': gallery, 'recraft_feed': recraft_feed, 'cdn': cdn, 'llm': llm}
+            results = {}
+            for name in args.only:
+                results[name] = run_benchmark(name, args, servers)
+                result = results[name]
+                print(f"{name:<20} {result['items']:>6} 条 {result['items_per_second']:>9} 条/秒 "
+                      f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms 峰值内存={result['peak_rss_mb']}MB")
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': {key: value for key, value in vars(args).items()
+                   if key not in ('only', 'output', 'compare', 'verbose')},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"压测结果已保存到 {args.output}")
+
+    if baseline is not None:
+        compare(results, baseline, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""本地替身服务：妙绘图库接口、Recraft社区图片列表接口、图片CDN和LLM接口，用于离线压测"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings')
+
+# 最小的JPEG文件头，让扩展名识别与真实CDN一致
+JPEG_HEADER = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'
+
+# 批量请求中的编号描述行，如 3. "红色背景，蛇"
+BATCH_LINE = re.compile(r'^\d+\. (".*")$', re.MULTILINE)
+# 单条请求中用户消息的位置
+USER_MESSAGE = re.compile(r'\[user\]\(#message\)\n(.*?)\n<\|im_start\|>assistant', re.DOTALL)
+
+
+class StandInServer:
+    """在后台线程中运行的HTTP替身服务"""
+
+    def __init__(self, handler_class, **config):
+        handler = type(handler_class.__name__, (handler_class,), {'config': config})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class GalleryHandler(QuietHandler):
+    """回放妙绘 /api/v2/public/gallery 的分页JSON
+
+    config: total_items 图片总数, cdn_url 图片地址前缀, latency 每次请求的延迟（秒）
+    """
+
+    def do_GET(self):
+        params = dict(parse_qsl(urlparse(self.path).query))
+        time.sleep(self.config.get('latency', 0))
+        page = int(params.get('page', 1))
+        per_page = int(params.get('per_page', 30))
+        query = params.get('query', '')
+        total = self.config.get('total_items', 300)
+        start = (page - 1) * per_page
+        items = []
+        for index in range(start, min(start + per_page, total)):
+            task_id = f"bench-{index:08d}"
+            items.append({
+                'prompt': f"{query}，第{index}张，春节，喜庆，红色背景，超高清",
+                'ratio': '1024x1536',
+                'large': f"{self.config.get('cdn_url', '')}/images/{task_id}.jpeg",
+                'task_id': task_id,
+                'user_name': 'bench',
+            })
+        self.send_json({'code': 0, 'info': {'list': items}})
+
+
+class RecraftFeedHandler(QuietHandler):
+    """回放录制的Recraft社区图片列表接口响应（recordings/recraft_feed.json）
+
+    按查询参数取出对应查询词的录制页，再按请求中的分页cursor找到对应的响应；
+    没有录制的查询词返回空列表，没有查询参数时回放未过滤的社区流（录制中键为空字符串）
+    config: recording 由load_recording读取的录制内容, cdn_url 替换响应中{cdn}的图片地址前缀,
+            latency 每次请求的延迟（秒）
+    """
+
+    @staticmethod
+    def load_recording(path=None):
+        with open(path or os.path.join(RECORDINGS_DIR, 'recraft_feed.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def do_GET(self):
+        recording = self.config['recording']
+        parts = urlparse(self.path)
+        if parts.path != recording['path']:
+            self.send_json({'error': 'not found'}, status=404)
+            return
+        params = dict(parse_qsl(parts.query))
+        time.sleep(self.config.get('latency', 0))
+        pages = recording['queries'].get(params.get(recording['query_param'], ''), [])
+        cursor = params.get(recording['page_param'])
+        page = next((page for page in pages if page['cursor'] == cursor), None)
+        if page is None:
+            self.send_json({'data': {'images': [], 'next_cursor': None}})
+            return
+        text = json.dumps(page['response'], ensure_ascii=False)
+        self.send_json(json.loads(text.replace('{cdn}', self.config.get('cdn_url', ''))))
+
+    @staticmethod
+    def feed_url(base_url, recording, query):
+        """浏览器发现接口时看到的第一页请求地址，供RecraftFeed.from_url推断查询参数与分页方式"""
+        return f"{base_url}{recording['path']}?{urlencode({recording['query_param']: query, 'limit': 24})}"
+
+
+class ImageHandler(QuietHandler):
+    """提供固定大小的静态图片，可配置首字节延迟和带宽，支持ETag与Range
+
+    config: size 图片字节数, latency 首字节延迟（秒）, bandwidth 每秒字节数（0为不限速）
+    """
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        size = self.config.get('size', 200 * 1024)
+        seed = hashlib.sha256(path.encode('utf-8')).digest()
+        body = (JPEG_HEADER + seed * (size // len(seed) + 1))[:size]
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        time.sleep(self.config.get('latency', 0))
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start, status = 0, 200
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match and int(match.group(1)) < size:
+            start, status = int(match.group(1)), 206
+        chunk = body[start:]
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(chunk)))
+        self.send_header('ETag', etag)
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{size - 1}/{size}")
+        self.end_headers()
+
+        bandwidth = self.config.get('bandwidth', 0)
+        step = 16 * 1024
+        for offset in range(0, len(chunk), step):
+            self.wfile.write(chunk[offset:offset + step])
+            if bandwidth:
+                time.sleep(step / bandwidth)
+
+
+class LLMHandler(QuietHandler):
+    """模拟LLM接口：按配置的延迟返回符合格式的JSON，并按比例注入429/500错误
+
+    config: delay 每次响应的延迟（秒）, failure_rate 失败概率,
+            invalid_rate 输出以一段说明文字开头（无法解析为JSON）的概率,
+            ttft 流式请求的首字延迟（秒）, chunk_delay 流式输出每个分块的间隔（秒）, chunk_chars 每个分块的字符数
+    请求体中stream为true时以SSE逐块输出
+    """
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length) or b'{}')
+        stream = bool(data.get('stream'))
+        time.sleep(self.config.get('ttft', 0.05) if stream else self.config.get('delay', 0))
+        if random.random() < self.config.get('failure_rate', 0):
+            status = random.choice((429, 500))
+            body = b'{"error": "stand-in failure"}'
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        prompt = data.get('prompt', '')
+        batch = [json.loads(line) for line in BATCH_LINE.findall(prompt)]
+        if batch:
+            payload = [self.make_result(description) for description in batch]
+        else:
+            messages = USER_MESSAGE.findall(prompt)
+            payload = self.make_result(messages[-1] if messages else prompt[-200:])
+
+        text = json.dumps(payload, ensure_ascii=False)
+        if random.random() < self.config.get('invalid_rate', 0):
+            text = "Sure! Here is the wallpaper prompt you asked for:\n" + text
+        if stream:
+            self.send_stream(text)
+            return
+        body = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_stream(self, text):
+        """以OpenAI风格的SSE事件逐块输出，客户端提前断开时停止"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        size = self.config.get('chunk_chars', 16)
+        try:
+            for start in range(0, len(text), size):
+                event = {'choices': [{'delta': {'content': text[start:start + size]}}]}
+                self.write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+                time.sleep(self.config.get('chunk_delay', 0.005))
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    @staticmethod
+    def make_result(description):
+        return {
+            'original_prompt': description,
+            'inspired_prompt': f"A festive wallpaper inspired by: {description}",
+            'analysis': {
+                'main_elements': ['lantern', 'ribbon'],
+                'scene_type': 'festival wallpaper',
+                'art_style': 'modern minimalism',
+                'mood': 'joyful',
+                'composition': 'centered with white space',
+                'color_scheme': 'red and gold',
+            },
+        }
@@ -0,0 +1,209 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from selenium import webdriver
+import metrics
+
+try:
+    import psutil
+except ImportError:  # 未安装时只报告JS堆大小
+    psutil = None
+
+# 浏览器内屏蔽的资源：图片由下载引擎单独获取，视频和字体对提取无用
+BLOCKED_URL_PATTERNS = [
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+    "*.mp4", "*.webm", "*.mov", "*.m3u8",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+]
+
+# 当前页面的传输字节数：导航请求加上所有子资源
+TRANSFER_SIZE_JS = """
+var entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+var total = 0;
+for (var i = 0; i < entries.length; i++) total += entries[i].transferSize || 0;
+return total;
+"""
+
+
+class BrowserPool:
+    """可跨查询复用的无头Chrome池：按需启动，最多size个；每个浏览器使用max_pages次后重启以限制内存"""
+
+    def __init__(self, size=1, max_pages=20, block_resources=True, user_agent=None):
+        self.size = size
+        self.max_pages = max_pages
+        self.block_resources = block_resources
+        self.user_agent = user_agent
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.pages = {}  # id(driver) -> 已使用次数
+        self.started = 0
+        self.closed = False
+        self.stats_data = {
+            'drivers_started': 0,
+            'drivers_recycled': 0,
+            'startup_seconds': 0.0,
+            'pages': 0,
+            'bytes_transferred': 0,
+            'peak_js_heap_bytes': 0,
+            'peak_driver_rss_bytes': 0,
+        }
+
+    def _start_driver(self):
+        start = time.perf_counter()
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--disable-dev-shm-usage')
+        if self.user_agent:
+            options.add_argument(f'user-agent={self.user_agent}')
+        if self.block_resources:
+            # 禁止渲染时下载图片，<img>的src属性仍然保留，不影响提取
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+        driver = webdriver.Chrome(options=options)
+        if self.block_resources:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+        driver.execute_cdp_cmd('Performance.enable', {})
+
+        elapsed = time.perf_counter() - start
+        metrics.observe("browser_startup_seconds", elapsed)
+        with self.lock:
+            self.pages[id(driver)] = 0
+            self.stats_data['drivers_started'] += 1
+            self.stats_data['startup_seconds'] += elapsed
+        return driver
+
+    def acquire(self, timeout=None):
+        """取出一个空闲浏览器，不足size个时新启动一个，否则等待其他线程归还，超时抛出queue.Empty"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                can_start = self.started < self.size
+                if can_start:
+                    self.started += 1
+            if can_start:
+                try:
+                    return self._start_driver()
+                except Exception:
+                    with self.lock:
+                        self.started -= 1
+                    raise
+            # 被回收的浏览器不会放回队列，短超时轮询以便及时发现空出的名额
+            wait = 0.5 if deadline is None else min(0.5, deadline - time.monotonic())
+            if wait <= 0:
+                raise queue.Empty
+            try:
+                return self.idle.get(timeout=wait)
+            except queue.Empty:
+                continue
+
+    @staticmethod
+    def _driver_rss(driver):
+        """chromedriver及其启动的全部Chrome进程（浏览器、渲染、GPU等）的常驻内存之和，无法获取时返回None"""
+        if psutil is None:
+            return None
+        try:
+            process = psutil.Process(driver.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+        except (AttributeError, psutil.Error):
+            return None
+        total = 0
+        for child in processes:
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                # 统计期间退出的子进程
+                continue
+        return total
+
+    def _measure(self, driver):
+        """记录当前页面的传输字节数、JS堆大小和浏览器进程的常驻内存"""
+        try:
+            transferred = int(driver.execute_script(TRANSFER_SIZE_JS) or 0)
+            page_metrics = driver.execute_cdp_cmd('Performance.getMetrics', {})['metrics']
+            heap = next((m['value'] for m in page_metrics if m['name'] == 'JSHeapUsedSize'), 0)
+        except Exception:
+            return
+        rss = self._driver_rss(driver)
+        metrics.inc("browser_bytes_total", transferred)
+        if rss is not None:
+            metrics.observe("browser_driver_rss_bytes", rss)
+        with self.lock:
+            self.stats_data['bytes_transferred'] += transferred
+            self.stats_data['peak_js_heap_bytes'] = max(self.stats_data['peak_js_heap_bytes'], int(heap))
+            if rss is not None:
+                self.stats_data['peak_driver_rss_bytes'] = max(self.stats_data['peak_driver_rss_bytes'], rss)
+
+    def release(self, driver, broken=False):
+        """归还浏览器；出错或达到max_pages次时关闭，下次acquire时重新启动"""
+        self._measure(driver)
+        with self.lock:
+            pages = self.pages.get(id(driver), 0) + 1
+            self.pages[id(driver)] = pages
+            self.stats_data['pages'] += 1
+            recycle = broken or self.closed or pages >= self.max_pages
+        if recycle:
+            self._quit(driver)
+            with self.lock:
+                self.stats_data['drivers_recycled'] += 1
+        else:
+            # 离开当前页面，释放DOM和脚本占用的内存
+            try:
+                driver.get('about:blank')
+            except Exception:
+                self._quit(driver)
+                return
+            self.idle.put(driver)
+
+    def _quit(self, driver):
+        with self.lock:
+            self.pages.pop(id(driver), None)
+            self.started -= 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """用法: with pool.driver() as driver: ..."""
+        driver = self.acquire(timeout)
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.stats_data)
+        started = stats['drivers_started']
+        stats['avg_startup_seconds'] = stats['startup_seconds'] / started if started else 0.0
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        print(f"浏览器池: 启动 {stats['drivers_started']} 次（平均 {stats['avg_startup_seconds']:.1f} 秒），"
+              f"回收 {stats['drivers_recycled']} 次，加载 {stats['pages']} 个页面，"
+              f"传输 {stats['bytes_transferred'] / 1024 / 1024:.1f} MB，"
+              f"JS堆峰值 {stats['peak_js_heap_bytes'] / 1024 / 1024:.1f} MB，"
+              + (f"浏览器进程内存峰值 {stats['peak_driver_rss_bytes'] / 1024 / 1024:.1f} MB"
+                 if psutil is not None else "浏览器进程内存未统计（需要安装psutil）"))
+
+    def close(self):
+        """关闭所有空闲浏览器，仍在使用中的浏览器归还时关闭"""
+        self.closed = True
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(driver)
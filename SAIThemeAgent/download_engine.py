@@ -0,0 +1,240 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 需要退避重试的HTTP状态码
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 单张图片默认大小上限
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+class TokenBucket:
+    """令牌桶限速器，rate为每秒补充的令牌数，capacity为允许的突发量"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到获取一个令牌"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class DownloadEngine:
+    """共享下载引擎：有界线程池 + keep-alive连接池 + 按主机令牌桶限速 + 429/5xx退避重试"""
+
+    def __init__(self, max_workers=8, rate_per_host=4.0, burst=None, max_retries=3,
+                 backoff_factor=0.5, timeout=(10, 60), headers=None,
+                 max_bytes=DEFAULT_MAX_BYTES, chunk_size=64 * 1024):
+        self.max_workers = max_workers
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout  # (连接超时, 读取超时)
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download")
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+
+    def _get_bucket(self, url):
+        host = urlparse(url).netloc
+        with self._buckets_lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_per_host, self.burst)
+                self._buckets[host] = bucket
+            return bucket
+
+    def _backoff_delay(self, attempt, response=None):
+        """计算退避时间，优先使用服务端的Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff_factor * (2 ** attempt) + random.uniform(0, self.backoff_factor)
+
+    def fetch(self, url, **kwargs):
+        """带限速与重试的GET请求，失败时返回None"""
+        kwargs.setdefault("timeout", self.timeout)
+        bucket = self._get_bucket(url)
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                response = self.session.get(url, **kwargs)
+            except requests.RequestException as e:
+                print(f"请求异常({attempt + 1}/{self.max_retries + 1}): {url} {e}")
+                if attempt < self.max_retries:
+                    time.sleep(self._backoff_delay(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self._backoff_delay(attempt, response)
+                print(f"请求返回 {response.status_code}，{delay:.1f} 秒后重试: {url}")
+                response.close()
+                time.sleep(delay)
+                continue
+            return response
+        return None
+
+    def download(self, url, dest_path, etag=None, last_modified=None, max_bytes=None):
+        """流式下载到 dest_path.part，完成后原子重命名为dest_path
+
+        中断的传输通过Range续传，续传时以If-Range带上.part开始写入时响应的校验值（保存在 dest_path.part.json），
+        资源已变化时服务端返回完整内容；没有校验值的残留文件无法确认一致，丢弃后重新下载。
+        传入etag/last_modified时发送条件请求，未修改返回status为not_modified。
+        调用方需保证同一dest_path同时只有一个下载（见ImageStore.temp_file）。
+        返回 {'status': 'ok'/'not_modified'/'failed', 'content_type', 'etag', 'last_modified', 'bytes'}
+        """
+        max_bytes = max_bytes or self.max_bytes
+        part_path = dest_path + ".part"
+        result = {'status': 'failed', 'content_type': None, 'etag': None, 'last_modified': None, 'bytes': 0}
+
+        for attempt in range(self.max_retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            part_validators = self._load_part_validators(part_path) if offset else None
+            if offset and not part_validators:
+                self._discard(part_path)
+                offset = 0
+            headers = {}
+            if offset:
+                headers['Range'] = f"bytes={offset}-"
+                headers['If-Range'] = part_validators.get('etag') or part_validators['last_modified']
+            else:
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+
+            response = self.fetch(url, headers=headers, stream=True)
+            if response is None:
+                return result
+            try:
+                if response.status_code == 304:
+                    result['status'] = 'not_modified'
+                    return result
+                if response.status_code == 416:
+                    # 续传位置无效，丢弃残留文件重新下载
+                    self._discard(part_path)
+                    continue
+                if response.status_code == 206:
+                    if not response.headers.get('Content-Range', '').startswith(f"bytes {offset}-"):
+                        # 返回的范围与残留文件对不上，丢弃后重新下载
+                        print(f"续传范围不匹配，重新下载: {url}")
+                        self._discard(part_path)
+                        continue
+                    mode = 'ab'
+                elif response.status_code == 200:
+                    mode, offset = 'wb', 0
+                    self._save_part_validators(part_path, response)
+                else:
+                    print(f"下载失败: {response.status_code} {url}")
+                    return result
+
+                content_length = response.headers.get('Content-Length')
+                if content_length and content_length.isdigit() and offset + int(content_length) > max_bytes:
+                    print(f"图片超过大小上限 {max_bytes} 字节，放弃下载: {url}")
+                    self._discard(part_path)
+                    return result
+
+                written = offset
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(self.chunk_size):
+                        written += len(chunk)
+                        if written > max_bytes:
+                            break
+                        f.write(chunk)
+                if written > max_bytes:
+                    print(f"图片超过大小上限 {max_bytes} 字节，放弃下载: {url}")
+                    self._discard(part_path)
+                    return result
+
+                os.replace(part_path, dest_path)
+                self._discard(part_path)
+                result.update(
+                    status='ok',
+                    content_type=response.headers.get('Content-Type'),
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                    bytes=written,
+                )
+                return result
+            except requests.RequestException as e:
+                # 保留.part文件，下一次尝试从断点续传
+                print(f"传输中断({attempt + 1}/{self.max_retries + 1}): {url} {e}")
+                if attempt < self.max_retries:
+                    time.sleep(self._backoff_delay(attempt))
+            finally:
+                response.close()
+        return result
+
+    @staticmethod
+    def _save_part_validators(part_path, response):
+        """记录.part文件对应响应的ETag/Last-Modified，续传时用于If-Range"""
+        validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        if not validators['etag'] and not validators['last_modified']:
+            # 没有校验值时不保存，中断后无法续传，只能重新下载
+            if os.path.exists(part_path + ".json"):
+                os.remove(part_path + ".json")
+            return
+        with open(part_path + ".json", 'w', encoding='utf-8') as f:
+            json.dump(validators, f)
+
+    @staticmethod
+    def _load_part_validators(part_path):
+        try:
+            with open(part_path + ".json", 'r', encoding='utf-8') as f:
+                validators = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return validators if validators.get('etag') or validators.get('last_modified') else None
+
+    @staticmethod
+    def _discard(path):
+        """删除.part文件及其校验值文件"""
+        for stale in (path, path + ".json"):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    def submit(self, fn, *args, **kwargs):
+        """将下载任务提交到线程池，返回Future"""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,281 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from image_hash import iter_image_paths
+
+# 解码后统一缩放到的边长，特征都在这个尺寸上计算
+THUMB_SIZE = 64
+# RGB每通道量化为4级，共64个颜色桶
+COLOR_LEVELS = 4
+COLOR_BINS = COLOR_LEVELS ** 3
+# 构图按4x4网格统计边缘密度与亮度
+GRID = 4
+# 相邻像素灰度差超过该值视为边缘
+EDGE_THRESHOLD = 24.0
+
+# 特征向量布局: [颜色直方图 64][各区域边缘密度 16][各区域平均亮度 16]
+HIST_SLICE = slice(0, COLOR_BINS)
+EDGE_SLICE = slice(COLOR_BINS, COLOR_BINS + GRID * GRID)
+LUMA_SLICE = slice(COLOR_BINS + GRID * GRID, COLOR_BINS + 2 * GRID * GRID)
+FEATURE_DIM = COLOR_BINS + 2 * GRID * GRID
+
+# 构图查询时可用的区域名 -> 网格中的(行, 列)范围
+REGIONS = {
+    'top': (slice(0, 2), slice(0, GRID)),
+    'bottom': (slice(2, GRID), slice(0, GRID)),
+    'left': (slice(0, GRID), slice(0, 2)),
+    'right': (slice(0, GRID), slice(2, GRID)),
+    'center': (slice(1, 3), slice(1, 3)),
+    'top-left': (slice(0, 2), slice(0, 2)),
+    'top-right': (slice(0, 2), slice(2, GRID)),
+    'bottom-left': (slice(2, GRID), slice(0, 2)),
+    'bottom-right': (slice(2, GRID), slice(2, GRID)),
+}
+
+
+def load_rgb(path):
+    with Image.open(path) as image:
+        image.draft('RGB', (THUMB_SIZE * 2, THUMB_SIZE * 2))
+        rgb = image.convert('RGB').resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR)
+        return np.asarray(rgb, dtype=np.uint8)
+
+
+def compute_features(rgb):
+    """(n, 64, 64, 3) uint8 -> (n, FEATURE_DIM) float32，整批向量化计算"""
+    n = len(rgb)
+    shift = 8 - int(np.log2(COLOR_LEVELS))
+    quantized = (rgb >> shift).astype(np.int64)
+    bins = (quantized[..., 0] * COLOR_LEVELS + quantized[..., 1]) * COLOR_LEVELS + quantized[..., 2]
+    offsets = np.arange(n)[:, None] * COLOR_BINS
+    hist = np.bincount((bins.reshape(n, -1) + offsets).ravel(), minlength=n * COLOR_BINS)
+    hist = hist.reshape(n, COLOR_BINS) / float(THUMB_SIZE * THUMB_SIZE)
+
+    gray = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    gx = np.abs(np.diff(gray, axis=2))[:, :-1, :]
+    gy = np.abs(np.diff(gray, axis=1))[:, :, :-1]
+    edges = np.pad((gx + gy) > EDGE_THRESHOLD, ((0, 0), (0, 1), (0, 1)))
+    cell = THUMB_SIZE // GRID
+    edge_density = edges.reshape(n, GRID, cell, GRID, cell).mean(axis=(2, 4)).reshape(n, -1)
+    luma = gray.reshape(n, GRID, cell, GRID, cell).mean(axis=(2, 4)).reshape(n, -1) / 255.0
+    return np.hstack([hist, edge_density, luma]).astype(np.float32)
+
+
+def extract_features(paths):
+    """在子进程中解码一批图片并计算特征，返回 (成功的路径列表, 特征矩阵)"""
+    loaded, ok_paths = [], []
+    for path in paths:
+        try:
+            loaded.append(load_rgb(path))
+            ok_paths.append(path)
+        except Exception:
+            continue
+    if not loaded:
+        return [], np.empty((0, FEATURE_DIM), dtype=np.float32)
+    return ok_paths, compute_features(np.stack(loaded))
+
+
+def parse_color(color):
+    """'#c8102e' 或 'c8102e' -> (r, g, b)"""
+    color = color.strip().lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def color_bin(rgb):
+    step = 256 // COLOR_LEVELS
+    r, g, b = (min(value // step, COLOR_LEVELS - 1) for value in rgb)
+    return (r * COLOR_LEVELS + g) * COLOR_LEVELS + b
+
+
+def bin_color(index):
+    """颜色桶中心对应的十六进制颜色"""
+    step = 256 // COLOR_LEVELS
+    r, rest = divmod(index, COLOR_LEVELS * COLOR_LEVELS)
+    g, b = divmod(rest, COLOR_LEVELS)
+    return '#' + ''.join(f"{value * step + step // 2:02x}" for value in (r, g, b))
+
+
+def region_mask(names):
+    mask = np.zeros((GRID, GRID), dtype=bool)
+    for name in names:
+        if name not in REGIONS:
+            raise ValueError(f"未知区域: {name}，可选: {', '.join(REGIONS)}")
+        mask[REGIONS[name]] = True
+    return mask.ravel()
+
+
+def file_key(path):
+    """返回文件的 (设备, inode)，文件不存在时返回None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+class FeatureIndex:
+    """颜色/构图特征索引：特征以float32行追加写入features.f32并内存映射读取，路径逐行写入paths.txt"""
+
+    def __init__(self, index_dir="spider_data/feature_index"):
+        self.index_dir = index_dir
+        self.features_file = os.path.join(index_dir, "features.f32")
+        self.paths_file = os.path.join(index_dir, "paths.txt")
+        os.makedirs(index_dir, exist_ok=True)
+        self.paths = []
+        self.features = np.empty((0, FEATURE_DIM), dtype=np.float32)
+        self.load()
+
+    def load(self):
+        """内存映射已有特征；中断时两个文件可能不一致，以较短的为准"""
+        if os.path.exists(self.paths_file):
+            with open(self.paths_file, 'r', encoding='utf-8') as f:
+                self.paths = [line.rstrip('\n') for line in f if line.strip()]
+        rows = 0
+        if os.path.exists(self.features_file):
+            rows = os.path.getsize(self.features_file) // (FEATURE_DIM * 4)
+        count = min(rows, len(self.paths))
+        self.paths = self.paths[:count]
+        if count:
+            self.features = np.memmap(self.features_file, dtype=np.float32, mode='r', shape=(count, FEATURE_DIM))
+        else:
+            self.features = np.empty((0, FEATURE_DIM), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def _append(self, paths, features):
+        # 先写特征再写路径，中断时多出的特征行在load时被忽略
+        with open(self.features_file, 'r+b' if os.path.exists(self.features_file) else 'wb') as f:
+            f.seek(len(self.paths) * FEATURE_DIM * 4)
+            f.write(np.ascontiguousarray(features, dtype=np.float32).tobytes())
+            f.truncate()
+        with open(self.paths_file, 'a', encoding='utf-8') as f:
+            for path in paths:
+                f.write(path + '\n')
+        self.paths.extend(paths)
+
+    def add_paths(self, paths, max_workers=None, batch_size=256):
+        """增量建立索引：跳过已收录的路径，进程池中解码并批量计算特征，返回新增数量
+
+        同一张图片在多个批次目录中是同一文件的硬链接，按 (设备, inode) 只收录第一个路径，查询结果不会重复
+        """
+        known = set(self.paths)
+        seen = {file_key(path) for path in self.paths}
+        todo = []
+        for path in dict.fromkeys(paths):
+            if path in known:
+                continue
+            key = file_key(path)
+            if key is not None and key in seen:
+                continue
+            seen.add(key)
+            todo.append(path)
+        if not todo:
+            return 0
+        batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+        added = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for ok_paths, features in executor.map(extract_features, batches):
+                if ok_paths:
+                    self._append(ok_paths, features)
+                    added += len(ok_paths)
+                print(f"已索引 {added}/{len(todo)} 张图片，{added / (time.perf_counter() - start):.0f} 张/秒")
+        self.load()
+        return added
+
+    def _top_k(self, scores, k):
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.paths[i], float(scores[i])) for i in top]
+
+    def palette_scores(self, colors, weights=None):
+        """与目标配色的直方图交集，越大越接近"""
+        target = np.zeros(COLOR_BINS, dtype=np.float32)
+        weights = weights or [1.0] * len(colors)
+        for color, weight in zip(colors, weights):
+            target[color_bin(parse_color(color))] += weight
+        target /= target.sum()
+        # 目标为零的桶对交集没有贡献，只取非零的几列计算
+        bins = np.flatnonzero(target)
+        return np.minimum(self.features[:, bins], target[bins]).sum(axis=1)
+
+    def emptiness_scores(self, regions):
+        """指定区域的留白程度：1减去区域内的平均边缘密度，越大越空"""
+        mask = region_mask(regions)
+        return 1.0 - self.features[:, EDGE_SLICE] @ (mask / mask.sum()).astype(np.float32)
+
+    def search(self, colors=None, empty=None, k=20, layout_weight=1.0):
+        """按配色和/或留白区域查询，返回 [(路径, 得分)]，得分越高越匹配"""
+        if not len(self):
+            return []
+        scores = np.zeros(len(self), dtype=np.float32)
+        if colors:
+            scores += self.palette_scores(colors)
+        if empty:
+            scores += layout_weight * self.emptiness_scores(empty)
+        return self._top_k(scores, k)
+
+    def similar(self, path, k=20):
+        """以图搜图：与给定图片的特征向量的欧氏距离最近的k张"""
+        if not len(self):
+            return []
+        target = compute_features(load_rgb(path)[None])[0]
+        distances = np.sqrt(((self.features - target) ** 2).sum(axis=1))
+        return self._top_k(-distances, k)
+
+    def palette(self, path, top=5):
+        """返回已收录图片的主色调 [(颜色, 占比)]"""
+        row = self.features[self.paths.index(path), HIST_SLICE]
+        order = np.argsort(-row)[:top]
+        return [(bin_color(int(i)), float(row[i])) for i in order]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='图片颜色/构图特征索引')
+    parser.add_argument('--index-dir', type=str, default='spider_data/feature_index', help='索引目录')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='扫描目录并增量建立索引')
+    build.add_argument('dirs', nargs='+', help='图片目录，递归扫描，其中的全局图片库目录会被跳过')
+    build.add_argument('--workers', type=int, default=None, help='解码进程数，默认CPU核数')
+    build.add_argument('--batch-size', type=int, default=256, help='每个进程任务处理的图片数')
+
+    query = subparsers.add_parser('query', help='按配色、留白区域或示例图片查询')
+    query.add_argument('--colors', type=str, default=None, help='目标配色，逗号分隔，如 "#c8102e,#ffd700"')
+    query.add_argument('--empty', type=str, default=None,
+                       help=f"需要留白的区域，逗号分隔，可选: {', '.join(REGIONS)}")
+    query.add_argument('--like', type=str, default=None, help='示例图片，查找整体最相似的图片')
+    query.add_argument('--k', type=int, default=20, help='返回结果数')
+    args = parser.parse_args()
+
+    index = FeatureIndex(args.index_dir)
+    if args.command == 'build':
+        added = index.add_paths(iter_image_paths(args.dirs), args.workers, args.batch_size)
+        print(f"新增 {added} 张，索引共 {len(index)} 张图片")
+        return
+
+    start = time.perf_counter()
+    if args.like:
+        results = index.similar(args.like, args.k)
+    else:
+        results = index.search(
+            colors=args.colors.split(',') if args.colors else None,
+            empty=args.empty.split(',') if args.empty else None,
+            k=args.k
+        )
+    print(f"在 {len(index)} 张图片中查询耗时 {(time.perf_counter() - start) * 1000:.1f} 毫秒")
+    for path, score in results:
+        palette = ' '.join(color for color, _ in index.palette(path, top=3))
+        print(f"{score:.3f}  {palette}  {path}")
+
+
+if __name__ == '__main__':
+    main()
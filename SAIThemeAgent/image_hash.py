@@ -0,0 +1,315 @@
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from image_store import IMAGE_EXTENSIONS, is_image_store
+
+HASH_BITS = 64
+MASK_64 = (1 << 64) - 1
+
+
+def _dct_matrix(n):
+    """正交DCT-II变换矩阵，pHash对32x32灰度图做二维DCT"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+DCT_32 = _dct_matrix(32)
+
+
+def load_gray(path):
+    """解码一次图片，返回dHash用的8x9和pHash用的32x32灰度数组"""
+    with Image.open(path) as image:
+        # JPEG可在解码时直接缩小，减少大图的解码开销
+        image.draft('L', (64, 64))
+        gray = image.convert('L')
+        small = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.uint8)
+        large = np.asarray(gray.resize((32, 32), Image.BILINEAR), dtype=np.uint8)
+    return small, large
+
+
+def _bits_to_uint64(bits):
+    packed = np.packbits(bits.astype(np.uint8), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+
+def dhash_batch(small):
+    """(n, 8, 9)灰度数组 -> n个64位dHash，比较每行相邻像素的亮度"""
+    diff = small[:, :, 1:] > small[:, :, :-1]
+    return _bits_to_uint64(diff.reshape(len(small), HASH_BITS))
+
+
+def phash_batch(large):
+    """(n, 32, 32)灰度数组 -> n个64位pHash，取DCT左上8x8低频系数与中位数比较"""
+    coeffs = DCT_32 @ large.astype(np.float64) @ DCT_32.T
+    low = coeffs[:, :8, :8].reshape(len(large), HASH_BITS)
+    # 直流分量不参与中位数计算
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _bits_to_uint64(low > median)
+
+
+def hash_files(paths):
+    """在子进程中解码一批图片并向量化计算哈希，返回 [(path, phash, dhash)]，解码失败的图片跳过"""
+    loaded = []
+    for path in paths:
+        try:
+            loaded.append((path,) + load_gray(path))
+        except Exception:
+            continue
+    if not loaded:
+        return []
+    small = np.stack([item[1] for item in loaded])
+    large = np.stack([item[2] for item in loaded])
+    phashes = phash_batch(large)
+    dhashes = dhash_batch(small)
+    return [(item[0], int(p), int(d)) for item, p, d in zip(loaded, phashes, dhashes)]
+
+
+def popcount(values):
+    """uint64数组逐元素统计置位数"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _to_signed(value):
+    # SQLite的INTEGER为有符号64位
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value & MASK_64
+
+
+class PerceptualIndex:
+    """持久化的感知哈希索引，多索引哈希（MIH）实现亚线性的汉明半径查询
+
+    64位pHash切成chunks段，按鸽巢原理，距离不超过threshold的哈希至少有一段的距离不超过
+    threshold // chunks；每段建一张哈希表，查询时只枚举该半径内的段取值，再用完整汉明距离复核。
+    只有保留下来的图片进入查询表，近似重复的图片只记录duplicate_of。
+    """
+
+    def __init__(self, db_path, threshold=8, dhash_threshold=12, chunks=4, journal_mode="WAL"):
+        self.threshold = threshold
+        self.dhash_threshold = dhash_threshold
+        self.chunks = chunks
+        self.chunk_bits = HASH_BITS // chunks
+        self.chunk_mask = (1 << self.chunk_bits) - 1
+        radius = threshold // chunks
+        self.flip_masks = np.array([
+            sum(1 << bit for bit in bits)
+            for r in range(radius + 1)
+            for bits in itertools.combinations(range(self.chunk_bits), r)
+        ], dtype=np.int64)
+        # 每段一张表：段取值 -> 保留图片的序号列表；哈希按序号存于数组，复核时向量化计算
+        self.tables = [defaultdict(list) for _ in range(chunks)]
+        self.ids = []
+        self.phashes = np.empty(1024, dtype=np.uint64)
+        self.dhashes = np.empty(1024, dtype=np.uint64)
+        self.known = {}  # 已索引的 task_id -> duplicate_of（保留的图片为None）
+        self.last_rowid = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        # 多个主机共享时由调用方传入"DELETE"，WAL在网络文件系统上不可用
+        self.conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "task_id TEXT PRIMARY KEY, "
+            "phash INTEGER NOT NULL, "
+            "dhash INTEGER NOT NULL, "
+            "duplicate_of TEXT)"
+        )
+        self.conn.commit()
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        """载入其他进程新写入的记录，多个爬虫进程共享同一索引文件"""
+        rows = self.conn.execute(
+            "SELECT rowid, task_id, phash, dhash, duplicate_of FROM hashes WHERE rowid > ? ORDER BY rowid",
+            (self.last_rowid,)
+        ).fetchall()
+        for rowid, task_id, phash, dhash, duplicate_of in rows:
+            self.last_rowid = max(self.last_rowid, rowid)
+            if task_id in self.known:
+                continue
+            self.known[task_id] = duplicate_of
+            if duplicate_of is None:
+                self._insert(task_id, _to_unsigned(phash), _to_unsigned(dhash))
+
+    def _insert(self, task_id, phash, dhash):
+        position = len(self.ids)
+        if position == len(self.phashes):
+            self.phashes = np.resize(self.phashes, position * 2)
+            self.dhashes = np.resize(self.dhashes, position * 2)
+        self.ids.append(task_id)
+        self.phashes[position] = phash
+        self.dhashes[position] = dhash
+        for index, table in enumerate(self.tables):
+            table[(phash >> (index * self.chunk_bits)) & self.chunk_mask].append(position)
+
+    def _search(self, phash, dhash):
+        """返回距离最近的近似重复图片 (task_id, 距离)，没有时返回None"""
+        candidates = []
+        for index, table in enumerate(self.tables):
+            key = (phash >> (index * self.chunk_bits)) & self.chunk_mask
+            keys = (self.flip_masks ^ key).tolist()
+            candidates.extend(itertools.chain.from_iterable(filter(None, map(table.get, keys))))
+        if not candidates:
+            return None
+        positions = np.array(candidates, dtype=np.int64)
+        distances = popcount(self.phashes[positions] ^ np.uint64(phash))
+        matched = (distances <= self.threshold) & \
+            (popcount(self.dhashes[positions] ^ np.uint64(dhash)) <= self.dhash_threshold)
+        if not matched.any():
+            return None
+        best = int(np.argmin(np.where(matched, distances, HASH_BITS + 1)))
+        return self.ids[positions[best]], int(distances[best])
+
+    def duplicate_of(self, task_id):
+        """task_id被判定为近似重复时返回保留的图片task_id，否则返回None"""
+        with self.lock:
+            return self.known.get(task_id)
+
+    def add_hashes(self, task_id, phash, dhash, commit=True):
+        """查询并收录一张图片的哈希，返回其近似重复的保留图片task_id，不重复时返回None"""
+        with self.lock:
+            if task_id in self.known:
+                return self.known[task_id]
+            self._refresh()
+            if task_id in self.known:
+                return self.known[task_id]
+            match = self._search(phash, dhash)
+            duplicate_of = match[0] if match else None
+            self.known[task_id] = duplicate_of
+            if duplicate_of is None:
+                self._insert(task_id, phash, dhash)
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO hashes (task_id, phash, dhash, duplicate_of) VALUES (?, ?, ?, ?)",
+                (task_id, _to_signed(phash), _to_signed(dhash), duplicate_of)
+            )
+            self.last_rowid = max(self.last_rowid, cursor.lastrowid or 0)
+            if commit:
+                self.conn.commit()
+            return duplicate_of
+
+    def check_file(self, task_id, path):
+        """下载入库时调用：计算图片的哈希并收录，返回近似重复的保留图片task_id或None"""
+        result = hash_files([path])
+        if not result:
+            return None
+        _, phash, dhash = result[0]
+        return self.add_hashes(task_id, phash, dhash)
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def __len__(self):
+        return len(self.known)
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+
+def iter_image_paths(dirs):
+    """递归列出图片文件，跳过全局图片库目录
+
+    库内对象以sha256命名，与批次目录中的硬链接是同一张图片，收录后会把真实的task_id误判为对象的近似重复
+    """
+    for directory in dirs:
+        for root, subdirs, names in os.walk(directory):
+            if is_image_store(root):
+                subdirs[:] = []
+                continue
+            subdirs.sort()
+            for name in sorted(names):
+                if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                    yield os.path.join(root, name)
+
+
+def bulk_dedup(paths, index, max_workers=None, batch_size=256):
+    """对已有图片批量去重：进程池中解码并批量计算哈希，主进程按顺序查询收录
+
+    以文件名（不含扩展名）作为task_id，返回 保留的task_id -> [近似重复的图片路径]
+    """
+    paths = list(paths)
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    stem_paths = {}
+    duplicates = defaultdict(list)
+    done = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # map按提交顺序返回结果，保证先出现的图片被保留
+        for results in executor.map(hash_files, batches):
+            for path, phash, dhash in results:
+                task_id = os.path.splitext(os.path.basename(path))[0]
+                if task_id in stem_paths:
+                    # 同一task_id在不同批次目录中的链接，不是近似重复
+                    continue
+                stem_paths[task_id] = path
+                duplicate_of = index.add_hashes(task_id, phash, dhash, commit=False)
+                if duplicate_of is not None:
+                    duplicates[duplicate_of].append(path)
+            done += len(results)
+            index.commit()
+            elapsed = time.perf_counter() - start
+            print(f"已处理 {done}/{len(paths)} 张图片，{done / elapsed:.0f} 张/秒")
+    return dict(duplicates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='感知哈希近似重复图片去重')
+    parser.add_argument('dirs', nargs='+', help='图片目录，递归扫描，其中的全局图片库目录会被跳过')
+    parser.add_argument('--index', type=str, default='spider_data/image_store/phash.db',
+                        help='感知哈希索引文件')
+    parser.add_argument('--threshold', type=int, default=8, help='pHash汉明距离阈值（64位）')
+    parser.add_argument('--dhash-threshold', type=int, default=12, help='dHash汉明距离复核阈值')
+    parser.add_argument('--workers', type=int, default=None, help='解码进程数，默认CPU核数')
+    parser.add_argument('--batch-size', type=int, default=256, help='每个进程任务处理的图片数')
+    parser.add_argument('--report', type=str, default='duplicates.json', help='重复分组报告文件')
+    parser.add_argument('--move-duplicates', type=str, default=None,
+                        help='将近似重复的图片移动到该目录，默认只输出报告')
+    args = parser.parse_args()
+
+    index = PerceptualIndex(args.index, threshold=args.threshold, dhash_threshold=args.dhash_threshold)
+    try:
+        start = time.perf_counter()
+        duplicates = bulk_dedup(iter_image_paths(args.dirs), index, args.workers, args.batch_size)
+        total = sum(len(paths) for paths in duplicates.values())
+        print(f"发现 {total} 张近似重复图片，分属 {len(duplicates)} 组，"
+              f"耗时 {time.perf_counter() - start:.1f} 秒")
+    finally:
+        index.close()
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(duplicates, f, ensure_ascii=False, indent=2)
+    print(f"重复分组已保存到 {args.report}")
+
+    if args.move_duplicates:
+        os.makedirs(args.move_duplicates, exist_ok=True)
+        for paths in duplicates.values():
+            for path in paths:
+                shutil.move(path, os.path.join(args.move_duplicates, os.path.basename(path)))
+        print(f"已将近似重复图片移动到 {args.move_duplicates}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+import hashlib
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows下只在进程内互斥
+    fcntl = None
+
+# Content-Type到扩展名的映射，原始字节按此保存不做转码
+CONTENT_TYPE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/avif': '.avif',
+    'image/gif': '.gif',
+}
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.webp', '.avif', '.gif', '.jpeg')
+
+# 文件头魔数，Content-Type缺失或为octet-stream时使用
+MAGIC_EXTENSIONS = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF8', '.gif'),
+)
+
+
+def guess_extension(content_type, url=None, data=None):
+    """根据Content-Type、文件头或URL后缀确定扩展名"""
+    if content_type:
+        ext = CONTENT_TYPE_EXTENSIONS.get(content_type.split(';')[0].strip().lower())
+        if ext:
+            return ext
+    if data:
+        for magic, ext in MAGIC_EXTENSIONS:
+            if data.startswith(magic):
+                return ext
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return '.webp'
+        if data[4:12] in (b'ftypavif', b'ftypavis'):
+            return '.avif'
+    if url:
+        # 兼容 .../xxx.jpeg 和 Recraft的 .../xxx@jpg
+        suffix = url.split('?')[0].rsplit('@', 1)[-1].rsplit('.', 1)[-1].lower()
+        if '.' + suffix in IMAGE_EXTENSIONS:
+            return '.jpg' if suffix == 'jpeg' else '.' + suffix
+    return '.jpg'
+
+
+def find_image_file(directory, task_id):
+    """查找目录中task_id对应的图片文件，不限扩展名"""
+    for ext in IMAGE_EXTENSIONS:
+        path = os.path.join(directory, task_id + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def is_image_store(path):
+    """判断目录是否为ImageStore的根目录，批量扫描图片时用于跳过库内以sha256命名的对象文件"""
+    return os.path.isfile(os.path.join(path, "index.db")) and os.path.isdir(os.path.join(path, "objects"))
+
+
+class ImageStore:
+    """全局内容寻址图片库：按SHA-256只存一份，记录task_id到内容哈希的索引，所有批次和爬虫共享
+
+    多个主机通过网络文件系统共享图片库时使用journal_mode="DELETE"，WAL需要共享内存，在网络文件系统上不可用
+    """
+
+    def __init__(self, root="spider_data/image_store", journal_mode="WAL"):
+        self.root = root
+        self.journal_mode = journal_mode
+        self.objects_dir = os.path.join(root, "objects")
+        # 下载中的临时文件放在库内，跨批次也能断点续传
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        # task_id -> [锁, 持有或等待的线程数]，同一图片的下载在进程内互斥
+        self._temp_locks = {}
+        self._temp_locks_lock = threading.Lock()
+        # 下载线程会并发写入，多个进程也可能共享同一个库
+        self.conn = sqlite3.connect(os.path.join(root, "index.db"), timeout=60, check_same_thread=False)
+        self.conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "task_id TEXT PRIMARY KEY, "
+            "sha256 TEXT NOT NULL, "
+            "ext TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_objects_sha256 ON objects (sha256)")
+        # 增量爬取状态，如每个查询词上次看到的最新task_id
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS crawl_state ("
+            "key TEXT PRIMARY KEY, "
+            "value TEXT NOT NULL)"
+        )
+        # HTTP校验值缓存，重新爬取时用于条件请求
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS validators ("
+            "url TEXT PRIMARY KEY, "
+            "etag TEXT, "
+            "last_modified TEXT)"
+        )
+        self.conn.commit()
+
+    def _object_path(self, sha256, ext):
+        return os.path.join(self.objects_dir, sha256[:2], sha256 + ext)
+
+    def lookup(self, task_id):
+        """返回task_id对应的对象文件路径，未收录时返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT sha256, ext FROM objects WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        path = self._object_path(*row)
+        return path if os.path.exists(path) else None
+
+    def __contains__(self, task_id):
+        return self.lookup(task_id) is not None
+
+    def _record(self, task_id, sha256, ext):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO objects (task_id, sha256, ext) VALUES (?, ?, ?)",
+                (task_id, sha256, ext)
+            )
+            self.conn.commit()
+
+    def put(self, task_id, data, ext):
+        """按原始字节写入，内容相同的图片只保存一份，返回对象文件路径"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self._object_path(sha256, ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        self._record(task_id, sha256, ext)
+        return path
+
+    def put_file(self, task_id, src_path, ext, chunk_size=1024 * 1024):
+        """将已下载完成的文件移入库中，边读边算哈希，不把整张图片读入内存"""
+        digest = hashlib.sha256()
+        with open(src_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        path = self._object_path(sha256, ext)
+        if os.path.exists(path):
+            os.remove(src_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(src_path, path)
+        self._record(task_id, sha256, ext)
+        return path
+
+    def remove(self, task_id):
+        """删除task_id的收录记录，对象文件不再被其他task_id引用时一并删除，批次目录中已有的链接不受影响"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT sha256, ext FROM objects WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                return
+            self.conn.execute("DELETE FROM objects WHERE task_id = ?", (task_id,))
+            shared = self.conn.execute(
+                "SELECT 1 FROM objects WHERE sha256 = ? LIMIT 1", (row[0],)
+            ).fetchone()
+            self.conn.commit()
+        if shared is None:
+            try:
+                os.remove(self._object_path(*row))
+            except FileNotFoundError:
+                pass
+
+    def temp_path(self, task_id):
+        """task_id对应的下载临时文件路径，使用前需通过temp_file取得独占权"""
+        return os.path.join(self.tmp_dir, task_id)
+
+    @contextmanager
+    def _task_lock(self, task_id):
+        with self._temp_locks_lock:
+            entry = self._temp_locks.setdefault(task_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._temp_locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._temp_locks[task_id]
+
+    @contextmanager
+    def temp_file(self, task_id):
+        """独占task_id的下载临时文件，yield临时文件路径
+
+        同一张图片的其他下载（本进程的其他线程，或共享图片库的其他进程、主机）在此等待，
+        临时文件名固定，中断的下载在下次运行时仍可续传；进程间通过锁文件上的flock互斥，进程退出时自动释放
+        """
+        path = self.temp_path(task_id)
+        with self._task_lock(task_id):
+            if fcntl is None:
+                yield path
+                return
+            lock_path = path + ".lock"
+            while True:
+                lock_file = open(lock_path, 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                # 等待期间锁文件可能已被上一个持有者删除，此时锁住的是旧文件，需要重新打开
+                try:
+                    if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                        break
+                except FileNotFoundError:
+                    pass
+                lock_file.close()
+            try:
+                yield path
+            finally:
+                os.remove(lock_path)
+                lock_file.close()
+
+    def get_validators(self, url):
+        """返回url上次响应的ETag/Last-Modified"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified FROM validators WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return {}
+        return {'etag': row[0], 'last_modified': row[1]}
+
+    def set_validators(self, url, etag, last_modified):
+        if not etag and not last_modified:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO validators (url, etag, last_modified) VALUES (?, ?, ?)",
+                (url, etag, last_modified)
+            )
+            self.conn.commit()
+
+    def link(self, task_id, dest_dir):
+        """将已收录的图片以 task_id+原扩展名 链接到批次目录，不支持硬链接时退化为复制；未收录返回None"""
+        src_path = self.lookup(task_id)
+        if src_path is None:
+            return None
+        dest_path = os.path.join(dest_dir, task_id + os.path.splitext(src_path)[1])
+        if os.path.exists(dest_path):
+            return dest_path
+        try:
+            os.link(src_path, dest_path)
+        except OSError:
+            shutil.copyfile(src_path, dest_path)
+        return dest_path
+
+    def get_state(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM crawl_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO crawl_state (key, value) VALUES (?, ?)", (key, value)
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,253 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+Job = namedtuple("Job", ["id", "kind", "key", "payload", "attempts"])
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """放在共享存储上的SQLite任务队列，多个进程或主机通过租约领取任务，互不重复
+
+    - 任务以 (kind, key) 唯一，重复入队被忽略，同一页或同一张图片只会有一个任务
+    - 领取时在 BEGIN IMMEDIATE 事务中把任务标记为 leased 并写入租约到期时间，
+      持有者需定期heartbeat续约；进程崩溃后租约过期，任务自动被其他worker重新领取
+    - 每次领取计一次尝试，失败的任务按指数退避重新排队，超过max_attempts次后标记为failed
+    - complete是幂等的：只有第一次完成生效，租约过期后原持有者迟到的完成也会被接受
+
+    跨主机使用时依赖SQLite基于POSIX文件锁的并发控制；WAL模式需要共享内存，在网络文件系统上不可用，
+    这里使用默认的回滚日志模式。worker写入的保存目录（图片库、元数据与感知哈希库）也必须在同一共享存储上，
+    队列模式下SpiderManager以shared_storage=True把这些库同样切换为回滚日志，并通过seed写入的标记文件检查目录。
+    """
+
+    def __init__(self, db_path, lease_seconds=120.0, max_attempts=3, worker_id=None):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id or default_worker_id()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # isolation_level=None时由代码显式控制事务，领取任务需要BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "kind TEXT NOT NULL, "
+            "key TEXT NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "available_at REAL NOT NULL DEFAULT 0, "
+            "lease_owner TEXT, "
+            "lease_expires REAL, "
+            "result TEXT, "
+            "error TEXT, "
+            "updated_at REAL, "
+            "UNIQUE (kind, key))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, kind, available_at)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _transaction(self, func):
+        """在写事务中执行func(conn)，BEGIN IMMEDIATE保证领取期间其他进程无法并发写入"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self.conn)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta_default(self, key, value):
+        """只在key不存在时写入，返回最终的取值；用于多个主机约定同一个批次号"""
+        def insert(conn):
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", (key, value))
+            return conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+        return self._transaction(insert)
+
+    def enqueue(self, kind, key, payload):
+        """入队一个任务，(kind, key)已存在时忽略并返回False"""
+        return self.enqueue_many(kind, [(key, payload)]) == 1
+
+    def enqueue_many(self, kind, items):
+        """批量入队 [(key, payload)]，返回新增的任务数"""
+        now = time.time()
+        rows = [(kind, key, json.dumps(payload, ensure_ascii=False), now) for key, payload in items]
+
+        def insert(conn):
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (kind, key, payload, updated_at) VALUES (?, ?, ?, ?)", rows
+            )
+            return conn.total_changes - before
+        return self._transaction(insert)
+
+    def lease(self, kinds=None, limit=1):
+        """领取最多limit个可执行的任务：待执行且到了可执行时间的，或租约已过期的"""
+        now = time.time()
+        kind_filter = ""
+        params = []
+        if kinds:
+            kind_filter = f"AND kind IN ({','.join('?' * len(kinds))}) "
+            params.extend(kinds)
+
+        def take(conn):
+            # 租约过期且已用完尝试次数的任务不再领取，直接标记失败，避免一直处于leased
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = '租约多次过期', updated_at = ? "
+                "WHERE status = 'leased' AND lease_expires <= ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            rows = conn.execute(
+                "SELECT id, kind, key, payload, attempts FROM jobs "
+                "WHERE ((status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires <= ?)) "
+                + kind_filter + "ORDER BY id LIMIT ?",
+                [now, now] + params + [limit]
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(self.worker_id, now + self.lease_seconds, now, row[0]) for row in rows]
+            )
+            return [Job(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1) for row in rows]
+        return self._transaction(take)
+
+    def heartbeat(self, job_ids):
+        """为仍由本worker持有的任务续约，返回已失去租约的任务id"""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return []
+        now = time.time()
+
+        def renew(conn):
+            lost = []
+            for job_id in job_ids:
+                cursor = conn.execute(
+                    "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                    "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                    (now + self.lease_seconds, now, job_id, self.worker_id)
+                )
+                if cursor.rowcount == 0:
+                    lost.append(job_id)
+            return lost
+        return self._transaction(renew)
+
+    def complete(self, job, result=None):
+        """标记任务完成，返回本次调用是否生效；已完成的任务重复完成时返回False"""
+        now = time.time()
+
+        def finish(conn):
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_owner = NULL, "
+                "lease_expires = NULL, updated_at = ? WHERE id = ? AND status != 'done'",
+                (json.dumps(result, ensure_ascii=False), now, job.id)
+            )
+            return cursor.rowcount == 1
+        return self._transaction(finish)
+
+    def fail(self, job, error, retry=True):
+        """任务失败：未超过尝试次数时按指数退避重新排队，否则标记为failed；已完成的任务不受影响"""
+        now = time.time()
+        give_up = not retry or job.attempts >= self.max_attempts
+        delay = min(300.0, 5.0 * 2 ** (job.attempts - 1))
+
+        def update(conn):
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ?, lease_owner = NULL, "
+                "lease_expires = NULL, updated_at = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                ('failed' if give_up else 'pending', str(error), now + delay, now, job.id, self.worker_id)
+            )
+        self._transaction(update)
+
+    def retry_failed(self, kinds=None):
+        """将失败的任务重置为待执行并清零尝试次数，返回重置的任务数"""
+        kind_filter = ""
+        params = []
+        if kinds:
+            kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})"
+            params.extend(kinds)
+
+        def reset(conn):
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, available_at = 0, error = NULL "
+                "WHERE status = 'failed'" + kind_filter, params
+            )
+            return cursor.rowcount
+        return self._transaction(reset)
+
+    def has_unfinished(self):
+        """是否还有待执行或执行中的任务；执行中的任务可能派生新任务，worker在此之前不应退出"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM jobs WHERE status IN ('pending', 'leased') LIMIT 1"
+            ).fetchone()
+        return row is not None
+
+    def stats(self):
+        """各类任务按状态计数：{kind: {status: count}}"""
+        with self.lock:
+            rows = self.conn.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status").fetchall()
+        stats = {}
+        for kind, status, count in rows:
+            stats.setdefault(kind, {})[status] = count
+        return stats
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class LeaseKeeper:
+    """后台线程定期为正在执行的任务续约，续约间隔为租约时长的三分之一"""
+
+    def __init__(self, job_queue, interval=None):
+        self.job_queue = job_queue
+        self.interval = interval or job_queue.lease_seconds / 3
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def add(self, jobs):
+        with self.lock:
+            self.jobs.update((job.id, job) for job in jobs)
+
+    def remove(self, jobs):
+        with self.lock:
+            for job in jobs:
+                self.jobs.pop(job.id, None)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                job_ids = list(self.jobs)
+            try:
+                lost = self.job_queue.heartbeat(job_ids)
+            except sqlite3.Error as e:
+                print(f"任务续约失败: {str(e)}")
+                continue
+            if lost:
+                # 租约已被其他worker接手，本地仍会执行完，完成操作是幂等的
+                print(f"{len(lost)} 个任务的租约已失效")
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
@@ -0,0 +1,225 @@
+import re
+from typing import Dict, Optional, Tuple
+
+# 单条结果：顶层为对象，已知字段的取值类型以首字符区分，inspired_prompt必须是非空字符串
+RESULT_SCHEMA = {
+    "start": "{",
+    "fields": {"original_prompt": '"', "inspired_prompt": '"', "analysis": "{"},
+    "required": ("inspired_prompt",),
+}
+
+# 批量结果：数组，或 {"results": [...]} 这类包了一层的对象，只做语法检查
+BATCH_SCHEMA = {
+    "start": "[{",
+    "fields": {},
+    "required": (),
+}
+
+NUMBER = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$")
+LITERALS = ("true", "false", "null")
+WHITESPACE = " \t\r\n"
+HEX_DIGITS = "0123456789abcdefABCDEF"
+
+
+class JSONStreamValidator:
+    """增量JSON校验：逐块喂入LLM的输出，一旦已收到的内容不可能再构成符合schema的JSON就报告错误
+
+    与json.loads的严格模式一致：字符串中不允许未转义的控制字符，顶层值结束后不允许再有非空白内容。
+    顶层值闭合且满足schema时complete为True，end为结束位置，调用方可以立即停止读取。
+    """
+
+    def __init__(self, schema: Optional[Dict] = None):
+        self.schema = schema or RESULT_SCHEMA
+        self.stack = []          # 未闭合的容器，'{' 或 '['
+        self.expect = "value"    # value / value_or_end / key / key_or_end / colon / comma_or_end
+        self.in_string = False
+        self.string_is_key = False
+        self.escape = False
+        self.unicode_left = 0
+        self.key_chars = []
+        self.token = []          # 进行中的数字或字面量
+        self.current_key = None  # 顶层对象中当前取值对应的字段名
+        self.value_length = 0    # 顶层对象中当前字符串取值的长度
+        self.seen = {}           # 顶层对象中已完成的字段 -> 字符串取值长度（非字符串为None）
+        self.position = 0
+        self.started = False
+        self.complete = False
+        self.end = None
+        self.error = None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def _fail(self, message: str) -> bool:
+        self.error = f"第{self.position}个字符: {message}"
+        return False
+
+    def feed(self, text: str) -> bool:
+        """喂入一段输出，返回是否仍可能构成合法结果"""
+        if self.error:
+            return False
+        for char in text:
+            if not self._feed_char(char):
+                return False
+            self.position += 1
+        return True
+
+    def _feed_char(self, char: str) -> bool:
+        if self.complete:
+            if char in WHITESPACE:
+                return True
+            self.complete = False
+            return self._fail("顶层JSON结束后还有多余内容")
+        if self.in_string:
+            return self._string_char(char)
+        if self.token:
+            if char.isalnum() or char in "+-.":
+                return self._token_char(char)
+            if not self._finish_token():
+                return False
+            # 数字或字面量由其后的字符结束，该字符重新按当前状态处理
+            return self._feed_char(char)
+        if char in WHITESPACE:
+            return True
+        if not self.started:
+            self.started = True
+            if char not in self.schema["start"]:
+                return self._fail(f"输出不是以 {self.schema['start']} 开头的JSON")
+        return self._structural_char(char)
+
+    def _string_char(self, char: str) -> bool:
+        if self.unicode_left:
+            if char not in HEX_DIGITS:
+                return self._fail("无效的\\u转义")
+            self.unicode_left -= 1
+        elif self.escape:
+            self.escape = False
+            if char == "u":
+                self.unicode_left = 4
+            elif char not in '"\\/bfnrt':
+                return self._fail(f"无效的转义字符 \\{char}")
+        elif char == "\\":
+            self.escape = True
+        elif char == '"':
+            self.in_string = False
+            if self.string_is_key:
+                return self._key_done("".join(self.key_chars))
+            return self._value_done()
+        elif ord(char) < 0x20:
+            return self._fail("字符串中有未转义的控制字符")
+        if self.string_is_key:
+            self.key_chars.append(char)
+        else:
+            self.value_length += 1
+        return True
+
+    def _token_char(self, char: str) -> bool:
+        self.token.append(char)
+        token = "".join(self.token)
+        if token[0].isalpha() and not any(literal.startswith(token) for literal in LITERALS):
+            return self._fail(f"无效的字面量 {token}")
+        return True
+
+    def _finish_token(self) -> bool:
+        token = "".join(self.token)
+        self.token = []
+        if token not in LITERALS and not NUMBER.match(token):
+            return self._fail(f"无效的取值 {token}")
+        if not self._value_done():
+            return False
+        if self.complete:
+            # 结束位置在当前字符之前
+            self.end = self.position
+        return True
+
+    def _start_value(self, char: str) -> bool:
+        if len(self.stack) == 1 and self.stack[0] == "{" and self.current_key is not None:
+            expected = self.schema["fields"].get(self.current_key)
+            if expected and char != expected:
+                return self._fail(f"字段 {self.current_key} 的类型不符合要求")
+        if char == "{":
+            self.stack.append("{")
+            self.expect = "key_or_end"
+        elif char == "[":
+            self.stack.append("[")
+            self.expect = "value_or_end"
+        elif char == '"':
+            self.in_string = True
+            self.string_is_key = False
+            self.value_length = 0
+        elif char == "-" or char.isdigit() or char in "tfn":
+            self.token = []
+            return self._token_char(char)
+        else:
+            return self._fail(f"意外的字符 {char!r}")
+        return True
+
+    def _structural_char(self, char: str) -> bool:
+        expect = self.expect
+        if expect == "value":
+            return self._start_value(char)
+        if expect == "value_or_end":
+            if char == "]":
+                return self._close("[")
+            return self._start_value(char)
+        if expect in ("key", "key_or_end"):
+            if char == "}" and expect == "key_or_end":
+                return self._close("{")
+            if char == '"':
+                self.in_string = True
+                self.string_is_key = True
+                self.key_chars = []
+                return True
+            return self._fail("缺少字段名")
+        if expect == "colon":
+            if char == ":":
+                self.expect = "value"
+                return True
+            return self._fail("字段名后缺少冒号")
+        # comma_or_end
+        if char == ",":
+            self.expect = "key" if self.stack[-1] == "{" else "value"
+            return True
+        if char in "}]":
+            return self._close("{" if char == "}" else "[")
+        return self._fail(f"意外的字符 {char!r}")
+
+    def _key_done(self, key: str) -> bool:
+        if len(self.stack) == 1:
+            self.current_key = key
+        self.expect = "colon"
+        return True
+
+    def _value_done(self) -> bool:
+        if len(self.stack) == 1 and self.stack[0] == "{" and self.current_key is not None:
+            # 只有顶层对象的直接取值在这里完成，嵌套容器闭合时由_close处理
+            self.seen[self.current_key] = self.value_length
+            self.current_key = None
+        if not self.stack:
+            return self._top_level_done()
+        self.expect = "comma_or_end"
+        return True
+
+    def _close(self, opener: str) -> bool:
+        if not self.stack or self.stack[-1] != opener:
+            return self._fail("括号不匹配")
+        self.stack.pop()
+        self.value_length = 0
+        return self._value_done()
+
+    def _top_level_done(self) -> bool:
+        for field in self.schema["required"]:
+            if not self.seen.get(field):
+                return self._fail(f"缺少必需的字段 {field}")
+        self.complete = True
+        self.end = self.position + 1
+        return True
+
+    def finish(self) -> Tuple[bool, Optional[str]]:
+        """输出结束时调用：顶层为数字等尚未结束的取值在这里收尾，返回 (是否完整合法, 错误信息)"""
+        if self.token and not self.error:
+            self._finish_token()
+        if not self.complete and not self.error:
+            self.error = "输出在JSON结束前中断"
+        return self.complete, self.error
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+class LLMCache:
+    """LLM响应的磁盘缓存，按模型、请求参数和完整提示的哈希索引，支持按容量和时间淘汰"""
+
+    def __init__(self, cache_file: str = "llm_cache.db", max_bytes: int = 512 * 1024 * 1024,
+                 max_age: Optional[float] = 30 * 24 * 3600):
+        self.cache_file = cache_file
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.lock = threading.Lock()
+
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(cache_file, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, "
+            "response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        if self.max_age:
+            self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,))
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, params: Dict) -> str:
+        """请求指纹：模型名 + 全部请求参数（含渲染后的完整提示）"""
+        payload = json.dumps({"model": model, "params": params}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age and now - row[1] > self.max_age):
+                if row is not None:
+                    self._delete(key)
+                    self.conn.commit()
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self.lock:
+            self._delete(key)
+            self.conn.execute(
+                "INSERT INTO responses (key, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self.total_bytes += size
+            self.stores += 1
+            self._evict()
+            self.conn.commit()
+
+    def _delete(self, key: str):
+        row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= row[0]
+
+    def _evict(self):
+        """总大小超限时按最近访问时间淘汰"""
+        if not self.max_bytes or self.total_bytes <= self.max_bytes:
+            return
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        for key, size in rows:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= size
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,100 @@
+import json
+import os
+import socket
+import sqlite3
+
+
+class MetadataStore:
+    """基于SQLite的图片元数据存储：task_id主键索引、批量提交、原子导出image_info.json
+
+    多个主机通过网络文件系统共享同一目录时使用journal_mode="DELETE"（WAL需要共享内存，在网络文件系统上不可用），
+    并把batch_size设为1，避免未提交的批次长时间占住写锁
+    """
+
+    def __init__(self, save_dir, db_name="image_info.db", json_name="image_info.json", batch_size=50,
+                 journal_mode="WAL"):
+        self.save_dir = save_dir
+        self.db_path = os.path.join(save_dir, db_name)
+        self.json_path = os.path.join(save_dir, json_name)
+        self.batch_size = batch_size
+        self._pending = 0
+
+        is_new = not os.path.exists(self.db_path)
+        self.conn = sqlite3.connect(self.db_path, timeout=60)
+        # WAL或回滚日志模式下，写入中途崩溃都不会损坏已提交的数据
+        self.conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        if journal_mode.upper() == "WAL":
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "task_id TEXT NOT NULL UNIQUE, "
+            "data TEXT NOT NULL)"
+        )
+        self.conn.commit()
+        if is_new:
+            self._import_json()
+
+    def _import_json(self):
+        """首次创建时导入已有的image_info.json"""
+        if not os.path.exists(self.json_path):
+            return
+        try:
+            with open(self.json_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"导入旧元数据失败: {str(e)}")
+            return
+        for item in data:
+            if item.get('task_id'):
+                self.add(item)
+        self.commit()
+
+    def __contains__(self, task_id):
+        row = self.conn.execute("SELECT 1 FROM images WHERE task_id = ?", (task_id,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def add(self, img_info):
+        """追加一条记录，已存在的task_id返回False"""
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO images (task_id, data) VALUES (?, ?)",
+            (img_info['task_id'], json.dumps(img_info, ensure_ascii=False))
+        )
+        if cursor.rowcount == 0:
+            return False
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.commit()
+        return True
+
+    def commit(self):
+        if self._pending:
+            self.conn.commit()
+            self._pending = 0
+
+    def iter_items(self):
+        for (data,) in self.conn.execute("SELECT data FROM images ORDER BY seq"):
+            yield json.loads(data)
+
+    def export_json(self, json_path=None):
+        """按插入顺序导出为image_info.json格式，先写临时文件再原子替换"""
+        self.commit()
+        json_path = json_path or self.json_path
+        # 共享目录中其他主机或进程也可能同时导出
+        tmp_path = f"{json_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(self.iter_items()), f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, json_path)
+        return json_path
+
+    def close(self, export=True):
+        if export:
+            self.export_json()
+        else:
+            self.commit()
+        self.conn.close()
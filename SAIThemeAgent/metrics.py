@@ -0,0 +1,244 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+# 直方图分桶上界（秒），覆盖列表请求、图片下载与LLM调用的典型耗时
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Prometheus指标名前缀
+PREFIX = "sai_"
+
+
+class _NullTimer:
+    """未启用指标时timer()返回的空计时器，不做任何事"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _Histogram:
+    __slots__ = ("counts", "count", "sum", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(DEFAULT_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(DEFAULT_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """按分桶估算分位数，返回所在桶的上界（最后一桶返回最大值）"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return DEFAULT_BUCKETS[index] if index < len(DEFAULT_BUCKETS) else self.max
+        return self.max
+
+
+def _key(name, labels):
+    # 标签值统一转为字符串，保证排序和导出时类型一致
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + list(extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class MetricsRegistry:
+    """进程内的计数器与直方图；未启用时所有记录方法直接返回，开销只有一次属性判断"""
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.json_file = None
+        self.prom_file = None
+        self._atexit_registered = False
+
+    def enable(self, json_file=None, prom_file=None):
+        """启用指标收集；给定文件时在进程退出时分别导出JSON汇总和Prometheus文本"""
+        self.enabled = True
+        self.json_file = json_file or self.json_file
+        self.prom_file = prom_file or self.prom_file
+        if (self.json_file or self.prom_file) and not self._atexit_registered:
+            atexit.register(self.export)
+            self._atexit_registered = True
+
+    def reset(self):
+        """清空已记录的数据，子进程开始新任务前调用，避免重复计入fork时继承的数据"""
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram()
+            histogram.add(value)
+
+    def timer(self, name, **labels):
+        """用法: with metrics.timer("spider_image_download_seconds", spider="miaohua"): ..."""
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def snapshot(self):
+        """返回可JSON序列化的原始数据，用于从子进程传回主进程合并"""
+        with self.lock:
+            return {
+                "counters": [[name, list(map(list, labels)), value]
+                             for (name, labels), value in self.counters.items()],
+                "histograms": [[name, list(map(list, labels)),
+                                {"counts": h.counts, "count": h.count, "sum": h.sum, "min": h.min, "max": h.max}]
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+    def merge(self, snapshot):
+        """合并其他进程的snapshot()"""
+        if not self.enabled or not snapshot:
+            return
+        with self.lock:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, data in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = _Histogram()
+                histogram.counts = [a + b for a, b in zip(histogram.counts, data["counts"])]
+                histogram.count += data["count"]
+                histogram.sum += data["sum"]
+                for attr, pick in (("min", min), ("max", max)):
+                    if data[attr] is not None:
+                        current = getattr(histogram, attr)
+                        setattr(histogram, attr, data[attr] if current is None else pick(current, data[attr]))
+
+    def summary(self):
+        """汇总：计数器取值，直方图给出次数、总和、均值与估算的p50/p95/p99"""
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = []
+            for (name, labels), h in sorted(self.histograms.items()):
+                histograms.append({
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": h.count,
+                    "sum": round(h.sum, 6),
+                    "mean": round(h.sum / h.count, 6) if h.count else None,
+                    "min": h.min,
+                    "max": h.max,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                })
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self):
+        """Prometheus文本格式，供node_exporter的textfile collector读取"""
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{_format_labels(labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                metric = PREFIX + name
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, count in zip(DEFAULT_BUCKETS, h.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {h.count}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {h.sum}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """写出JSON汇总与Prometheus文本，先写临时文件再替换，避免采集端读到半个文件"""
+        if not self.enabled:
+            return
+        outputs = []
+        if self.json_file:
+            outputs.append((self.json_file, json.dumps(self.summary(), ensure_ascii=False, indent=2)))
+        if self.prom_file:
+            outputs.append((self.prom_file, self.to_prometheus()))
+        for path, content in outputs:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+
+# 进程内共享的默认注册表，各模块直接调用 metrics.inc / metrics.timer 等
+registry = MetricsRegistry()
+enable = registry.enable
+reset = registry.reset
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+snapshot = registry.snapshot
+merge = registry.merge
+export = registry.export
+
+
+def is_enabled():
+    return registry.enabled
@@ -1,39 +1,28 @@
-import requests
 from bs4 import BeautifulSoup
-import os
-import json
 from urllib.parse import urljoin, quote
 import time
-from PIL import Image
-import io
+import queue
+import threading
+from concurrent.futures import as_completed
+from base_spider import BaseSpider
+from image_store import find_image_file
+import metrics
 
-class MiaohuaSpider:
-    def __init__(self):
+class MiaohuaSpider(BaseSpider):
+    def __init__(self, engine=None, image_store=None, revalidate=False, dedup_index=None,
+                 image_sink=None, metadata_options=None, state_sink=None):
+        super().__init__(
+            "miaohua",
+            headers={
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+            },
+            save_dir="miaohua_images",
+            engine=engine, image_store=image_store, revalidate=revalidate, dedup_index=dedup_index,
+            image_sink=image_sink, metadata_options=metadata_options,
+        )
         self.base_url = "https://miaohua.sensetime.com/api/v2/public/gallery"
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        self.save_dir = "miaohua_images"
-        
-    def create_save_dir(self):
-        if not os.path.exists(self.save_dir):
-            os.makedirs(self.save_dir)
-            
-    def download_image(self, img_url, img_name):
-        try:
-            response = requests.get(img_url, headers=self.headers)
-            if response.status_code == 200:
-                # 将图片数据转换为PNG格式
-                image = Image.open(io.BytesIO(response.content))
-                # 修改文件名后缀为.png
-                img_name = os.path.splitext(img_name)[0] + '.png'
-                file_path = os.path.join(self.save_dir, img_name)
-                # 保存为PNG格式
-                image.save(file_path, 'PNG')
-                return True
-        except Exception as e:
-            print(f"下载图片失败: {str(e)}")
-        return False
+        # 传入时由state_sink(key, task_id)代为记录增量爬取位置，流水线借此在描述写入检查点后才记录
+        self.state_sink = state_sink
 
     def parse_image_info(self, item):
         try:
@@ -49,76 +38,190 @@ class MiaohuaSpider:
             print(f"解析图片信息失败: {str(e)}")
             return None
 
+    def fetch_page(self, page=1, per_page=30, query="春节"):
+        """请求一页列表，返回解析后的图片信息列表，请求失败返回None"""
+        params = {
+            'page': page,
+            'per_page': per_page,
+            'query': query
+        }
+        
+        with metrics.timer("spider_list_fetch_seconds", spider=self.name):
+            response = self.engine.fetch(self.base_url, params=params)
+        if response is None or response.status_code != 200:
+            print(f"请求失败: {response.status_code if response is not None else '无响应'}")
+            metrics.inc("spider_list_pages_total", spider=self.name, result="failed")
+            return None
+        metrics.inc("spider_list_pages_total", spider=self.name, result="ok")
+
+        data = response.json()
+        if data.get('code') != 0:
+            print("获取数据失败")
+            return None
+
+        image_infos = []
+        for item in data.get('info', {}).get('list', []):
+            img_info = self.parse_image_info(item)
+            if img_info:
+                image_infos.append(img_info)
+        return image_infos
+
+    def submit_downloads(self, image_infos, futures):
+        """跳过已下载的图片，其余提交到下载引擎，返回需要下载的图片信息"""
+        image_list = []
+        for img_info in image_infos:
+            # 检查图片是否已下载
+            img_name = img_info['task_id']
+            if find_image_file(self.save_dir, img_name):
+                print(f"图片 {img_name} 已存在，跳过下载")
+                metrics.inc("spider_images_total", spider=self.name, result="exists")
+            elif self.is_near_duplicate(img_name):
+                # 已判定为其他图片的近似重复，不再下载
+                continue
+            elif not self.revalidate and self.image_store.link(img_name, self.save_dir):
+                # 其他批次已下载过，直接链接，不发起网络请求
+                print(f"图片 {img_name} 已在全局图片库中，跳过下载")
+                metrics.inc("spider_images_total", spider=self.name, result="linked")
+                self.save_image_info(img_info)
+            else:
+                image_list.append(img_info)
+                # 交给下载引擎并发下载，限速由引擎按主机控制
+                future = self.engine.submit(self.download_image, img_info['img_url'], img_name)
+                futures[future] = (img_info, img_name)
+        return image_list
+
+    def collect_downloads(self, futures, wait=True):
+        """处理已完成的下载，元数据在主线程中顺序写入；wait为False时只处理已完成的部分"""
+        done = as_completed(futures) if wait else [future for future in futures if future.done()]
+        for future in list(done):
+            img_info, img_name = futures.pop(future)
+            if future.result():
+                print(f"成功下载图片: {img_name}")
+                self.save_image_info(img_info)
+        if self.metadata is not None:
+            self.metadata.commit()
+
     def crawl(self, page=1, per_page=30, query="春节"):
         try:
-            params = {
-                'page': page,
-                'per_page': per_page,
-                'query': query
-            }
-            
-            response = requests.get(self.base_url, params=params, headers=self.headers)
-            if response.status_code != 200:
-                print(f"请求失败: {response.status_code}")
+            image_infos = self.fetch_page(page, per_page, query)
+            if not image_infos:
                 return []
 
-            data = response.json()
-            if data.get('code') != 0:
-                print("获取数据失败")
-                return []
-
-            image_list = []
-            for item in data.get('info', {}).get('list', []):
-                img_info = self.parse_image_info(item)
-                if img_info:
-                    # 检查图片是否已下载
-                    img_name = f"{img_info['task_id']}.png"
-                    if not os.path.exists(os.path.join(self.save_dir, img_name)):
-                        image_list.append(img_info)
-                        
-                        if self.download_image(img_info['img_url'], img_name):
-                            print(f"成功下载图片: {img_name}")
-                            self.save_image_info(img_info)
-                        time.sleep(1)
-                    else:
-                        print(f"图片 {img_name} 已存在，跳过下载")
-
+            futures = {}
+            image_list = self.submit_downloads(image_infos, futures)
+            self.collect_downloads(futures)
             return image_list
 
         except Exception as e:
             print(f"爬取失败: {str(e)}")
             return []
 
-    def save_image_info(self, img_info):
-        json_file = os.path.join(self.save_dir, 'image_info.json')
+    def crawl_pages(self, query="春节", per_page=30, max_pages=None, prefetch=2, incremental=True):
+        """流水线翻页：后台线程预取列表页，翻页与下载重叠进行
+
+        遇到空页（列表末尾）或上次记录的最新task_id时自动停止；incremental为True且没有上次记录时，
+        整页图片均已收录也会停止（传入state_sink时除外），为False时完整翻页。列表请求失败时停止翻页但不视为到达末尾。
+        incremental为True时只有真正到达上次记录的位置、列表末尾，或没有上次记录时遇到整页已收录，
+        才记录本次看到的最新task_id；因max_pages或请求失败提前停止时保留原记录，下次从头爬到原记录处，中间的页不会被跳过
+        """
+        state_key = f"miaohua:{query}"
+        high_water = self.image_store.get_state(state_key) if incremental else None
+        pages = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def prefetch_pages():
+            page = 1
+            try:
+                while not stop.is_set() and (max_pages is None or page <= max_pages):
+                    print(f"正在爬取第{page}页...")
+                    image_infos = self.fetch_page(page, per_page, query)
+                    put((page, image_infos))
+                    # 空页为列表末尾，None为请求失败，两种情况都不再继续翻页
+                    if not image_infos:
+                        return
+                    page += 1
+            except Exception as e:
+                print(f"爬取失败: {str(e)}")
+            finally:
+                put((None, None))
+
+        producer = threading.Thread(target=prefetch_pages, name="miaohua-prefetch", daemon=True)
+        producer.start()
+
+        image_list = []
+        futures = {}
+        newest = None
+        # 是否完整看到了上次记录之后的全部新图片：到达上次记录的位置、列表末尾或（没有记录时）整页已收录
+        caught_up = False
         try:
-            if os.path.exists(json_file):
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                data = []
-            
-            # 检查是否已存在相同的task_id
-            if not any(item.get('task_id') == img_info['task_id'] for item in data):
-                data.append(img_info)
-                
-                with open(json_file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
+            while True:
+                page, image_infos = pages.get()
+                if page is None:
+                    break
+                if image_infos is None:
+                    print(f"第{page}页请求失败，停止翻页")
+                    break
+                if not image_infos:
+                    print(f"第{page}页没有数据，已到达列表末尾")
+                    caught_up = True
+                    break
+                if newest is None:
+                    newest = image_infos[0]['task_id']
+
+                reached = False
+                task_ids = [img_info['task_id'] for img_info in image_infos]
+                if high_water in task_ids:
+                    image_infos = image_infos[:task_ids.index(high_water)]
+                    reached = True
+                all_known = all(img_info['task_id'] in self.image_store for img_info in image_infos)
+
+                new_images = self.submit_downloads(image_infos, futures)
+                image_list.extend(new_images)
+                self.collect_downloads(futures, wait=False)
+                print(f"第{page}页爬取完成，获取到{len(new_images)}张新图片信息")
+
+                if reached:
+                    print("已到达上次爬取的位置，停止翻页")
+                    caught_up = True
+                    break
+                # 有上次记录时必须翻到记录处，之前因提前停止留下的页才能补上
+                # 没有上次记录时整页已收录即视为追上，记录本次看到的最新task_id，之后的运行按记录停止；
+                # 有state_sink时图片入库后还需下游处理，已收录不代表已处理完成，不使用这一停止条件
+                if incremental and high_water is None and all_known and self.state_sink is None:
+                    print(f"第{page}页的图片均已收录，停止翻页")
+                    caught_up = True
+                    break
+        finally:
+            stop.set()
+            self.collect_downloads(futures)
+
+        if incremental and newest and caught_up:
+            if self.state_sink is not None:
+                self.state_sink(state_key, newest)
             else:
-                print(f"图片 {img_info['task_id']} 信息已存在，跳过保存")
-                
-        except Exception as e:
-            print(f"保存图片信息失败: {str(e)}")
+                self.image_store.set_state(state_key, newest)
+        return image_list
 
 def main():
     spider = MiaohuaSpider()
     spider.create_save_dir()
     
-    for page in range(1, 2):
-        print(f"正在爬取第{page}页...")
-        images = spider.crawl(page=page)
-        print(f"第{page}页爬取完成，获取到{len(images)}张图片信息")
-        time.sleep(2)
+    try:
+        for page in range(1, 2):
+            print(f"正在爬取第{page}页...")
+            images = spider.crawl(page=page)
+            print(f"第{page}页爬取完成，获取到{len(images)}张图片信息")
+            time.sleep(2)
+    finally:
+        spider.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,353 @@
+import argparse
+import queue
+import threading
+import time
+
+import metrics
+from llm_cache import LLMCache
+from PromptsGenerator import LLMClient, PromptGenerator, get_description
+from prompt_corpus import PromptCorpus
+from result_checkpoint import ResultCheckpoint
+from spider_manager import SpiderManager, load_queries, query_dir_name
+
+# 队列结束标记
+_DONE = object()
+
+
+class CrawlPipeline:
+    """爬取与提示生成在同一进程内流水线运行
+
+    爬虫线程（每种爬虫一个）在写入图片元数据时把描述放入有界的描述队列，
+    LLM工作线程从中取出描述生成提示，结果经有界的结果队列交给主线程写入检查点。
+    队列满时上游阻塞等待，爬取速度被限制在LLM的处理能力之内，内存占用有上限。
+    """
+
+    def __init__(self, manager, generator, checkpoint=None, concurrency=4, queue_size=32,
+                 report_interval=10.0, done=None):
+        self.manager = manager
+        self.generator = generator
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency
+        self.report_interval = report_interval
+        self.queues = {
+            'descriptions': queue.Queue(maxsize=queue_size),
+            'results': queue.Queue(maxsize=queue_size),
+        }
+        self.stop = threading.Event()
+        self.lock = threading.Lock()
+        # 已生成或已入队的描述，同一描述只请求一次；done为检查点中已有的描述
+        self.seen = set(done or ())
+        self.counts = {'crawled': 0, 'skipped': 0, 'generated': 0, 'failed': 0, 'written': 0}
+        self.blocked = {name: 0.0 for name in self.queues}
+        self.max_depth = {name: 0 for name in self.queues}
+        self.start_time = None
+        # 已放入描述队列但尚未写入检查点的描述，以及等待这些描述写完才记录的增量爬取位置
+        self.outstanding = set()
+        self.deferred_states = []  # [(key, task_id, 尚未写入的描述集合)]
+        manager.image_sink = self.submit_image
+        manager.state_sink = self.defer_state
+
+    def _put(self, name, item):
+        """放入有界队列，队列满时阻塞（背压），记录阻塞时长；停止后放弃并返回False"""
+        target = self.queues[name]
+        start = time.perf_counter()
+        while not self.stop.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        else:
+            return False
+        waited = time.perf_counter() - start
+        metrics.observe("pipeline_queue_wait_seconds", waited, queue=name)
+        with self.lock:
+            self.blocked[name] += waited
+            self.max_depth[name] = max(self.max_depth[name], target.qsize())
+        return True
+
+    def _get(self, name, block=True):
+        """从队列取出一项；停止后返回_DONE，block为False且队列为空时返回None"""
+        target = self.queues[name]
+        if not block:
+            try:
+                return target.get_nowait()
+            except queue.Empty:
+                return None
+        while not self.stop.is_set():
+            try:
+                return target.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.counts[key] += value
+        metrics.inc("pipeline_items_total", value, stage=key)
+
+    def submit_image(self, img_info):
+        """爬虫写入元数据后的回调，在爬虫线程中执行，描述队列满时阻塞爬虫"""
+        description = get_description(img_info)
+        with self.lock:
+            duplicate = not description or description in self.seen
+            if not duplicate:
+                self.seen.add(description)
+        if duplicate:
+            self._count('skipped')
+            return
+        with self.lock:
+            self.outstanding.add(description)
+        self._count('crawled')
+        self._put('descriptions', description)
+
+    def defer_state(self, key, value):
+        """妙绘AI爬完一个查询词后的回调：该查询词的描述可能仍在队列中等待生成，
+        等此前放入队列的描述全部写入检查点后才记录增量爬取位置，中途崩溃时--resume会重新爬取这些图片"""
+        with self.lock:
+            waiting = set(self.outstanding)
+            if waiting:
+                self.deferred_states.append((key, value, waiting))
+                return
+        self.manager.image_store.set_state(key, value)
+
+    def _written(self, description):
+        """描述的结果已写入检查点，记录不再等待任何描述的增量爬取位置"""
+        with self.lock:
+            self.outstanding.discard(description)
+            ready = []
+            for entry in self.deferred_states:
+                entry[2].discard(description)
+                if not entry[2]:
+                    ready.append(entry)
+            self.deferred_states = [entry for entry in self.deferred_states if entry[2]]
+        for key, value, _ in ready:
+            self.manager.image_store.set_state(key, value)
+
+    def crawl_worker(self, spider_name, queries, options):
+        """依次运行一种爬虫的各个查询词"""
+        for query in queries:
+            if self.stop.is_set():
+                break
+            try:
+                if spider_name == 'miaohua':
+                    self.manager.run_miaohua_spider(query=query, pages=options.get('miaohua_pages'),
+                                                    sub_dir=query_dir_name(query))
+                else:
+                    self.manager.run_recraft_spider(query=query, time_limit=options.get('recraft_time_limit'),
+                                                    mode=options.get('recraft_mode', 'api'),
+                                                    sub_dir=query_dir_name(query))
+            except Exception as e:
+                print(f"[{spider_name}] {query} 爬取失败: {str(e)}")
+
+    def _next_chunk(self, first):
+        """批量模式下不等待，把队列中已有的描述按批次上限一并取出
+
+        返回 (描述列表, 是否已取到结束标记, 放不进本批、留给下一批的描述)
+        """
+        chunk = [first]
+        if not self.generator.batch_token_budget:
+            return chunk, False, None
+        while True:
+            item = self._get('descriptions', block=False)
+            if item is None:
+                return chunk, False, None
+            if item is _DONE:
+                return chunk, True, None
+            if not self.generator.batch_has_room(chunk, item):
+                return chunk, False, item
+            chunk.append(item)
+
+    def llm_worker(self):
+        """取出描述生成提示，每个工作线程消费恰好一个结束标记后退出"""
+        finished = False
+        carry = None
+        while not finished:
+            item = carry if carry is not None else self._get('descriptions')
+            if item is _DONE:
+                break
+            chunk, finished, carry = self._next_chunk(item)
+            try:
+                results = self.generator.generate_chunk(chunk)
+            except Exception as e:
+                print(f"生成提示失败: {str(e)}")
+                results = [self.generator._get_error_result(description) for description in chunk]
+            for description, result in zip(chunk, results):
+                failed = ResultCheckpoint.is_failed(result)
+                self._count('failed' if failed else 'generated')
+                metrics.inc("prompt_results_total", result="failed" if failed else "ok")
+                if not self._put('results', (description, result)):
+                    return
+
+    def report(self, final=False):
+        """输出各阶段累计数量、吞吐与队列深度"""
+        elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+        with self.lock:
+            counts = dict(self.counts)
+            blocked = dict(self.blocked)
+            max_depth = dict(self.max_depth)
+        depths = {name: target.qsize() for name, target in self.queues.items()}
+        for name, depth in depths.items():
+            metrics.observe("pipeline_queue_depth", depth, queue=name)
+        processed = counts['generated'] + counts['failed']
+        print(f"[流水线 {elapsed:.0f}s] 爬取 {counts['crawled']} 条（{counts['crawled'] / elapsed:.2f} 条/秒），"
+              f"描述队列 {depths['descriptions']}/{self.queues['descriptions'].maxsize}，"
+              f"生成 {processed} 条（{processed / elapsed:.2f} 条/秒，失败 {counts['failed']}），"
+              f"结果队列 {depths['results']}/{self.queues['results'].maxsize}，"
+              f"写入 {counts['written']} 条")
+        if final:
+            print(f"重复或空描述跳过 {counts['skipped']} 条；"
+                  f"爬虫因描述队列满阻塞 {blocked['descriptions']:.1f} 秒（最大深度 {max_depth['descriptions']}），"
+                  f"生成因结果队列满阻塞 {blocked['results']:.1f} 秒（最大深度 {max_depth['results']}）")
+
+    def _reporter(self, finished):
+        while not finished.wait(self.report_interval):
+            self.report()
+
+    def run(self, spiders, queries, **options):
+        """运行流水线直到所有爬虫结束且描述全部生成完毕，返回本次生成的结果（按完成顺序）"""
+        self.start_time = time.perf_counter()
+        crawlers = [
+            threading.Thread(target=self.crawl_worker, args=(name, queries, options),
+                             name=f"pipeline-crawl-{name}", daemon=True)
+            for name in spiders
+        ]
+        workers = [
+            threading.Thread(target=self.llm_worker, name=f"pipeline-llm-{index}", daemon=True)
+            for index in range(self.concurrency)
+        ]
+
+        def close_descriptions():
+            for thread in crawlers:
+                thread.join()
+            for _ in workers:
+                self._put('descriptions', _DONE)
+
+        def close_results():
+            for thread in workers:
+                thread.join()
+            self._put('results', _DONE)
+
+        finished = threading.Event()
+        helpers = [
+            threading.Thread(target=close_descriptions, name="pipeline-close-descriptions", daemon=True),
+            threading.Thread(target=close_results, name="pipeline-close-results", daemon=True),
+            threading.Thread(target=self._reporter, args=(finished,), name="pipeline-reporter", daemon=True),
+        ]
+        for thread in crawlers + workers + helpers:
+            thread.start()
+
+        results = []
+        try:
+            # 检查点在主线程中顺序写入
+            while True:
+                item = self._get('results')
+                if item is _DONE:
+                    break
+                description, result = item
+                if self.checkpoint is not None:
+                    self.checkpoint.append(description, result)
+                results.append(result)
+                self._count('written')
+                self._written(description)
+        except KeyboardInterrupt:
+            print("收到中断，停止流水线，已生成的结果保留在检查点中")
+            raise
+        finally:
+            self.stop.set()
+            finished.set()
+            self.report(final=True)
+        return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='爬取与提示生成流水线：爬到的描述立即交给LLM生成提示')
+    parser.add_argument('--spider', type=str, choices=['all', 'miaohua', 'recraft'], default='all',
+                        help='选择要运行的爬虫')
+    parser.add_argument('--queries', type=str, nargs='+', default=None, help='搜索关键词，可多个')
+    parser.add_argument('--query-file', type=str, default=None, help='搜索关键词文件，每行一个')
+    parser.add_argument('--miaohua-pages', type=int, default=None,
+                        help='妙绘AI每个关键词最多爬取页数，默认翻页直到没有新图片')
+    parser.add_argument('--recraft-time-limit', type=int, default=100, help='Recraft每个关键词的运行时间限制（秒）')
+    parser.add_argument('--recraft-mode', type=str, choices=['api', 'browser', 'longrun'], default='api',
+                        help='Recraft爬取方式')
+    parser.add_argument('--save-dir', type=str, default='spider_data', help='爬虫数据保存根目录')
+    parser.add_argument('--full-crawl', action='store_true', help='妙绘AI忽略上次记录的位置，重新完整翻页')
+    parser.add_argument('--phash-dedup', action='store_true', help='丢弃与已收录图片近似重复的图片')
+    parser.add_argument('--system-prompt', type=str, default='prompt_inspiration.md', help='系统提示文件路径')
+    parser.add_argument('--model', type=str, default='gpt4o', choices=['deucalion', 'gpt4turbo', 'gpt4o'],
+                        help='使用的模型')
+    parser.add_argument('--timeout', type=int, default=420, help='LLM请求超时时间')
+    parser.add_argument('--concurrency', type=int, default=4, help='LLM并发请求数')
+    parser.add_argument('--max-retries', type=int, default=3, help='单条请求最大尝试次数')
+    parser.add_argument('--stream', action='store_true', help='流式读取LLM响应，输出不合格时提前取消并重试')
+    parser.add_argument('--batch-token-budget', type=int, default=None,
+                        help='批量模式下每次请求中描述部分的token预算，默认不启用批量模式')
+    parser.add_argument('--batch-max-items', type=int, default=16, help='批量模式下每次请求的最大描述数')
+    parser.add_argument('--cache-file', type=str, default='llm_cache.db', help='LLM响应缓存文件')
+    parser.add_argument('--no-cache', action='store_true', help='不读取缓存，强制重新请求')
+    parser.add_argument('--queue-size', type=int, default=32, help='描述队列与结果队列的容量')
+    parser.add_argument('--report-interval', type=float, default=10.0, help='输出各阶段状态的间隔（秒）')
+    parser.add_argument('--output-file', type=str, default='generated_prompts.json', help='输出文件路径')
+    parser.add_argument('--checkpoint-file', type=str, default=None,
+                        help='逐条写入结果的JSONL检查点，默认为 <output-file>l')
+    parser.add_argument('--resume', action='store_true', help='跳过检查点中已生成的描述')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='检查点已存在且未指定--resume时清空后重新生成，默认拒绝运行以免覆盖已有结果')
+    parser.add_argument('--corpus-dir', type=str, default=None, help='结束后将结果增量导入该列式分析库目录')
+    parser.add_argument('--metrics-json', type=str, default=None, help='退出时写入指标汇总的JSON文件')
+    parser.add_argument('--metrics-prom', type=str, default=None, help='退出时写入的Prometheus文本文件')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.metrics_json or args.metrics_prom:
+        metrics.enable(json_file=args.metrics_json, prom_file=args.metrics_prom)
+
+    queries = list(args.queries or [])
+    if args.query_file:
+        queries.extend(load_queries(args.query_file))
+    if not queries:
+        queries = ['春节']
+    spiders = ['miaohua', 'recraft'] if args.spider == 'all' else [args.spider]
+
+    checkpoint = ResultCheckpoint(args.checkpoint_file or args.output_file + 'l')
+    if not args.resume and not args.overwrite and checkpoint.has_records():
+        raise SystemExit(f"检查点 {checkpoint.path} 已有结果，继续生成请加 --resume，清空重新生成请加 --overwrite")
+
+    cache = LLMCache(args.cache_file)
+    llm_client = LLMClient(args.timeout, args.model, max_retries=args.max_retries,
+                           cache=cache, bypass_cache=args.no_cache, stream=args.stream)
+    generator = PromptGenerator(args.system_prompt, llm_client,
+                                batch_token_budget=args.batch_token_budget,
+                                batch_max_items=args.batch_max_items)
+    done = None
+    if args.resume:
+        done = [description for description, result in checkpoint.load().items()
+                if not checkpoint.is_failed(result)]
+        print(f"从检查点恢复 {len(done)} 条已生成的描述")
+    else:
+        checkpoint.reset()
+
+    manager = SpiderManager(base_dir=args.save_dir, incremental=not args.full_crawl,
+                            phash_dedup=args.phash_dedup)
+    pipeline = CrawlPipeline(manager, generator, checkpoint, concurrency=args.concurrency,
+                             queue_size=args.queue_size, report_interval=args.report_interval, done=done)
+    try:
+        pipeline.run(spiders, queries, miaohua_pages=args.miaohua_pages,
+                     recraft_time_limit=args.recraft_time_limit, recraft_mode=args.recraft_mode)
+    finally:
+        manager.close()
+        cache.close()
+        count = checkpoint.compact(args.output_file)
+        print(f"检查点中的 {count} 条结果已保存到 {args.output_file}")
+
+    if args.corpus_dir:
+        corpus = PromptCorpus(args.corpus_dir)
+        added = corpus.ingest(args.output_file)
+        print(f"已将 {added} 条新结果导入分析库 {args.corpus_dir}，共 {len(corpus)} 条")
+
+
+if __name__ == '__main__':
+    main()
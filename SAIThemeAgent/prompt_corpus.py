@@ -0,0 +1,355 @@
+import argparse
+import json
+import os
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from result_checkpoint import ResultCheckpoint
+
+# 分析结果中适合字典编码的低基数字段，存为category列
+CATEGORICAL_COLUMNS = ("art_style", "mood", "scene_type")
+TEXT_COLUMNS = ("original_prompt", "inspired_prompt", "composition", "color_scheme")
+FILTER_COLUMNS = ("row_id",) + CATEGORICAL_COLUMNS
+DEFAULT_COLUMNS = ("inspired_prompt",)
+
+
+def flatten_result(result: Dict) -> Dict:
+    """将一条生成结果展开为一行，analysis中的字段提升为列"""
+    analysis = result.get("analysis") or {}
+    elements = analysis.get("main_elements") or []
+    if isinstance(elements, str):
+        elements = [elements]
+    row = {column: str(result.get(column) or "") for column in ("original_prompt", "inspired_prompt")}
+    for column in CATEGORICAL_COLUMNS + ("composition", "color_scheme"):
+        row[column] = str(analysis.get(column) or "").strip()
+    row["main_elements"] = [str(element).strip() for element in elements if str(element).strip()]
+    return row
+
+
+def normalize_element(element: str) -> str:
+    return element.strip().lower()
+
+
+def _category_matches(series: pd.Series, values: List[str]) -> pd.Series:
+    """在category字典上做不区分大小写的子串匹配，再按编码筛选行，不逐行比较字符串"""
+    names = series.cat.categories.astype(str).str.lower()
+    matched = np.zeros(len(names), dtype=bool)
+    for value in values:
+        matched |= np.asarray(names.str.contains(value.lower(), regex=False), dtype=bool)
+    return series.isin(series.cat.categories[matched])
+
+
+class PromptCorpus:
+    """生成结果的列式分析库：结果按批次写成Parquet分片，附带main_elements倒排索引
+
+    目录结构:
+        manifest.json                分片列表、每个分片的起始row_id，以及各来源文件的读取进度
+        part-00001.parquet           一批结果，art_style/mood/scene_type为category列
+        part-00001.elements.parquet  倒排索引：规范化后的元素（category） -> row_id
+    """
+
+    def __init__(self, corpus_dir: str = "prompt_corpus"):
+        self.corpus_dir = corpus_dir
+        self.manifest_file = os.path.join(corpus_dir, "manifest.json")
+        os.makedirs(corpus_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+        self._element_index = None
+        self._known_prompts = None
+
+    def _load_manifest(self) -> Dict:
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {"parts": [], "sources": {}, "next_row_id": 0, "next_part": 1}
+
+    def _save_manifest(self):
+        tmp_file = self.manifest_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.manifest_file)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.corpus_dir, name)
+
+    def __len__(self):
+        return sum(part["rows"] for part in self.manifest["parts"])
+
+    # ---------- 写入 ----------
+
+    def _iter_source(self, source: str) -> Iterator[Dict]:
+        """读取来源文件中尚未导入的结果
+
+        JSONL检查点从上次的字节偏移继续读，只消费完整的行；JSON数组文件大小和修改时间
+        都未变化时跳过，变化时整体重读，已导入的结果在ingest中按original_prompt去重。
+        """
+        key = os.path.abspath(source)
+        state = self.manifest["sources"].get(key, {})
+        stat = os.stat(source)
+        if source.endswith(".jsonl"):
+            offset = state.get("offset", 0)
+            if offset > stat.st_size:
+                # 检查点被reset重写过，从头读取
+                offset = 0
+            with open(source, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    yield record.get("result") or {}
+            self.manifest["sources"][key] = {"offset": offset}
+            return
+        if state.get("size") == stat.st_size and state.get("mtime") == stat.st_mtime:
+            return
+        with open(source, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+        yield from results
+        self.manifest["sources"][key] = {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def known_prompts(self) -> set:
+        """已入库的original_prompt，只读取这一列"""
+        if self._known_prompts is None:
+            self._known_prompts = set()
+            for part in self.manifest["parts"]:
+                frame = pd.read_parquet(self._path(part["file"]), columns=["original_prompt"])
+                self._known_prompts.update(frame["original_prompt"])
+        return self._known_prompts
+
+    def add_results(self, results: Iterable[Dict], source: str = "") -> int:
+        """导入一批结果，跳过失败的结果和已入库的original_prompt，返回新增行数"""
+        known = self.known_prompts()
+        rows = []
+        for result in results:
+            if ResultCheckpoint.is_failed(result):
+                continue
+            row = flatten_result(result)
+            if row["original_prompt"] in known:
+                continue
+            known.add(row["original_prompt"])
+            rows.append(row)
+        if rows:
+            self._write_part(rows, source)
+        return len(rows)
+
+    def ingest(self, source: str) -> int:
+        """增量导入生成结果文件（JSON数组或JSONL检查点），返回新增行数"""
+        added = self.add_results(self._iter_source(source), source=os.path.basename(source))
+        self._save_manifest()
+        return added
+
+    def _write_part(self, rows: List[Dict], source):
+        """写入一个分片及其倒排索引；source为整批的来源文件名，或与rows等长的列表"""
+        start = self.manifest["next_row_id"]
+        frame = pd.DataFrame(rows)
+        frame.insert(0, "row_id", pd.RangeIndex(start, start + len(frame)).astype("int64"))
+        for column in CATEGORICAL_COLUMNS:
+            frame[column] = frame[column].astype("category")
+        frame["source"] = pd.Categorical(source if isinstance(source, list) else [source] * len(frame))
+
+        elements = frame[["row_id", "main_elements"]].explode("main_elements").dropna()
+        elements = pd.DataFrame({
+            "element": elements["main_elements"].map(normalize_element).astype("category"),
+            "row_id": elements["row_id"].astype("int64"),
+        }).drop_duplicates()
+
+        name = f"part-{self.manifest['next_part']:05d}"
+        frame.to_parquet(self._path(name + ".parquet"), index=False)
+        elements.to_parquet(self._path(name + ".elements.parquet"), index=False)
+        self.manifest["parts"].append({
+            "file": name + ".parquet",
+            "elements": name + ".elements.parquet",
+            "start": start,
+            "rows": len(frame),
+        })
+        self.manifest["next_row_id"] = start + len(frame)
+        self.manifest["next_part"] += 1
+        self._element_index = None
+
+    def compact(self) -> int:
+        """将增量导入产生的小分片合并为一个分片并重建倒排索引，返回合并前的分片数"""
+        parts = self.manifest["parts"]
+        if len(parts) <= 1:
+            return len(parts)
+        frames = [pd.read_parquet(self._path(part["file"])) for part in parts]
+        frame = pd.concat(frames, ignore_index=True)
+        rows = frame.drop(columns=["row_id", "source"]).to_dict("records")
+        for row in rows:
+            row["main_elements"] = list(row["main_elements"])
+
+        self.manifest["parts"] = []
+        self.manifest["next_row_id"] = 0
+        self._write_part(rows, frame["source"].astype(str).tolist())
+        self._save_manifest()
+        for part in parts:
+            for name in (part["file"], part["elements"]):
+                os.remove(self._path(name))
+        return len(parts)
+
+    # ---------- 查询 ----------
+
+    def element_index(self) -> pd.DataFrame:
+        """合并所有分片的倒排索引（element, row_id），同一实例内缓存"""
+        if self._element_index is None:
+            frames = [pd.read_parquet(self._path(part["elements"])) for part in self.manifest["parts"]]
+            if frames:
+                index = pd.concat(frames, ignore_index=True)
+                index["element"] = index["element"].astype(str).astype("category")
+            else:
+                index = pd.DataFrame({"element": pd.Categorical([]), "row_id": pd.Series([], dtype="int64")})
+            self._element_index = index
+        return self._element_index
+
+    def rows_with_elements(self, elements: List[str], match_all: bool = True) -> set:
+        """倒排索引查询：元素按子串匹配，match_all时要求包含全部元素，否则任一即可"""
+        index = self.element_index()
+        result = None
+        for element in elements:
+            rows = set(index["row_id"][_category_matches(index["element"], [normalize_element(element)])])
+            if result is None:
+                result = rows
+            else:
+                result = result & rows if match_all else result | rows
+        return result or set()
+
+    def query(self, art_style: Optional[List[str]] = None, mood: Optional[List[str]] = None,
+              scene_type: Optional[List[str]] = None, elements: Optional[List[str]] = None,
+              match_all: bool = True, columns: Optional[List[str]] = None,
+              limit: Optional[int] = None) -> pd.DataFrame:
+        """按分类字段和main_elements筛选，每个分片只读取筛选和输出需要的列
+
+        art_style/mood/scene_type各自给出的多个取值之间为“或”，不同字段之间为“且”，
+        均为不区分大小写的子串匹配。
+        """
+        columns = list(columns or DEFAULT_COLUMNS)
+        filters = {"art_style": art_style, "mood": mood, "scene_type": scene_type}
+        candidates = self.rows_with_elements(elements, match_all) if elements else None
+        read_columns = list(dict.fromkeys(list(FILTER_COLUMNS) + columns))
+
+        frames = []
+        found = 0
+        for part in self.manifest["parts"]:
+            if candidates is not None and not any(
+                    part["start"] <= row_id < part["start"] + part["rows"] for row_id in candidates):
+                continue
+            frame = pd.read_parquet(self._path(part["file"]), columns=read_columns)
+            mask = pd.Series(True, index=frame.index)
+            for column, values in filters.items():
+                if values:
+                    mask &= _category_matches(frame[column], values)
+            if candidates is not None:
+                mask &= frame["row_id"].isin(candidates)
+            frame = frame[mask]
+            if frame.empty:
+                continue
+            frames.append(frame)
+            found += len(frame)
+            if limit is not None and found >= limit:
+                break
+
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        result = pd.concat(frames, ignore_index=True)
+        # 各分片的category字典不同，合并后重新编码
+        for column in CATEGORICAL_COLUMNS:
+            if column in result:
+                result[column] = result[column].astype(str).astype("category")
+        if limit is not None:
+            result = result.head(limit)
+        return result[columns]
+
+    def value_counts(self, column: str, top: Optional[int] = None) -> pd.Series:
+        """某个分类字段或main_elements的取值分布"""
+        if column == "main_elements":
+            counts = self.element_index()["element"].astype(str).value_counts()
+        else:
+            values = [pd.read_parquet(self._path(part["file"]), columns=[column])[column].astype(str)
+                      for part in self.manifest["parts"]]
+            counts = pd.concat(values).value_counts() if values else pd.Series(dtype="int64")
+        return counts.head(top) if top else counts
+
+
+def write_output(frame: pd.DataFrame, output_file: Optional[str], output_format: str):
+    if output_format == "txt":
+        text = "".join(f"{value}\n" for value in frame.iloc[:, 0])
+    elif output_format == "tsv":
+        text = frame.to_csv(sep="\t", index=False)
+    else:
+        text = frame.to_json(orient="records", force_ascii=False, indent=2) + "\n"
+    if output_file:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"已导出 {len(frame)} 条结果到 {output_file}")
+    else:
+        print(text, end="")
+
+
+def split_values(value: Optional[str]) -> Optional[List[str]]:
+    return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成结果的列式分析库')
+    parser.add_argument('--corpus_dir', type=str, default='prompt_corpus', help='分析库目录')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest = subparsers.add_parser('ingest', help='增量导入生成结果（JSON数组或JSONL检查点）')
+    ingest.add_argument('files', nargs='+', help='generated_prompts.json 或其检查点 generated_prompts.jsonl')
+
+    subparsers.add_parser('compact', help='合并增量导入产生的分片')
+
+    query = subparsers.add_parser('query', help='按分类字段和主要元素筛选导出')
+    query.add_argument('--art_style', type=str, default=None, help='艺术风格，逗号分隔的多个取值为“或”')
+    query.add_argument('--mood', type=str, default=None, help='氛围，逗号分隔')
+    query.add_argument('--scene_type', type=str, default=None, help='场景类型，逗号分隔')
+    query.add_argument('--elements', type=str, default=None, help='主要元素，逗号分隔')
+    query.add_argument('--any_element', action='store_true', help='包含任一元素即可，默认需包含全部')
+    query.add_argument('--columns', type=str, default=','.join(DEFAULT_COLUMNS),
+                       help='输出列，逗号分隔，可选: row_id,source,main_elements,'
+                            + ','.join(TEXT_COLUMNS + CATEGORICAL_COLUMNS))
+    query.add_argument('--limit', type=int, default=None, help='最多返回的条数')
+    query.add_argument('--format', type=str, choices=['txt', 'tsv', 'json'], default='txt',
+                       help='输出格式，txt只输出第一列')
+    query.add_argument('--output', type=str, default=None, help='输出文件，默认打印到标准输出')
+
+    stats = subparsers.add_parser('stats', help='查看字段取值分布')
+    stats.add_argument('column', choices=list(CATEGORICAL_COLUMNS) + ['main_elements'])
+    stats.add_argument('--top', type=int, default=20, help='显示前几项')
+    args = parser.parse_args()
+
+    corpus = PromptCorpus(args.corpus_dir)
+    if args.command == 'ingest':
+        for path in args.files:
+            added = corpus.ingest(path)
+            print(f"从 {path} 新增 {added} 条结果，分析库共 {len(corpus)} 条")
+    elif args.command == 'compact':
+        merged = corpus.compact()
+        print(f"已合并 {merged} 个分片，分析库共 {len(corpus)} 条")
+    elif args.command == 'query':
+        start = time.perf_counter()
+        frame = corpus.query(
+            art_style=split_values(args.art_style),
+            mood=split_values(args.mood),
+            scene_type=split_values(args.scene_type),
+            elements=split_values(args.elements),
+            match_all=not args.any_element,
+            columns=split_values(args.columns),
+            limit=args.limit,
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        write_output(frame, args.output, args.format)
+        if args.output:
+            print(f"在 {len(corpus)} 条结果中查询耗时 {elapsed:.1f} 毫秒")
+    else:
+        for value, count in corpus.value_counts(args.column, args.top).items():
+            print(f"{count:>6}  {value}")
+
+
+if __name__ == '__main__':
+    main()
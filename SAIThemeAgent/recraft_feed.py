@@ -0,0 +1,207 @@
+import json
+import os
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+# 分页参数名，按常见程度排列
+OFFSET_PARAMS = ('offset', 'skip', 'from', 'start')
+PAGE_PARAMS = ('page', 'page_number', 'pageNumber')
+CURSOR_PARAMS = ('cursor', 'after', 'next_cursor', 'page_token')
+NEXT_CURSOR_KEYS = ('next_cursor', 'nextCursor', 'cursor', 'next', 'after', 'next_page_token')
+
+# 图片条目中可能出现的字段名
+URL_KEYS = ('image_url', 'imageUrl', 'url', 'src', 'preview_url', 'thumbnail_url')
+PROMPT_KEYS = ('prompt', 'description', 'alt', 'title')
+
+
+def _first_value(item, keys):
+    for key in keys:
+        value = item.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _item_url(item):
+    """取条目中的图片地址，兼容 {"image": {"url": ...}} 这类嵌套结构"""
+    url = _first_value(item, URL_KEYS)
+    if isinstance(url, str) and url.startswith('http'):
+        return url
+    for value in item.values():
+        if isinstance(value, dict):
+            url = _first_value(value, URL_KEYS)
+            if isinstance(url, str) and url.startswith('http'):
+                return url
+    return None
+
+
+def find_item_list(payload):
+    """在JSON响应中找出最像图片列表的数组"""
+    best = None
+    stack = [payload]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            dicts = [x for x in node if isinstance(x, dict)]
+            if dicts and len(dicts) == len(node) and any(_item_url(x) for x in dicts):
+                if best is None or len(node) > len(best):
+                    best = node
+            else:
+                stack.extend(node)
+    return best
+
+
+def find_next_cursor(payload):
+    if isinstance(payload, dict):
+        value = _first_value(payload, NEXT_CURSOR_KEYS)
+        if isinstance(value, (str, int)) and not isinstance(value, bool):
+            return value
+        for child in payload.values():
+            if isinstance(child, dict):
+                value = find_next_cursor(child)
+                if value is not None:
+                    return value
+    return None
+
+
+def to_record(item):
+    """将接口条目转换为与页面提取结果相同的格式: [src, alt, width, height]
+
+    task_id统一由parse_image_info从图片地址中提取，不使用接口条目自带的id，两种模式下同一张图片的task_id相同
+    """
+    dims = item.get('image') if isinstance(item.get('image'), dict) else item
+    return [
+        _item_url(item),
+        _first_value(item, PROMPT_KEYS) or '',
+        dims.get('width') or item.get('width'),
+        dims.get('height') or item.get('height'),
+    ]
+
+
+class RecraftFeed:
+    """Recraft社区页背后的JSON接口描述：地址、查询参数名与分页方式"""
+
+    def __init__(self, url, query_param=None, page_param=None, page_style=None):
+        self.url = url
+        self.query_param = query_param
+        self.page_param = page_param
+        self.page_style = page_style  # 'offset' / 'page' / 'cursor' / None(仅单页)
+
+    @classmethod
+    def from_url(cls, url, query=None, payload=None):
+        """根据接口URL和一次响应推断查询参数与分页方式"""
+        params = dict(parse_qsl(urlparse(url).query))
+        query_param = None
+        if query:
+            query_param = next((k for k, v in params.items() if v == query), None)
+
+        for style, names in (('offset', OFFSET_PARAMS), ('page', PAGE_PARAMS), ('cursor', CURSOR_PARAMS)):
+            page_param = next((k for k in names if k in params), None)
+            if page_param:
+                return cls(url, query_param, page_param, style)
+
+        if payload is not None and find_next_cursor(payload) is not None:
+            return cls(url, query_param, 'cursor', 'cursor')
+        return cls(url, query_param)
+
+    @classmethod
+    def discover(cls, driver, query=None):
+        """从Chrome performance日志中找出返回图片列表的JSON请求，需在页面加载完成后调用"""
+        for entry in driver.get_log('performance'):
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+            if message.get('method') != 'Network.responseReceived':
+                continue
+            response = message['params']['response']
+            if 'json' not in response.get('mimeType', ''):
+                continue
+            try:
+                body = driver.execute_cdp_cmd(
+                    'Network.getResponseBody', {'requestId': message['params']['requestId']}
+                )
+                payload = json.loads(body['body'])
+            except Exception:
+                continue
+            if find_item_list(payload):
+                return cls.from_url(response['url'], query, payload)
+        return None
+
+    def supports_query(self, query):
+        """接口能否按查询词过滤；未识别出查询参数时只能请求未过滤的社区流"""
+        return not query or bool(self.query_param)
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'query_param': self.query_param,
+            'page_param': self.page_param,
+            'page_style': self.page_style,
+        }
+
+    def save(self, path):
+        # 多个进程可能同时发现接口，先写临时文件再原子替换
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(**json.load(f))
+
+    def _initial_position(self):
+        value = dict(parse_qsl(urlparse(self.url).query)).get(self.page_param)
+        if self.page_style == 'offset':
+            return int(value or 0)
+        if self.page_style == 'page':
+            return int(value or 1)
+        return None
+
+    def page_url(self, query=None, position=None):
+        """构造指定查询词与分页位置的接口地址"""
+        parts = urlparse(self.url)
+        params = dict(parse_qsl(parts.query))
+        if self.query_param:
+            # 缓存的地址中带有发现接口时的查询词，不带查询词爬取时去掉
+            if query:
+                params[self.query_param] = query
+            else:
+                params.pop(self.query_param, None)
+        if self.page_param:
+            if position is None:
+                params.pop(self.page_param, None)
+            else:
+                params[self.page_param] = position
+        return urlunparse(parts._replace(query=urlencode(params)))
+
+    def iter_pages(self, fetch, query=None, max_pages=None):
+        """逐页请求接口，yield每页的条目列表；fetch为返回requests响应的函数"""
+        position = self._initial_position()
+        pages = 0
+        while max_pages is None or pages < max_pages:
+            response = fetch(self.page_url(query, position))
+            if response is None or response.status_code != 200:
+                break
+            payload = response.json()
+            items = find_item_list(payload) or []
+            if not items:
+                break
+            pages += 1
+            yield items
+
+            if self.page_style == 'offset':
+                position += len(items)
+            elif self.page_style == 'page':
+                position += 1
+            elif self.page_style == 'cursor':
+                position = find_next_cursor(payload)
+                if position is None:
+                    break
+            else:
+                break
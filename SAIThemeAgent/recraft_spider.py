@@ -1,52 +1,154 @@
-import requests
 from bs4 import BeautifulSoup
-import os
 import json
 import time
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from PIL import Image
-import io
+from collections import deque
+from concurrent.futures import as_completed
 from urllib.parse import quote
+from base_spider import BaseSpider
+from image_store import find_image_file
+from recraft_feed import RecraftFeed, to_record
+import metrics
 
-class RecraftSpider:
-    def __init__(self, query=None, time_limit=None):
+# 社区页图片节点选择器
+IMAGE_SELECTOR = "img.c-crbeIZ"
+
+# 一次往返取出所有未处理过的图片节点并打上标记，同时返回当前页面高度，
+# 以及从页面中出现第一个新图片到本次提取的间隔（毫秒，由观察器记录）
+EXTRACT_NEW_IMAGES_JS = """
+var nodes = document.querySelectorAll(arguments[0] + ':not([data-sai-seen])');
+var items = [];
+for (var i = 0; i < nodes.length; i++) {
+    var img = nodes[i];
+    // 懒加载尚未填充src的节点不标记，留到下一次滚动
+    if (!img.src) continue;
+    img.setAttribute('data-sai-seen', '1');
+    items.push([img.src, img.alt, img.width, img.height]);
+}
+var since = window.__saiPendingSince;
+window.__saiPendingSince = null;
+return JSON.stringify({
+    height: document.body.scrollHeight,
+    items: items,
+    latency: (items.length && since) ? performance.now() - since : null
+});
+"""
+
+# 在页面中常驻一个MutationObserver，记录新图片节点（或懒加载填充src）第一次出现的时间
+INSTALL_OBSERVER_JS = """
+var selector = arguments[0] + ':not([data-sai-seen])[src]:not([src=""])';
+if (window.__saiObserver) return;
+window.__saiPendingSince = document.querySelector(selector) ? performance.now() : null;
+window.__saiObserver = new MutationObserver(function() {
+    if (window.__saiPendingSince == null && document.querySelector(selector)) {
+        window.__saiPendingSince = performance.now();
+    }
+});
+window.__saiObserver.observe(document.body, {childList: true, subtree: true, attributes: true, attributeFilter: ['src']});
+"""
+
+# 异步等待新图片出现：已有未处理的图片立即返回，否则由MutationObserver唤醒，超时返回false
+WAIT_NEW_IMAGES_JS = """
+var selector = arguments[0] + ':not([data-sai-seen])[src]:not([src=""])';
+var timeout = arguments[1];
+var done = arguments[arguments.length - 1];
+if (document.querySelector(selector)) { done(true); return; }
+var timer = null;
+var observer = new MutationObserver(function() {
+    if (document.querySelector(selector)) {
+        observer.disconnect();
+        clearTimeout(timer);
+        done(true);
+    }
+});
+observer.observe(document.body, {childList: true, subtree: true, attributes: true, attributeFilter: ['src']});
+timer = setTimeout(function() { observer.disconnect(); done(false); }, timeout);
+"""
+
+# 移除已处理且位于视口上方prune_margin像素之外的整张图片卡片，每个列表容器顶部只保留一个占位元素，
+# 其高度累加被移除卡片让出的高度，使容器高度与滚动位置保持不变，DOM节点数不随滚动深度增长；返回本次移除的节点数
+PRUNE_SEEN_IMAGES_JS = """
+var nodes = document.querySelectorAll(arguments[0] + '[data-sai-seen]');
+var margin = arguments[1];
+var containers = new Map();
+for (var i = 0; i < nodes.length; i++) {
+    var img = nodes[i];
+    if (img.getBoundingClientRect().bottom > -margin) continue;
+    var card = img.parentElement;
+    if (!card || !card.parentElement) continue;
+    if (!containers.has(card.parentElement)) containers.set(card.parentElement, new Set());
+    containers.get(card.parentElement).add(card);
+}
+var removed = 0;
+containers.forEach(function(cards, container) {
+    var spacer = null;
+    for (var k = 0; k < container.children.length; k++) {
+        if (container.children[k].hasAttribute('data-sai-spacer')) { spacer = container.children[k]; break; }
+    }
+    if (!spacer) {
+        spacer = document.createElement('div');
+        spacer.setAttribute('data-sai-spacer', '1');
+        // 网格布局中占满整行，普通流式布局中为整宽块
+        spacer.style.gridColumn = '1 / -1';
+        spacer.style.width = '100%';
+        spacer.style.height = '0px';
+        container.insertBefore(spacer, container.firstChild);
+    }
+    var before = container.getBoundingClientRect().height;
+    cards.forEach(function(card) {
+        var imgs = card.getElementsByTagName('img');
+        for (var k = 0; k < imgs.length; k++) imgs[k].removeAttribute('src');
+        removed += 1 + card.getElementsByTagName('*').length;
+        container.removeChild(card);
+    });
+    var after = container.getBoundingClientRect().height;
+    spacer.style.height = (parseFloat(spacer.style.height) + before - after) + 'px';
+});
+return removed;
+"""
+
+class RecraftSpider(BaseSpider):
+    def __init__(self, query=None, time_limit=None, engine=None, image_store=None,
+                 mode="api", feed_file="recraft_feed.json", revalidate=False, browser_pool=None,
+                 scroll_timeout=5.0, max_empty_scrolls=3, prune_margin=3000, dedup_index=None,
+                 image_sink=None, metadata_options=None):
+        super().__init__(
+            "recraft",
+            headers={
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+            },
+            save_dir="recraft_images",
+            engine=engine, image_store=image_store, revalidate=revalidate, dedup_index=dedup_index,
+            image_sink=image_sink, metadata_options=metadata_options,
+        )
         self.base_url = "https://www.recraft.ai/community"
         self.query = query
-        self.save_dir = "recraft_images"
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
         self.time_limit = time_limit  # 爬虫运行时间限制（秒）
+        # api模式直接分页请求社区页背后的JSON接口，失败时回退到浏览器模式
+        self.mode = mode
+        self.feed_file = feed_file  # 缓存已发现的接口描述，只需用浏览器发现一次
+        # 传入BrowserPool时浏览器模式复用池中的浏览器，否则每次爬取单独启动
+        self.browser_pool = browser_pool
+        # 每次滚动后最多等待新图片出现的秒数，连续max_empty_scrolls次没有新图片才认为到达底部
+        self.scroll_timeout = scroll_timeout
+        self.max_empty_scrolls = max_empty_scrolls
+        # 长时间运行模式下，滚出视口上方超过该像素数的已处理节点会被移除
+        self.prune_margin = prune_margin
         
-    def setup_driver(self):
+    def setup_driver(self, performance_log=False):
         # 设置Chrome选项
         options = webdriver.ChromeOptions()
         options.add_argument('--headless')  # 无头模式
         options.add_argument('--disable-gpu')
         options.add_argument(f'user-agent={self.headers["User-Agent"]}')
+        if performance_log:
+            # 记录网络事件，用于发现图片列表接口
+            options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
         return webdriver.Chrome(options=options)
         
-    def create_save_dir(self):
-        if not os.path.exists(self.save_dir):
-            os.makedirs(self.save_dir)
-            
-    def download_image(self, img_url, img_name):
-        try:
-            response = requests.get(img_url, headers=self.headers)
-            if response.status_code == 200:
-                # 将图片数据转换为PNG格式
-                image = Image.open(io.BytesIO(response.content))
-                file_path = os.path.join(self.save_dir, img_name)
-                # 保存为PNG格式
-                image.save(file_path, 'PNG')
-                return True
-        except Exception as e:
-            print(f"下载图片失败: {str(e)}")
-        return False
-
     def get_image_dimensions(self, img_element):
         """获取图片尺寸"""
         try:
@@ -57,12 +159,15 @@ class RecraftSpider:
             return "未知"
 
     def parse_image_info(self, img):
-        """解析图片信息，统一输出格式"""
+        """解析图片信息，统一输出格式；img可以是WebElement或脚本返回的[src, alt, width, height]"""
         try:
-            img_url = img.get_attribute('src')
-            prompt = img.get_attribute('alt')
-            width = img.get_attribute('width')
-            height = img.get_attribute('height')
+            if isinstance(img, (list, tuple)):
+                img_url, prompt, width, height = img
+            else:
+                img_url = img.get_attribute('src')
+                prompt = img.get_attribute('alt')
+                width = img.get_attribute('width')
+                height = img.get_attribute('height')
             
             # 从URL中提取唯一标识符
             task_id = img_url.split('/')[-1].split('@')[0]
@@ -85,90 +190,228 @@ class RecraftSpider:
             return f"{self.base_url}?q={quote(self.query)}"
         return self.base_url
 
+    def handle_image_info(self, img_info, image_data, pending):
+        """检查本地与全局图片库，未下载过的图片提交到下载引擎
+
+        返回 'exists'（本批次已有）、'duplicate'（近似重复）、'linked'（从全局图片库链接）或 'submitted'（已提交下载），
+        重复提交返回None；
+        image_data为None时不记录提交的图片信息
+        """
+        img_name = img_info['task_id']
+        if img_name in pending:
+            return None
+        if find_image_file(self.save_dir, img_name):
+            print(f"图片 {img_name} 已存在，跳过下载")
+            metrics.inc("spider_images_total", spider=self.name, result="exists")
+            return 'exists'
+        elif self.is_near_duplicate(img_name):
+            return 'duplicate'
+        elif not self.revalidate and self.image_store.link(img_name, self.save_dir):
+            # 其他批次已下载过，直接链接，不发起网络请求
+            print(f"图片 {img_name} 已在全局图片库中，跳过下载")
+            metrics.inc("spider_images_total", spider=self.name, result="linked")
+            self.save_image_info(img_info)
+            return 'linked'
+        if image_data is not None:
+            image_data.append(img_info)
+        # 交给下载引擎并发下载，限速由引擎按主机控制
+        future = self.engine.submit(self.download_image, img_info['img_url'], img_name)
+        pending[img_info['task_id']] = (future, img_info, img_name)
+        return 'submitted'
+
+    def collect_finished(self, pending, wait=True):
+        """处理已完成的下载并yield成功的图片信息；wait为False时只处理已完成的部分"""
+        futures = {future: task_id for task_id, (future, _, _) in pending.items()}
+        done = as_completed(futures) if wait else [future for future in futures if future.done()]
+        for future in done:
+            _, img_info, img_name = pending.pop(futures[future])
+            if future.result():
+                print(f"成功下载图片: {img_name}")
+                self.save_image_info(img_info)
+                yield img_info
+        if self.metadata is not None:
+            self.metadata.commit()
+
+    def wait_downloads(self, pending):
+        """等待所有下载完成，元数据在主线程中顺序写入"""
+        for _ in self.collect_finished(pending):
+            pass
+
+    def discover_feed(self):
+        """用浏览器加载一次社区页，从网络日志中找出图片列表接口并缓存
+
+        缓存的接口没有识别出查询参数时不能用于带查询词的爬取，此时带上查询词重新发现；
+        仍无法识别查询参数则返回None，由调用方回退到浏览器模式，而不是爬取未过滤的社区流
+        """
+        cached = RecraftFeed.load(self.feed_file) if self.feed_file else None
+        if cached and cached.supports_query(self.query):
+            return cached
+        driver = self.setup_driver(performance_log=True)
+        try:
+            driver.get(self.get_url())
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, IMAGE_SELECTOR))
+            )
+            feed = RecraftFeed.discover(driver, self.query)
+        except Exception as e:
+            print(f"发现图片列表接口失败: {str(e)}")
+            return None
+        finally:
+            driver.quit()
+        if feed is None:
+            return None
+        # 识别出查询参数的接口对所有查询词通用，不被不带查询参数的结果覆盖
+        if self.feed_file and (cached is None or feed.query_param):
+            feed.save(self.feed_file)
+            print(f"已发现图片列表接口: {feed.url}")
+        if not feed.supports_query(self.query):
+            print(f"未能识别图片列表接口的查询参数，无法按查询词 {self.query} 过滤")
+            return None
+        return feed
+
     def crawl(self):
-        driver = self.setup_driver()
+        """按mode爬取：api与browser模式返回图片信息列表，longrun模式返回图片数"""
+        if self.mode == "longrun":
+            # 结果边爬边写入元数据，只返回图片数，不在内存中保留全部结果；需要逐条处理时直接迭代iter_browser(prune=True)
+            return sum(1 for _ in self.iter_browser(prune=True))
+        if self.mode == "api":
+            image_data = self.crawl_api()
+            if image_data is not None:
+                return image_data
+            print("接口模式不可用，回退到浏览器模式")
+        return self.crawl_browser()
+
+    def fetch_feed_page(self, url):
+        with metrics.timer("spider_list_fetch_seconds", spider=self.name):
+            return self.engine.fetch(url)
+
+    def crawl_api(self, feed=None):
+        """不启动浏览器，直接分页请求图片列表接口；接口不可用时返回None"""
+        feed = feed or self.discover_feed()
+        if feed is None or not feed.supports_query(self.query):
+            return None
         start_time = time.time()
+        image_data = []
+        pending = {}
+        pages = 0
+        try:
+            for items in feed.iter_pages(self.fetch_feed_page, self.query):
+                pages += 1
+                metrics.inc("spider_list_pages_total", spider=self.name, result="ok")
+                for item in items:
+                    record = to_record(item)
+                    if not record[0]:
+                        continue
+                    img_info = self.parse_image_info(record)
+                    if img_info:
+                        self.handle_image_info(img_info, image_data, pending)
+
+                # 检查是否达到时间限制
+                if self.time_limit and (time.time() - start_time) > self.time_limit:
+                    print(f"已达到设定的时间限制 {self.time_limit} 秒，停止爬取")
+                    break
+        except Exception as e:
+            print(f"接口爬取失败: {str(e)}")
+            if not pages:
+                return None
+
+        if not pages:
+            return None
+        self.wait_downloads(pending)
+        return image_data
+
+    def crawl_browser(self):
+        """滚动页面爬取，返回本次下载或从全局图片库链接的图片信息"""
+        return list(self.iter_browser())
+
+    def iter_browser(self, prune=False):
+        """滚动页面爬取，每张图片下载完成并写入元数据后立即yield
+
+        prune为True时为长时间运行模式：已处理且滚出视口较远的图片卡片会从DOM中移除，
+        由单个占位元素保持高度以免滚动位置跳动，浏览器与Python两侧的内存都不随运行时间增长
+        """
+        driver = self.browser_pool.acquire() if self.browser_pool else self.setup_driver()
+        broken = False
+        start_time = time.time()
+        pending = {}
         try:
             url = self.get_url()
             driver.get(url)
             
             WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "img.c-crbeIZ"))
+                EC.presence_of_element_located((By.CSS_SELECTOR, IMAGE_SELECTOR))
             )
             
-            image_data = []
+            driver.execute_script(INSTALL_OBSERVER_JS, IMAGE_SELECTOR)
+            driver.set_script_timeout(self.scroll_timeout + 10)
+            
+            # 只保留最近的间隔样本用于汇总，长时间运行时不随图片数增长
+            latencies = deque(maxlen=1000)
+            empty_scrolls = 0
             while True:
                 # 检查是否达到时间限制
                 if self.time_limit and (time.time() - start_time) > self.time_limit:
                     print(f"已达到设定的时间限制 {self.time_limit} 秒，停止爬取")
                     break
                 
-                # 获取当前页面高度
-                last_height = driver.execute_script("return document.body.scrollHeight")
-                
-                # 滚动到页面底部
+                # 滚动到页面底部，等待新图片出现而不是固定休眠
                 driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                time.sleep(2)
+                with metrics.timer("recraft_scroll_wait_seconds"):
+                    driver.execute_async_script(WAIT_NEW_IMAGES_JS, IMAGE_SELECTOR, int(self.scroll_timeout * 1000))
                 
-                # 获取新的页面高度
-                new_height = driver.execute_script("return document.body.scrollHeight")
+                # 一次脚本调用获取新的页面高度和本轮新出现的图片
+                with metrics.timer("spider_list_fetch_seconds", spider=self.name):
+                    snapshot = json.loads(driver.execute_script(EXTRACT_NEW_IMAGES_JS, IMAGE_SELECTOR))
+                metrics.inc("spider_list_pages_total", spider=self.name, result="ok")
+                if snapshot['latency'] is not None:
+                    latency = snapshot['latency'] / 1000
+                    latencies.append(latency)
+                    metrics.observe("recraft_detect_to_extract_seconds", latency)
                 
-                # 获取当前可见的所有图片
-                images = driver.find_elements(By.CSS_SELECTOR, "img.c-crbeIZ")
-                
-                for img in images:
+                for img in snapshot['items']:
                     try:
                         img_info = self.parse_image_info(img)
-                        if img_info:
-                            img_name = f"{img_info['task_id']}.png"
-                            if not os.path.exists(os.path.join(self.save_dir, img_name)):
-                                image_data.append(img_info)
-                                
-                                if self.download_image(img_info['img_url'], img_name):
-                                    print(f"成功下载图片: {img_name}")
-                                    self.save_image_info(img_info)
-                                time.sleep(1)
-                            else:
-                                print(f"图片 {img_name} 已存在，跳过下载")
+                        if img_info and self.handle_image_info(img_info, None, pending) == 'linked':
+                            yield img_info
                         
                     except Exception as e:
                         print(f"处理图片失败: {str(e)}")
                         continue
+
+                if prune:
+                    removed = driver.execute_script(PRUNE_SEEN_IMAGES_JS, IMAGE_SELECTOR, self.prune_margin)
+                    metrics.inc("recraft_pruned_nodes_total", removed)
+
+                # 已完成的下载立即交给调用方，pending中只保留进行中的任务
+                yield from self.collect_finished(pending, wait=False)
                 
-                # 检查是否到达页面底部
-                if new_height == last_height:
-                    print("已到达页面底部")
-                    break
+                # 连续多次滚动都没有新图片才认为到达页面底部，避免加载慢时过早停止
+                if snapshot['items']:
+                    empty_scrolls = 0
+                else:
+                    empty_scrolls += 1
+                    if empty_scrolls >= self.max_empty_scrolls:
+                        print(f"连续{empty_scrolls}次滚动没有新图片，已到达页面底部")
+                        break
                     
-            return image_data
+            if latencies:
+                ordered = sorted(latencies)
+                print(f"新图片出现到提取的间隔: p50={ordered[len(ordered) // 2] * 1000:.0f}ms "
+                      f"max={ordered[-1] * 1000:.0f}ms")
+            yield from self.collect_finished(pending)
 
         except Exception as e:
             print(f"爬取失败: {str(e)}")
-            return []
+            broken = True
             
         finally:
-            driver.quit()
-
-    def save_image_info(self, img_info):
-        json_file = os.path.join(self.save_dir, 'image_info.json')
-        try:
-            if os.path.exists(json_file):
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+            # 调用方提前停止迭代时也要等待进行中的下载并写入元数据
+            for _ in self.collect_finished(pending):
+                pass
+            if self.browser_pool:
+                self.browser_pool.release(driver, broken)
             else:
-                data = []
-            
-            # 检查是否已存在相同的task_id
-            if not any(item.get('task_id') == img_info['task_id'] for item in data):
-                data.append(img_info)
-                
-                with open(json_file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-            else:
-                print(f"图片 {img_info['task_id']} 信息已存在，跳过保存")
-                
-        except Exception as e:
-            print(f"保存图片信息失败: {str(e)}")
+                driver.quit()
 
 def main():
     # 示例：设置30分钟的时间限制
@@ -180,7 +423,10 @@ def main():
     spider.create_save_dir()
     
     start_time = time.time()
-    images = spider.crawl()
+    try:
+        images = spider.crawl()
+    finally:
+        spider.close()
     end_time = time.time()
     
     print(f"爬取完成，共获取{len(images)}张图片信息")
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+# _get_error_result生成的占位结果标记
+FAILED_MARKERS = ("处理失败", "Processing failed")
+
+
+class ResultCheckpoint:
+    """JSONL检查点：每条结果生成后立即追加写入，崩溃或中断后可从中恢复"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        # 首次追加前检查文件末尾是否有中断时写了一半的行
+        self.repaired = False
+
+    @staticmethod
+    def is_failed(result: Dict) -> bool:
+        return not result.get("inspired_prompt") or result["inspired_prompt"] in FAILED_MARKERS
+
+    def has_records(self) -> bool:
+        """检查点文件是否已有内容，未指定续跑时不应静默清空"""
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def reset(self):
+        """清空检查点，开始新的一轮生成"""
+        with self.lock:
+            open(self.path, 'w', encoding='utf-8').close()
+            self.repaired = True
+
+    def _truncate_partial_line(self, chunk_size=64 * 1024):
+        """截掉文件末尾不完整的行，否则下一条结果会接在它后面，两条一起无法解析"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - chunk_size)
+                f.seek(start)
+                index = f.read(position - start).rfind(b"\n")
+                if index >= 0:
+                    position = start + index + 1
+                    break
+                position = start
+            if position < end:
+                print(f"检查点末尾有 {end - position} 字节不完整的记录，已截断")
+                f.truncate(position)
+
+    def append(self, description: str, result: Dict):
+        """追加一条结果并落盘"""
+        line = json.dumps({"description": description, "result": result}, ensure_ascii=False)
+        with self.lock:
+            if not self.repaired:
+                self._truncate_partial_line()
+                self.repaired = True
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def load(self) -> Dict[str, Dict]:
+        """读取检查点，返回 描述 -> 结果；同一描述以最后一条为准，跳过中断时写了一半的行"""
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[record["description"]] = record["result"]
+        return results
+
+    def compact(self, output_file: str, order: Optional[List[str]] = None) -> int:
+        """将检查点压缩为原有的JSON数组格式；给定order时按输入顺序输出"""
+        results = self.load()
+        if order is not None:
+            items = [results[description] for description in order if description in results]
+        else:
+            items = list(results.values())
+        tmp_file = output_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, output_file)
+        return len(items)
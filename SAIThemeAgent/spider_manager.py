@@ -1,60 +1,217 @@
 import os
+import re
+import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from miaohua_spider import MiaohuaSpider
 from recraft_spider import RecraftSpider
+from image_store import ImageStore, find_image_file
+from job_queue import JobQueue, LeaseKeeper
+import metrics
 import time
+from multiprocessing.util import Finalize
+
+# 子进程内复用的浏览器池，进程池中同一进程处理的多个Recraft任务共享
+_process_browser_pool = None
+
+# 需要浏览器的Recraft爬取模式，api模式只发HTTP请求，不创建浏览器池
+BROWSER_MODES = ('browser', 'longrun')
+
+def load_queries(query_file):
+    """读取查询词文件，每行一个，忽略空行和#开头的注释"""
+    with open(query_file, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+def query_dir_name(query):
+    """将查询词转换为可用作目录名的字符串"""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', query or 'default').strip('_') or 'default'
+
+def count_images(save_dir):
+    """统计任务目录中image_info.json记录的图片数"""
+    json_file = os.path.join(save_dir, 'image_info.json')
+    if not os.path.exists(json_file):
+        return 0
+    with open(json_file, 'r', encoding='utf-8') as f:
+        return len(json.load(f))
+
+def get_process_browser_pool(size=1, max_pages=20):
+    """获取当前进程的浏览器池，首次调用时创建，进程退出时关闭"""
+    global _process_browser_pool
+    if _process_browser_pool is None:
+        from browser_pool import BrowserPool
+        _process_browser_pool = BrowserPool(size=size, max_pages=max_pages)
+        # 进程池的工作进程不执行atexit，用multiprocessing的退出钩子关闭浏览器
+        Finalize(_process_browser_pool, _process_browser_pool.close, exitpriority=10)
+    return _process_browser_pool
+
+def run_spider_job(base_dir, timestamp, spider_name, query, options):
+    """在子进程中运行单个(爬虫, 查询词)任务，返回任务摘要；启用指标时摘要中附带本任务的指标快照"""
+    if options.get('metrics'):
+        # 进程池复用子进程，每个任务只上报自己的指标
+        metrics.enable()
+        metrics.reset()
+    browser_pool = None
+    if spider_name == 'recraft' and options.get('recraft_mode', 'api') in BROWSER_MODES:
+        browser_pool = get_process_browser_pool(options.get('browser_pool_size', 1),
+                                                options.get('browser_max_pages', 20))
+    manager = SpiderManager(base_dir=base_dir, revalidate=options.get('revalidate', False),
+                            timestamp=timestamp, incremental=options.get('incremental', True),
+                            browser_pool=browser_pool, phash_dedup=options.get('phash_dedup', False))
+    summary = {'spider': spider_name, 'query': query, 'save_dir': None,
+               'images': 0, 'seconds': 0.0, 'error': None}
+    start_time = time.time()
+    try:
+        if spider_name == 'miaohua':
+            save_dir = manager.run_miaohua_spider(
+                query=query,
+                pages=options.get('miaohua_pages'),
+                sub_dir=query_dir_name(query)
+            )
+        else:
+            save_dir = manager.run_recraft_spider(
+                query=query,
+                time_limit=options.get('recraft_time_limit'),
+                mode=options.get('recraft_mode', 'api'),
+                sub_dir=query_dir_name(query)
+            )
+        summary['save_dir'] = save_dir
+        summary['images'] = count_images(save_dir)
+        if browser_pool is not None:
+            # 浏览器池跨任务累计的启动耗时、传输字节数与内存峰值
+            summary['browser'] = browser_pool.stats()
+    except Exception as e:
+        summary['error'] = str(e)
+    finally:
+        manager.close()
+    summary['seconds'] = time.time() - start_time
+    metrics.inc("spider_jobs_total", spider=spider_name, result="failed" if summary['error'] else "ok")
+    if options.get('metrics'):
+        summary['metrics'] = metrics.snapshot()
+    return summary
+
+def run_queue_worker_job(base_dir, queue_path, options):
+    """在子进程中运行一个队列worker，直到队列中没有待执行或执行中的任务，返回worker摘要"""
+    if options.get('metrics'):
+        metrics.enable()
+        metrics.reset()
+    job_queue = JobQueue(queue_path, lease_seconds=options.get('lease_seconds', 120),
+                         max_attempts=options.get('max_attempts', 3))
+    manager = SpiderManager(base_dir=base_dir, revalidate=options.get('revalidate', False),
+                            phash_dedup=options.get('phash_dedup', False), shared_storage=True)
+    try:
+        summary = manager.run_queue_worker(
+            job_queue,
+            max_pages=options.get('miaohua_pages'),
+            batch_size=options.get('batch_size', 16),
+            recraft_time_limit=options.get('recraft_time_limit'),
+            recraft_mode=options.get('recraft_mode', 'api')
+        )
+    finally:
+        manager.close()
+        job_queue.close()
+    if options.get('metrics'):
+        summary['metrics'] = metrics.snapshot()
+    return summary
 
 class SpiderManager:
-    def __init__(self, base_dir="spider_data"):
+    def __init__(self, base_dir="spider_data", revalidate=False, timestamp=None, incremental=True,
+                 browser_pool=None, browser_pool_size=1, browser_max_pages=20, phash_dedup=False,
+                 image_sink=None, shared_storage=False, state_sink=None):
         self.base_dir = base_dir
-        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.revalidate = revalidate
+        self.incremental = incremental  # 妙绘AI只爬取上次记录位置之后的新图片
+        self.timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+        # 队列模式下多个主机通过网络文件系统共享base_dir，其中的SQLite库都改用回滚日志
+        # （WAL需要共享内存，在网络文件系统上不可用），元数据逐条提交，不长时间占住写锁
+        self.shared_storage = shared_storage
+        journal_mode = "DELETE" if shared_storage else "WAL"
+        self.metadata_options = {'journal_mode': journal_mode, 'batch_size': 1} if shared_storage else {}
+        # 所有批次和爬虫共享的全局图片库
+        self.image_store = ImageStore(os.path.join(base_dir, "image_store"), journal_mode=journal_mode)
+        # Recraft浏览器模式使用的浏览器池，未传入时在首次需要时创建
+        self._owns_browser_pool = browser_pool is None
+        self.browser_pool = browser_pool
+        self.browser_pool_size = browser_pool_size
+        self.browser_max_pages = browser_max_pages
+        # 感知哈希去重索引与全局图片库放在一起，所有批次共享
+        self.phash_dedup = phash_dedup
+        self.dedup_index = None
+        if phash_dedup:
+            from image_hash import PerceptualIndex
+            self.dedup_index = PerceptualIndex(os.path.join(base_dir, "image_store", "phash.db"),
+                                               journal_mode=journal_mode)
+        # 传给爬虫的元数据回调与增量爬取位置回调，见pipeline.py
+        self.image_sink = image_sink
+        self.state_sink = state_sink
         
-    def create_save_dir(self, spider_name):
-        """创建保存目录，使用时间戳区分不同批次"""
+    def create_save_dir(self, spider_name, sub_dir=None):
+        """创建保存目录，使用时间戳区分不同批次，sub_dir用于隔离同一批次中的不同任务"""
         save_dir = os.path.join(self.base_dir, spider_name, self.timestamp)
+        if sub_dir:
+            save_dir = os.path.join(save_dir, sub_dir)
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
         return save_dir
     
-    def run_miaohua_spider(self, query="春节", pages=1):
-        """运行妙绘AI爬虫"""
-        save_dir = self.create_save_dir("miaohua")
+    def run_miaohua_spider(self, query="春节", pages=None, sub_dir=None):
+        """运行妙绘AI爬虫，pages为空时翻页直到没有新图片"""
+        save_dir = self.create_save_dir("miaohua", sub_dir)
         print(f"开始运行妙绘AI爬虫，保存目录: {save_dir}")
         
-        spider = MiaohuaSpider()
+        spider = MiaohuaSpider(image_store=self.image_store, revalidate=self.revalidate,
+                               dedup_index=self.dedup_index, image_sink=self.image_sink,
+                               metadata_options=self.metadata_options, state_sink=self.state_sink)
         spider.save_dir = save_dir
         spider.create_save_dir()
         
-        total_images = 0
-        for page in range(1, pages + 1):
-            print(f"正在爬取第{page}页...")
-            images = spider.crawl(page=page, query=query)
-            total_images += len(images)
-            print(f"第{page}页爬取完成，获取到{len(images)}张图片信息")
+        try:
+            with metrics.timer("spider_run_seconds", spider="miaohua"):
+                images = spider.crawl_pages(query=query, max_pages=pages, incremental=self.incremental)
+            total_images = len(images)
+        finally:
+            spider.close()
         
         print(f"妙绘AI爬虫运行完成，共获取{total_images}张图片")
         return save_dir
     
-    def run_recraft_spider(self, query=None, time_limit=None):
+    def get_browser_pool(self):
+        if self.browser_pool is None:
+            from browser_pool import BrowserPool
+            self.browser_pool = BrowserPool(size=self.browser_pool_size, max_pages=self.browser_max_pages)
+        return self.browser_pool
+
+    def run_recraft_spider(self, query=None, time_limit=None, mode="api", sub_dir=None):
         """运行Recraft爬虫"""
-        save_dir = self.create_save_dir("recraft")
+        save_dir = self.create_save_dir("recraft", sub_dir)
         print(f"开始运行Recraft爬虫，保存目录: {save_dir}")
         
-        spider = RecraftSpider(query=query, time_limit=time_limit)
+        # api模式不需要浏览器，接口不可用而回退到浏览器模式时由爬虫单独启动一次
+        browser_pool = self.get_browser_pool() if mode in BROWSER_MODES else None
+        spider = RecraftSpider(query=query, time_limit=time_limit, image_store=self.image_store,
+                               mode=mode, feed_file=os.path.join(self.base_dir, "recraft_feed.json"),
+                               revalidate=self.revalidate, browser_pool=browser_pool,
+                               dedup_index=self.dedup_index, image_sink=self.image_sink,
+                               metadata_options=self.metadata_options)
         spider.save_dir = save_dir
         spider.create_save_dir()
         
         start_time = time.time()
-        images = spider.crawl()
+        try:
+            with metrics.timer("spider_run_seconds", spider="recraft"):
+                result = spider.crawl()
+                # longrun模式结果边爬边写入元数据，crawl只返回图片数，内存不随运行时间增长
+                total_images = result if mode == "longrun" else len(result)
+        finally:
+            spider.close()
         end_time = time.time()
         
-        print(f"Recraft爬虫运行完成，共获取{len(images)}张图片")
+        print(f"Recraft爬虫运行完成，共获取{total_images}张图片")
         print(f"总耗时: {(end_time - start_time):.2f} 秒")
         return save_dir
     
     def run_all_spiders(self, miaohua_query="春节", recraft_query=None, 
-                       miaohua_pages=1, recraft_time_limit=None):
+                       miaohua_pages=None, recraft_time_limit=None, recraft_mode="api"):
         """运行所有爬虫"""
         results = {}
         
@@ -67,11 +224,231 @@ class SpiderManager:
         # 运行Recraft爬虫
         results['recraft'] = self.run_recraft_spider(
             query=recraft_query,
-            time_limit=recraft_time_limit
+            time_limit=recraft_time_limit,
+            mode=recraft_mode
         )
         
         return results
 
+    def run_jobs(self, spiders, queries, miaohua_workers=2, recraft_workers=1, **options):
+        """在进程池中并发运行 (爬虫, 查询词) 任务，每种爬虫使用独立的进程数，返回全部任务摘要"""
+        workers = {'miaohua': miaohua_workers, 'recraft': recraft_workers}
+        executors = {name: ProcessPoolExecutor(max_workers=workers[name]) for name in spiders}
+        options = dict(options, revalidate=self.revalidate, incremental=self.incremental,
+                       metrics=metrics.is_enabled(), browser_pool_size=self.browser_pool_size,
+                       browser_max_pages=self.browser_max_pages, phash_dedup=self.phash_dedup)
+        summaries = []
+        start_time = time.time()
+        try:
+            futures = [
+                executors[spider_name].submit(
+                    run_spider_job, self.base_dir, self.timestamp, spider_name, query, options
+                )
+                for spider_name in spiders
+                for query in queries
+            ]
+            for future in as_completed(futures):
+                summary = future.result()
+                metrics.merge(summary.pop('metrics', None))
+                summaries.append(summary)
+                status = "失败: " + summary['error'] if summary['error'] else f"{summary['images']} 张图片"
+                print(f"[{summary['spider']}] {summary['query']} 完成，{status}，耗时 {summary['seconds']:.1f} 秒")
+        finally:
+            for executor in executors.values():
+                executor.shutdown()
+        self.report_jobs(summaries, time.time() - start_time)
+        return summaries
+
+    def report_jobs(self, summaries, wall_seconds):
+        """输出所有任务的汇总，并写入 <base_dir>/summary_<timestamp>.json"""
+        summaries = sorted(summaries, key=lambda x: (x['spider'], x['query'] or ''))
+        print("\n任务汇总:")
+        for summary in summaries:
+            status = "失败" if summary['error'] else "完成"
+            print(f"  {summary['spider']:<8} {summary['query'] or '-':<16} {status} "
+                  f"{summary['images']:>6} 张 {summary['seconds']:>8.1f} 秒")
+        total_images = sum(summary['images'] for summary in summaries)
+        busy_seconds = sum(summary['seconds'] for summary in summaries)
+        print(f"共 {len(summaries)} 个任务，{total_images} 张图片，"
+              f"总耗时 {wall_seconds:.1f} 秒（串行累计 {busy_seconds:.1f} 秒）")
+
+        summary_file = os.path.join(self.base_dir, f"summary_{self.timestamp}.json")
+        with open(summary_file, 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': self.timestamp, 'wall_seconds': wall_seconds, 'jobs': summaries},
+                      f, ensure_ascii=False, indent=2)
+        print(f"任务汇总已保存到 {summary_file}")
+
+    def seed_queue(self, job_queue, spiders, queries):
+        """向共享队列写入初始任务：妙绘AI每个查询词从第1页开始，后续页由worker逐页派生；
+        Recraft的接口与滚动爬取都无法按页定位，每个查询词作为一个整体任务（page为0）
+
+        返回队列中约定的批次号，所有worker都写入该批次目录；同时在保存目录中写入标记文件，
+        worker据此确认自己的--save-dir与seed时是同一个共享目录
+        """
+        run_id = job_queue.set_meta_default('run_id', self.timestamp)
+        with open(self.queue_marker_path(run_id), 'w', encoding='utf-8') as f:
+            json.dump({'run_id': run_id, 'queue': os.path.abspath(job_queue.db_path)}, f, ensure_ascii=False)
+        added = 0
+        for spider_name in spiders:
+            page = 1 if spider_name == 'miaohua' else 0
+            added += job_queue.enqueue_many('page', [
+                (f"{spider_name}:{query}:{page}", {'spider': spider_name, 'query': query, 'page': page})
+                for query in queries
+            ])
+        print(f"已写入 {added} 个新任务，批次号 {run_id}")
+        return run_id
+
+    def queue_marker_path(self, run_id):
+        return os.path.join(self.base_dir, f"queue_{run_id}.json")
+
+    def _queue_spider(self, spiders, query):
+        """队列模式下每个查询词复用一个妙绘AI爬虫实例，写入 <批次目录>/<查询词>"""
+        spider = spiders.get(query)
+        if spider is None:
+            spider = MiaohuaSpider(image_store=self.image_store, revalidate=self.revalidate,
+                                   dedup_index=self.dedup_index, image_sink=self.image_sink,
+                                   metadata_options=self.metadata_options)
+            spider.save_dir = self.create_save_dir("miaohua", query_dir_name(query))
+            spiders[query] = spider
+        return spider
+
+    def _run_page_job(self, job_queue, job, spiders, per_page, max_pages, recraft_time_limit, recraft_mode):
+        spider_name, query, page = job.payload['spider'], job.payload['query'], job.payload['page']
+        if spider_name == 'recraft':
+            save_dir = self.run_recraft_spider(query=query, time_limit=recraft_time_limit, mode=recraft_mode,
+                                               sub_dir=query_dir_name(query))
+            job_queue.complete(job, {'images': count_images(save_dir)})
+            return
+
+        spider = self._queue_spider(spiders, query)
+        print(f"[队列] 妙绘AI {query} 第{page}页")
+        image_infos = spider.fetch_page(page, per_page, query)
+        if image_infos is None:
+            job_queue.fail(job, "列表请求失败")
+            return
+        # 同一图片出现在不同查询词下时各自链接到对应目录，内容寻址的图片库保证只下载一次
+        added = job_queue.enqueue_many('image', [
+            (f"miaohua:{query}:{img_info['task_id']}", {'spider': 'miaohua', 'query': query, 'info': img_info})
+            for img_info in image_infos
+        ])
+        # 空页或整页都已收录时不再派生下一页，与crawl_pages的停止条件一致；完整爬取时只在空页停止
+        all_known = self.incremental and all(img_info['task_id'] in self.image_store for img_info in image_infos)
+        if image_infos and not all_known and (max_pages is None or page < max_pages):
+            job_queue.enqueue('page', f"miaohua:{query}:{page + 1}",
+                              {'spider': 'miaohua', 'query': query, 'page': page + 1})
+        job_queue.complete(job, {'images': len(image_infos), 'new_jobs': added})
+
+    def _run_image_jobs(self, job_queue, jobs, spiders):
+        """并发下载一批图片任务：已存在、已链接或近似重复的直接完成，下载失败的按重试次数重新排队
+
+        不同查询词的任务可能指向同一张图片，只下载一次，完成后链接到其余查询词的目录并写入各自的元数据
+        """
+        futures = {}
+        # 下载future -> [(任务, 爬虫, 图片信息)]，第一项为发起下载的任务
+        waiting = {}
+        running = {}  # task_id -> 本批中正在下载该图片的future
+        for job in jobs:
+            spider = self._queue_spider(spiders, job.payload['query'])
+            img_info = job.payload['info']
+            task_id = img_info['task_id']
+            if find_image_file(spider.save_dir, task_id):
+                job_queue.complete(job, {'status': 'exists'})
+            elif task_id in running:
+                waiting[running[task_id]].append((job, spider, img_info))
+            elif not spider.submit_downloads([img_info], futures):
+                # 从全局图片库链接（元数据已写入）或被判定为近似重复
+                job_queue.complete(job, {'status': 'skipped'})
+            else:
+                future = next(future for future, (info, _) in futures.items() if info is img_info)
+                running[task_id] = future
+                waiting[future] = [(job, spider, img_info)]
+        for future in as_completed(futures):
+            downloaded = future.result()
+            for index, (job, spider, img_info) in enumerate(waiting[future]):
+                # 发起下载的任务已由download_image链接到自己的目录，其余任务从全局图片库链接
+                linked = index == 0 or self.image_store.link(img_info['task_id'], spider.save_dir) is not None
+                if downloaded and linked:
+                    spider.save_image_info(img_info)
+                    job_queue.complete(job, {'status': 'downloaded' if index == 0 else 'linked'})
+                else:
+                    job_queue.fail(job, "下载失败")
+        for spider in spiders.values():
+            if spider.metadata is not None:
+                spider.metadata.commit()
+
+    def run_queue_worker(self, job_queue, per_page=30, max_pages=None, batch_size=16, poll_interval=5.0,
+                         recraft_time_limit=None, recraft_mode="api"):
+        """从共享队列领取并执行任务，直到没有待执行或执行中的任务；优先下载已发现的图片，再领取列表页"""
+        run_id = job_queue.get_meta('run_id')
+        if run_id is None:
+            raise RuntimeError("队列尚未写入任务，请先以 --queue-role seed 运行")
+        if not os.path.exists(self.queue_marker_path(run_id)):
+            # 各主机写入各自的本地目录时，图片与元数据会分散在不同机器上，image_info.json也只有部分记录
+            raise RuntimeError(f"保存目录 {self.base_dir} 中没有批次 {run_id} 的标记文件，"
+                               f"--save-dir必须指向seed时使用的、与队列位于同一共享存储上的目录")
+        self.timestamp = run_id
+        keeper = LeaseKeeper(job_queue).start()
+        spiders = {}
+        summary = {'worker': job_queue.worker_id, 'pages': 0, 'images': 0, 'seconds': 0.0}
+        start_time = time.time()
+        try:
+            while True:
+                jobs = job_queue.lease(kinds=('image',), limit=batch_size) or job_queue.lease(kinds=('page',))
+                if not jobs:
+                    if not job_queue.has_unfinished():
+                        break
+                    # 其他worker仍在执行，可能派生新任务或因崩溃释放租约
+                    time.sleep(poll_interval)
+                    continue
+                keeper.add(jobs)
+                try:
+                    if jobs[0].kind == 'page':
+                        summary['pages'] += 1
+                        self._run_page_job(job_queue, jobs[0], spiders, per_page, max_pages,
+                                           recraft_time_limit, recraft_mode)
+                    else:
+                        summary['images'] += len(jobs)
+                        self._run_image_jobs(job_queue, jobs, spiders)
+                except Exception as e:
+                    print(f"任务执行失败: {str(e)}")
+                    for job in jobs:
+                        job_queue.fail(job, e)
+                finally:
+                    keeper.remove(jobs)
+                metrics.inc("queue_jobs_total", len(jobs), kind=jobs[0].kind)
+        finally:
+            keeper.stop()
+            for spider in spiders.values():
+                spider.close()
+        summary['seconds'] = time.time() - start_time
+        return summary
+
+    def run_queue_workers(self, queue_path, workers=1, **options):
+        """在本机启动多个队列worker进程，返回各worker的摘要"""
+        options = dict(options, revalidate=self.revalidate, metrics=metrics.is_enabled(),
+                       phash_dedup=self.phash_dedup)
+        summaries = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_queue_worker_job, self.base_dir, queue_path, options)
+                       for _ in range(workers)]
+            for future in as_completed(futures):
+                summary = future.result()
+                metrics.merge(summary.pop('metrics', None))
+                summaries.append(summary)
+                print(f"[{summary['worker']}] 完成 {summary['pages']} 个列表任务、"
+                      f"{summary['images']} 个图片任务，耗时 {summary['seconds']:.1f} 秒")
+        return summaries
+
+    def close(self):
+        """关闭全局图片库、感知哈希索引和自行创建的浏览器池"""
+        self.image_store.close()
+        if self.dedup_index is not None:
+            self.dedup_index.close()
+        if self._owns_browser_pool and self.browser_pool is not None:
+            self.browser_pool.report()
+            self.browser_pool.close()
+            self.browser_pool = None
+
 def parse_args():
     parser = argparse.ArgumentParser(description='AI图片爬虫管理器')
     parser.add_argument('--spider', type=str, choices=['all', 'miaohua', 'recraft'],
@@ -80,44 +457,129 @@ def parse_args():
                       help='妙绘AI搜索关键词')
     parser.add_argument('--recraft-query', type=str, default='春节',
                       help='Recraft搜索关键词')
-    parser.add_argument('--miaohua-pages', type=int, default=1,
-                      help='妙绘AI爬取页数')
+    parser.add_argument('--miaohua-pages', type=int, default=None,
+                      help='妙绘AI最多爬取页数，默认翻页直到空页或没有新图片')
+    parser.add_argument('--full-crawl', action='store_true',
+                      help='妙绘AI忽略上次记录的位置，重新完整翻页')
     parser.add_argument('--save-dir', type=str, default='spider_data',
                       help='数据保存根目录')
     parser.add_argument('--recraft-time-limit', type=int, default=100,
                       help='Recraft爬虫运行时间限制（秒），默认无限制')
+    parser.add_argument('--recraft-mode', type=str, choices=['api', 'browser', 'longrun'], default='api',
+                      help='Recraft爬取方式：api直接请求图片列表接口，browser滚动页面，'
+                           'longrun滚动页面并移除已处理的节点，适合长时间运行')
+    parser.add_argument('--revalidate', action='store_true',
+                      help='对已下载过的图片发送条件请求校验是否更新，而不是直接跳过')
+    parser.add_argument('--queries', type=str, nargs='+', default=None,
+                      help='多个搜索关键词，所选爬虫对每个关键词各运行一个任务')
+    parser.add_argument('--query-file', type=str, default=None,
+                      help='搜索关键词文件，每行一个')
+    parser.add_argument('--miaohua-workers', type=int, default=2,
+                      help='多关键词模式下妙绘AI爬虫的并发进程数')
+    parser.add_argument('--recraft-workers', type=int, default=1,
+                      help='多关键词模式下Recraft爬虫的并发进程数')
+    parser.add_argument('--browser-pool-size', type=int, default=1,
+                      help='每个进程中Recraft浏览器模式可同时使用的浏览器数')
+    parser.add_argument('--browser-max-pages', type=int, default=20,
+                      help='每个浏览器加载多少个页面后重启，限制内存增长')
+    parser.add_argument('--phash-dedup', action='store_true',
+                      help='下载后计算感知哈希，丢弃与已收录图片近似重复的图片')
+    parser.add_argument('--queue', type=str, default=None,
+                      help='共享任务队列文件（放在共享存储上），多个主机的worker从中领取任务；'
+                           '--save-dir需指向同一共享存储上的目录，所有主机写入同一批次目录')
+    parser.add_argument('--queue-role', type=str, choices=['seed', 'worker', 'stats', 'retry-failed'],
+                      default='worker', help='seed写入初始任务，worker领取执行，stats查看进度，'
+                                             'retry-failed重置失败的任务')
+    parser.add_argument('--queue-workers', type=int, default=1, help='本机启动的队列worker进程数')
+    parser.add_argument('--lease-seconds', type=float, default=120, help='任务租约时长（秒），worker定期续约')
+    parser.add_argument('--max-attempts', type=int, default=3, help='单个任务最多尝试次数')
+    parser.add_argument('--metrics-json', type=str, default=None,
+                      help='退出时写入指标汇总的JSON文件')
+    parser.add_argument('--metrics-prom', type=str, default=None,
+                      help='退出时写入的Prometheus文本文件，供textfile collector采集')
     return parser.parse_args()
 
 def main():
     args = parse_args()
+    if args.metrics_json or args.metrics_prom:
+        metrics.enable(json_file=args.metrics_json, prom_file=args.metrics_prom)
     
     # 初始化爬虫管理器
-    manager = SpiderManager(base_dir=args.save_dir)
+    manager = SpiderManager(base_dir=args.save_dir, revalidate=args.revalidate,
+                            incremental=not args.full_crawl,
+                            browser_pool_size=args.browser_pool_size,
+                            browser_max_pages=args.browser_max_pages,
+                            phash_dedup=args.phash_dedup,
+                            shared_storage=bool(args.queue))
     
-    if args.spider == 'all':
-        results = manager.run_all_spiders(
-            miaohua_query=args.miaohua_query,
-            recraft_query=args.recraft_query,
-            miaohua_pages=args.miaohua_pages,
-            recraft_time_limit=args.recraft_time_limit
-        )
-        print("\n所有爬虫运行完成！")
-        for spider_name, save_dir in results.items():
-            print(f"{spider_name} 数据保存在: {save_dir}")
+    queries = list(args.queries or [])
+    if args.query_file:
+        queries.extend(load_queries(args.query_file))
+    
+    try:
+        if args.queue:
+            job_queue = JobQueue(args.queue, lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+            try:
+                if args.queue_role == 'seed':
+                    spiders = ['miaohua', 'recraft'] if args.spider == 'all' else [args.spider]
+                    manager.seed_queue(job_queue, spiders, queries or [args.miaohua_query])
+                elif args.queue_role == 'retry-failed':
+                    print(f"已重置 {job_queue.retry_failed()} 个失败的任务")
+                elif args.queue_role == 'worker':
+                    manager.run_queue_workers(
+                        args.queue,
+                        workers=args.queue_workers,
+                        lease_seconds=args.lease_seconds,
+                        max_attempts=args.max_attempts,
+                        miaohua_pages=args.miaohua_pages,
+                        recraft_time_limit=args.recraft_time_limit,
+                        recraft_mode=args.recraft_mode
+                    )
+                for kind, counts in sorted(job_queue.stats().items()):
+                    print(f"{kind:<6} " + "，".join(f"{status} {count}" for status, count in sorted(counts.items())))
+            finally:
+                job_queue.close()
+
+        elif queries:
+            spiders = ['miaohua', 'recraft'] if args.spider == 'all' else [args.spider]
+            manager.run_jobs(
+                spiders,
+                queries,
+                miaohua_workers=args.miaohua_workers,
+                recraft_workers=args.recraft_workers,
+                miaohua_pages=args.miaohua_pages,
+                recraft_time_limit=args.recraft_time_limit,
+                recraft_mode=args.recraft_mode
+            )
             
-    elif args.spider == 'miaohua':
-        save_dir = manager.run_miaohua_spider(
-            query=args.miaohua_query,
-            pages=args.miaohua_pages
-        )
-        print(f"\n妙绘AI爬虫运行完成！数据保存在: {save_dir}")
+        elif args.spider == 'all':
+            results = manager.run_all_spiders(
+                miaohua_query=args.miaohua_query,
+                recraft_query=args.recraft_query,
+                miaohua_pages=args.miaohua_pages,
+                recraft_time_limit=args.recraft_time_limit,
+                recraft_mode=args.recraft_mode
+            )
+            print("\n所有爬虫运行完成！")
+            for spider_name, save_dir in results.items():
+                print(f"{spider_name} 数据保存在: {save_dir}")
+            
+        elif args.spider == 'miaohua':
+            save_dir = manager.run_miaohua_spider(
+                query=args.miaohua_query,
+                pages=args.miaohua_pages
+            )
+            print(f"\n妙绘AI爬虫运行完成！数据保存在: {save_dir}")
         
-    elif args.spider == 'recraft':
-        save_dir = manager.run_recraft_spider(
-            query=args.recraft_query,
-            time_limit=args.recraft_time_limit
-        )
-        print(f"\nRecraft爬虫运行完成！数据保存在: {save_dir}")
+        elif args.spider == 'recraft':
+            save_dir = manager.run_recraft_spider(
+                query=args.recraft_query,
+                time_limit=args.recraft_time_limit,
+                mode=args.recraft_mode
+            )
+            print(f"\nRecraft爬虫运行完成！数据保存在: {save_dir}")
+    finally:
+        manager.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,119 @@
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# 英文/数字按单词切分，中日韩文字按单字切分
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+# 梅森素数，用于MinHash的线性哈希族
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+# 每个LSH桶内参与比较的分组代表数量上限
+MAX_BUCKET_REPRESENTATIVES = 32
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """小写化并去除标点空白后切分为词元"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def shingles(text: str, size: int = 2) -> set:
+    tokens = normalize_tokens(text)
+    if len(tokens) < size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def choose_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """选择分带数b与每带行数r，使S曲线的拐点 (1/b)^(1/r) 最接近阈值"""
+    best = (num_perm, 1)
+    best_error = float("inf")
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class NearDuplicateFilter:
+    """基于MinHash + LSH的近似重复描述分组，复杂度近似线性，可处理十万级描述"""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, shingle_size: int = 2, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = choose_bands(threshold, num_perm)
+        rng = np.random.RandomState(seed)
+        self.perm_a = rng.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self.perm_b = rng.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: set) -> np.ndarray:
+        """计算MinHash签名，空集合返回全最大值"""
+        if not shingle_set:
+            return np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) for s in shingle_set), dtype=np.uint64, count=len(shingle_set)
+        )
+        # (a*h + b) mod p，h和a均小于2^32，乘积不会溢出uint64
+        values = (np.outer(self.perm_a, hashes) + self.perm_b[:, None]) % MERSENNE_PRIME
+        return (values & MAX_HASH).min(axis=1)
+
+    def group(self, texts: List[str]) -> List[int]:
+        """返回每条文本所属分组的代表下标（组内第一条出现的文本）"""
+        shingle_sets = [shingles(text, self.shingle_size) for text in texts]
+        signatures = np.array([self.signature(s) for s in shingle_sets]) if texts else np.empty((0, self.num_perm))
+
+        parent = list(range(len(texts)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for band in range(self.bands):
+            buckets = defaultdict(list)
+            start = band * self.rows
+            for index, row in enumerate(signatures[:, start:start + self.rows]):
+                # 没有词元的文本无法判断相似度，不参与分组
+                if shingle_sets[index]:
+                    buckets[row.tobytes()].append(index)
+            for members in buckets.values():
+                # 只与桶内已有分组的代表（并查集的根）比较，加入某一组后即停止；
+                # 与第一条不相似的文本仍会和桶内其他分组比较
+                representatives = []
+                for index in members:
+                    root = find(index)
+                    if root in representatives:
+                        continue
+                    a = shingle_sets[index]
+                    for position, representative in enumerate(representatives):
+                        # LSH候选对用精确Jaccard相似度复核
+                        b = shingle_sets[representative]
+                        if len(a & b) / len(a | b) >= self.threshold:
+                            merged = min(root, representative)
+                            parent[max(root, representative)] = merged
+                            representatives[position] = merged
+                            break
+                    else:
+                        # 代表数量有上限，保证退化的大桶中比较次数仍为线性
+                        if len(representatives) < MAX_BUCKET_REPRESENTATIVES:
+                            representatives.append(root)
+
+        return [find(i) for i in range(len(texts))]
+
+    def dedup(self, texts: List[str]) -> Tuple[List[str], Dict[str, List[str]]]:
+        """返回 (代表文本列表, 代表文本 -> 组内全部文本)"""
+        labels = self.group(texts)
+        groups = defaultdict(list)
+        for text, label in zip(texts, labels):
+            groups[texts[label]].append(text)
+        return list(groups.keys()), dict(groups)
+
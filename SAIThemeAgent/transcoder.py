@@ -0,0 +1,157 @@
+import argparse
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+from image_store import IMAGE_EXTENSIONS
+import metrics
+
+FORMAT_EXTENSIONS = {
+    'WEBP': '.webp',
+    'AVIF': '.avif',
+    'PNG': '.png',
+    'JPEG': '.jpg',
+}
+
+
+def transcode_file(src_path, output_dir, fmt='WEBP', quality=85, thumb_size=None):
+    """在子进程中解码、转码并写出一张图片，返回各阶段耗时和字节数"""
+    stats = {
+        'src': src_path,
+        'decode': 0.0,
+        'encode': 0.0,
+        'write': 0.0,
+        'bytes_in': os.path.getsize(src_path),
+        'bytes_out': 0,
+        'error': None,
+    }
+    try:
+        start = time.perf_counter()
+        with Image.open(src_path) as image:
+            image.load()
+            if fmt == 'JPEG' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            elif image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+        stats['decode'] = time.perf_counter() - start
+
+        stem = os.path.splitext(os.path.basename(src_path))[0]
+        ext = FORMAT_EXTENSIONS[fmt]
+        outputs = [(image, stem + ext)]
+        if thumb_size:
+            thumb = image.copy()
+            thumb.thumbnail((thumb_size, thumb_size))
+            outputs.append((thumb, f"{stem}_thumb{thumb_size}{ext}"))
+
+        for output, name in outputs:
+            start = time.perf_counter()
+            buffer = io.BytesIO()
+            output.save(buffer, fmt, quality=quality)
+            stats['encode'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            data = buffer.getvalue()
+            with open(os.path.join(output_dir, name), 'wb') as f:
+                f.write(data)
+            stats['write'] += time.perf_counter() - start
+            stats['bytes_out'] += len(data)
+    except Exception as e:
+        stats['error'] = str(e)
+    return stats
+
+
+def iter_image_files(input_dir):
+    for name in sorted(os.listdir(input_dir)):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+            yield os.path.join(input_dir, name)
+
+
+class Transcoder:
+    """可选的后处理阶段：在进程池中将原始图片转为WebP/AVIF并生成缩略图"""
+
+    def __init__(self, fmt='WEBP', quality=85, thumb_size=None, max_workers=None):
+        fmt = fmt.upper()
+        if fmt not in FORMAT_EXTENSIONS:
+            raise ValueError(f"不支持的输出格式: {fmt}")
+        self.fmt = fmt
+        self.quality = quality
+        self.thumb_size = thumb_size
+        self.max_workers = max_workers
+
+    def run(self, src_paths, output_dir):
+        """批量转码，返回吞吐统计"""
+        os.makedirs(output_dir, exist_ok=True)
+        src_paths = list(src_paths)
+        results = []
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(transcode_file, path, output_dir, self.fmt, self.quality, self.thumb_size)
+                for path in src_paths
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                if result['error']:
+                    print(f"转码失败: {result['src']} {result['error']}")
+                    metrics.inc("transcode_images_total", format=self.fmt, result="failed")
+                else:
+                    # 各阶段耗时在子进程中测得，由主进程记入指标
+                    for stage in ('decode', 'encode', 'write'):
+                        metrics.observe("transcode_stage_seconds", result[stage], format=self.fmt, stage=stage)
+                    metrics.inc("transcode_images_total", format=self.fmt, result="ok")
+                results.append(result)
+        wall = time.perf_counter() - start
+        return self.summarize(results, wall)
+
+    @staticmethod
+    def summarize(results, wall):
+        ok = [r for r in results if not r['error']]
+        decode = sum(r['decode'] for r in ok)
+        encode = sum(r['encode'] for r in ok)
+        write = sum(r['write'] for r in ok)
+        bytes_in = sum(r['bytes_in'] for r in ok)
+        bytes_out = sum(r['bytes_out'] for r in ok)
+        mb = 1024 * 1024
+        return {
+            'images': len(ok),
+            'failed': len(results) - len(ok),
+            'wall_seconds': wall,
+            'images_per_second': len(ok) / wall if wall else 0.0,
+            # 各阶段为所有进程累计的耗时，吞吐按单核计算
+            'decode_seconds': decode,
+            'encode_seconds': encode,
+            'write_seconds': write,
+            'decode_mb_per_second': bytes_in / mb / decode if decode else 0.0,
+            'encode_images_per_second': len(ok) / encode if encode else 0.0,
+            'write_mb_per_second': bytes_out / mb / write if write else 0.0,
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='图片转码后处理')
+    parser.add_argument('input_dir', type=str, help='原始图片目录')
+    parser.add_argument('--output-dir', type=str, default=None,
+                      help='输出目录，默认为 <input_dir>/transcoded')
+    parser.add_argument('--format', type=str, choices=['webp', 'avif', 'png', 'jpeg'], default='webp',
+                      help='输出格式')
+    parser.add_argument('--quality', type=int, default=85, help='编码质量')
+    parser.add_argument('--thumb-size', type=int, default=None, help='缩略图边长，默认不生成')
+    parser.add_argument('--workers', type=int, default=None, help='进程数，默认为CPU核数')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join(args.input_dir, 'transcoded')
+    transcoder = Transcoder(args.format, args.quality, args.thumb_size, args.workers)
+    summary = transcoder.run(iter_image_files(args.input_dir), output_dir)
+
+    print(f"转码完成: {summary['images']} 张，失败 {summary['failed']} 张，"
+          f"耗时 {summary['wall_seconds']:.2f} 秒 ({summary['images_per_second']:.1f} 张/秒)")
+    print(f"解码: {summary['decode_seconds']:.2f} 秒 ({summary['decode_mb_per_second']:.1f} MB/秒)")
+    print(f"编码: {summary['encode_seconds']:.2f} 秒 ({summary['encode_images_per_second']:.1f} 张/秒)")
+    print(f"写入: {summary['write_seconds']:.2f} 秒 ({summary['write_mb_per_second']:.1f} MB/秒)")
+    print(f"体积: {summary['bytes_in'] / 1024 / 1024:.1f} MB -> {summary['bytes_out'] / 1024 / 1024:.1f} MB")
+
+if __name__ == "__main__":
+    main()